@@ -4,19 +4,25 @@
 提供對話 CRUD 和問答功能
 """
 
-from typing import Any, List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import asyncio
+import time
+from typing import Any, Awaitable, List, Optional, Dict, TypeVar
+
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, func
 from sqlalchemy.orm import selectinload
 import json
+import logging
 
 from app.api.deps import get_db, get_current_user
+from app.core.database import AsyncSessionLocal
 from app.models.user import User
 from app.models.group import Group, GroupMember, GroupRole
 from app.models.conversation import Conversation
-from app.models.message import Message, MessageRole
+from app.models.message import Message, MessageRole, MessageStatus
 from app.schemas.chat import (
     ConversationCreate,
     ConversationUpdate,
@@ -31,6 +37,12 @@ from app.schemas.chat import (
     MessageResponseSimple,
 )
 from app.services.rag.chain import rag_chain
+from app.core.config import settings
+
+T = TypeVar("T")
+
+# 用戶端中斷連線（nginx 慣例狀態碼，回應不會被讀取，僅供日誌辨識）
+HTTP_499_CLIENT_CLOSED_REQUEST = 499
 
 # 建立路由器
 router = APIRouter(
@@ -70,6 +82,178 @@ async def check_group_access(
     return member
 
 
+async def get_or_create_conversation(
+    db: AsyncSession,
+    request: ChatRequest,
+    current_user: User
+) -> Conversation:
+    """取得現有對話，或以問題為標題建立新對話"""
+    if request.conversation_id:
+        # 使用現有對話
+        conv_result = await db.execute(
+            select(Conversation)
+            .options(selectinload(Conversation.messages))
+            .where(
+                and_(
+                    Conversation.id == request.conversation_id,
+                    Conversation.user_id == current_user.id
+                )
+            )
+        )
+        conversation = conv_result.scalar_one_or_none()
+
+        if not conversation:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="對話不存在"
+            )
+        return conversation
+
+    # 建立新對話
+    conversation = Conversation(
+        user_id=current_user.id,
+        group_id=request.group_id,
+        title=request.question[:50] + "..." if len(request.question) > 50 else request.question,
+        message_count=0
+    )
+    db.add(conversation)
+    await db.flush()
+    return conversation
+
+
+async def load_conversation_history(
+    db: AsyncSession,
+    conversation_id: int,
+    limit: int = None
+) -> List[Dict[str, str]]:
+    """
+    取得對話最近的訊息（依時間排序，不含被取消的問答）
+
+    PROMPT_LAYOUT 為 stable 時，視窗起點以固定步長（limit - 2）跳動，
+    而不是每輪滑動一則：數輪內歷史前綴逐字不變，Ollama 可重用 KV 快取
+    """
+    limit = limit or settings.CHAT_HISTORY_MESSAGES
+    completed = and_(
+        Message.conversation_id == conversation_id,
+        Message.status == MessageStatus.COMPLETED
+    )
+
+    if settings.PROMPT_LAYOUT == "stable":
+        total_result = await db.execute(
+            select(func.count(Message.id)).where(completed)
+        )
+        total = total_result.scalar() or 0
+        step = max(2, limit - 2)
+        start = 0 if total <= limit else -(-(total - limit) // step) * step
+
+        # 重新查詢訊息以避免 lazy loading 問題
+        msg_result = await db.execute(
+            select(Message)
+            .where(completed)
+            .order_by(Message.created_at, Message.id)
+            .offset(start)
+            .limit(limit)
+        )
+        return [
+            {"role": msg.role.value, "content": msg.content}
+            for msg in msg_result.scalars().all()
+        ]
+
+    # 重新查詢訊息以避免 lazy loading 問題
+    msg_result = await db.execute(
+        select(Message)
+        .where(completed)
+        .order_by(Message.created_at.desc())
+        .limit(limit)
+    )
+    history_messages = msg_result.scalars().all()
+    return [
+        {"role": msg.role.value, "content": msg.content}
+        for msg in reversed(history_messages)
+    ]
+
+
+def sse_event(event: str, data: Any) -> str:
+    """格式化 Server-Sent Events 訊息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class ClientDisconnected(Exception):
+    """用戶端在生成完成前中斷連線"""
+
+
+async def run_until_disconnected(http_request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    執行 awaitable，期間定期檢查用戶端是否已中斷連線
+
+    非串流端點不會因用戶端離開而被取消，需主動輪詢；
+    中斷時取消執行中的任務（關閉上游 LLM 請求並釋放生成名額）
+
+    Raises:
+        ClientDisconnected: 用戶端已中斷連線
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.CLIENT_DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+async def save_stream_messages(
+    conversation_id: int,
+    question: str,
+    content: str,
+    sources: List[Dict[str, Any]],
+    token_count: Optional[int],
+    generation_time: float,
+    model_used: Optional[str],
+    message_status: MessageStatus
+) -> int:
+    """
+    儲存串流問答的使用者與助手訊息
+
+    串流回應期間請求的 db session 已結束，使用獨立 session
+    使用者訊息與助手訊息使用相同狀態：被取消的問答整組不列入對話歷史
+
+    Returns:
+        int: 助手訊息 ID
+    """
+    async with AsyncSessionLocal() as session:
+        session.add(Message(
+            conversation_id=conversation_id,
+            role=MessageRole.USER,
+            content=question,
+            status=message_status
+        ))
+        assistant_message = Message(
+            conversation_id=conversation_id,
+            role=MessageRole.ASSISTANT,
+            content=content,
+            sources=sources,
+            token_count=token_count,
+            generation_time=generation_time,
+            model_used=model_used,
+            status=message_status
+        )
+        session.add(assistant_message)
+
+        stored_conversation = await session.get(Conversation, conversation_id)
+        if stored_conversation:
+            stored_conversation.message_count += 2
+        await session.commit()
+        return assistant_message.id
+
+
 # ============================================
 # 對話 CRUD API
 # ============================================
@@ -235,6 +419,7 @@ async def get_conversation(
             token_count=m.token_count,
             generation_time=m.generation_time,
             model_used=m.model_used,
+            status=m.status,
             created_at=m.created_at
         )
         for m in sorted(conversation.messages, key=lambda x: x.created_at)
@@ -360,48 +545,23 @@ async def delete_conversation(
     4. 呼叫 LLM 生成答案
     5. 儲存問答記錄
     6. 返回答案和來源
+
+    用戶端在生成完成前中斷連線時，取消 LLM 呼叫並記錄為已取消的助手訊息
     """
 )
 async def ask_question(
     request: ChatRequest,
+    http_request: Request,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ) -> Any:
     """問答"""
 
     # 1. 檢查群組存取權限
-    await check_group_access(db, current_user.id, request.group_id)
+    member = await check_group_access(db, current_user.id, request.group_id)
 
     # 2. 取得或建立對話
-    if request.conversation_id:
-        # 使用現有對話
-        conv_result = await db.execute(
-            select(Conversation)
-            .options(selectinload(Conversation.messages))
-            .where(
-                and_(
-                    Conversation.id == request.conversation_id,
-                    Conversation.user_id == current_user.id
-                )
-            )
-        )
-        conversation = conv_result.scalar_one_or_none()
-
-        if not conversation:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="對話不存在"
-            )
-    else:
-        # 建立新對話
-        conversation = Conversation(
-            user_id=current_user.id,
-            group_id=request.group_id,
-            title=request.question[:50] + "..." if len(request.question) > 50 else request.question,
-            message_count=0
-        )
-        db.add(conversation)
-        await db.flush()
+    conversation = await get_or_create_conversation(db, request, current_user)
 
     # 3. 建立使用者訊息
     user_message = Message(
@@ -416,28 +576,34 @@ async def ask_question(
     conversation_history = []
     if request.conversation_id:
         # 只有現有對話才有歷史訊息
-        # 重新查詢訊息以避免 lazy loading 問題
-        msg_result = await db.execute(
-            select(Message)
-            .where(Message.conversation_id == conversation.id)
-            .order_by(Message.created_at.desc())
-            .limit(6)
-        )
-        history_messages = msg_result.scalars().all()
-        for msg in reversed(history_messages):
-            conversation_history.append({
-                "role": msg.role.value,
-                "content": msg.content
-            })
-
-    # 5. 呼叫 RAG Chain
+        conversation_history = await load_conversation_history(db, conversation.id)
+
+    # 5. 呼叫 RAG Chain（用戶端中斷連線時取消）
+    started = time.perf_counter()
     try:
-        rag_response = await rag_chain.query(
+        rag_response = await run_until_disconnected(http_request, rag_chain.query(
             question=request.question,
             group_id=request.group_id,
             document_ids=request.document_ids,
             conversation_history=conversation_history,
-            llm_provider=request.llm_provider
+            llm_provider=request.llm_provider,
+            access_scope=member.role.value
+        ))
+    except ClientDisconnected:
+        # 問題沒有得到回答，不列入之後的對話歷史（避免歷史中出現連續的使用者訊息）
+        user_message.status = MessageStatus.CANCELLED
+        db.add(Message(
+            conversation_id=conversation.id,
+            role=MessageRole.ASSISTANT,
+            content="",
+            generation_time=round(time.perf_counter() - started, 3),
+            status=MessageStatus.CANCELLED
+        ))
+        conversation.message_count += 1
+        await db.commit()
+        raise HTTPException(
+            status_code=HTTP_499_CLIENT_CLOSED_REQUEST,
+            detail="用戶端已中斷連線，生成已取消"
         )
     except Exception as e:
         raise HTTPException(
@@ -451,6 +617,7 @@ async def ask_question(
             "document_id": s["document_id"],
             "document_name": s["document_name"],
             "chunk_index": s.get("chunk_index"),
+            "chunk_indices": s.get("chunk_indices"),
             "content": s["content"],
             "score": s["score"]
         }
@@ -482,6 +649,7 @@ async def ask_question(
                 document_id=s["document_id"],
                 document_name=s["document_name"],
                 chunk_index=s.get("chunk_index"),
+                chunk_indices=s.get("chunk_indices"),
                 content=s["content"],
                 score=s["score"]
             )
@@ -493,6 +661,149 @@ async def ask_question(
     )
 
 
+@router.post(
+    "/ask/stream",
+    summary="串流問答",
+    description="""
+    向 RAG 系統提問，以 Server-Sent Events 串流返回答案
+
+    事件順序：
+    1. meta: {conversation_id}
+    2. sources: 檢索到的來源（生成前送出）
+    3. delta: {content} 答案片段（多次）
+    4. done: {message_id, generation_time, time_to_first_token, token_count,
+       prefill_time, prompt_cache_ratio, context_tokens}
+       或 error: {detail}
+
+    業務邏輯：
+    - 權限檢查與對話建立在串流開始前完成
+    - 串流結束後才儲存使用者與助手訊息（含 token 數與耗時）
+    - 用戶端中斷連線時立即關閉上游 LLM 串流並釋放生成名額，
+      已生成的部分內容以 cancelled 狀態保存
+    """
+)
+async def ask_question_stream(
+    request: ChatRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """串流問答"""
+
+    # 1. 檢查群組存取權限
+    await check_group_access(db, current_user.id, request.group_id)
+
+    # 2. 取得或建立對話（先提交，讓串流開始時即有 conversation_id）
+    conversation = await get_or_create_conversation(db, request, current_user)
+    conversation_id = conversation.id
+
+    # 3. 取得對話歷史
+    conversation_history = []
+    if request.conversation_id:
+        conversation_history = await load_conversation_history(db, conversation_id)
+    await db.commit()
+
+    async def event_stream():
+        started = time.perf_counter()
+        first_token_at = None
+        parts: List[str] = []
+        sources: List[Dict[str, Any]] = []
+        usage: Dict[str, Any] = {}
+
+        yield sse_event("meta", {"conversation_id": conversation_id})
+
+        stream = rag_chain.query_stream(
+            question=request.question,
+            group_id=request.group_id,
+            document_ids=request.document_ids,
+            conversation_history=conversation_history,
+            llm_provider=request.llm_provider
+        )
+        try:
+            async for event in stream:
+                if isinstance(event, dict):
+                    if event.get("type") == "sources":
+                        sources = event["data"]
+                        usage["model"] = event.get("model")
+                        yield sse_event("sources", {
+                            "sources": sources,
+                            "confidence": event.get("confidence", 0.0)
+                        })
+                    elif event.get("type") == "usage":
+                        usage = event["data"]
+                    continue
+
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(event)
+                yield sse_event("delta", {"content": event})
+        except (asyncio.CancelledError, GeneratorExit):
+            # 用戶端中斷連線：Starlette 取消串流任務，或在 yield 處關閉此產生器
+            # 屏蔽取消，確保上游串流已關閉（釋放生成名額）且部分內容已保存
+            with anyio.CancelScope(shield=True):
+                await stream.aclose()
+                try:
+                    await save_stream_messages(
+                        conversation_id=conversation_id,
+                        question=request.question,
+                        content="".join(parts),
+                        sources=sources,
+                        token_count=len(parts),
+                        generation_time=round(time.perf_counter() - started, 3),
+                        model_used=usage.get("model"),
+                        message_status=MessageStatus.CANCELLED
+                    )
+                except Exception as e:
+                    logging.warning(f"Failed to save cancelled message for conversation {conversation_id}: {e}")
+            logging.info(
+                f"Chat stream cancelled by client: conversation {conversation_id}, "
+                f"{len(parts)} chunks generated"
+            )
+            raise
+        except Exception as e:
+            yield sse_event("error", {"detail": f"RAG 查詢失敗: {str(e)}"})
+            return
+
+        generation_time = round(time.perf_counter() - started, 3)
+        time_to_first_token = round(first_token_at - started, 3) if first_token_at else None
+        # 未取得模型統計時，以串流片段數估算（Ollama 約每個 token 一個片段）
+        token_count = usage.get("total_tokens") or len(parts)
+
+        # 4. 儲存使用者與助手訊息
+        message_id = await save_stream_messages(
+            conversation_id=conversation_id,
+            question=request.question,
+            content="".join(parts),
+            sources=sources,
+            token_count=token_count,
+            generation_time=generation_time,
+            model_used=usage.get("model"),
+            message_status=MessageStatus.COMPLETED
+        )
+
+        yield sse_event("done", {
+            "conversation_id": conversation_id,
+            "message_id": message_id,
+            "model": usage.get("model"),
+            "generation_time": generation_time,
+            "time_to_first_token": time_to_first_token,
+            "token_count": token_count,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "prefill_time": usage.get("prefill_time"),
+            "prompt_cache_ratio": usage.get("prompt_cache_ratio"),
+            "context_tokens": usage.get("context_tokens")
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 避免反向代理緩衝
+        }
+    )
+
+
 @router.get(
     "/providers",
     summary="取得可用的 LLM 提供者",
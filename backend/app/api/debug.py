@@ -11,6 +11,12 @@ from app.api.deps import get_current_user
 from app.models.user import User
 from app.services.rag.vectorstore import vectorstore_service
 from app.services.rag.embedder import embedding_service
+from app.services.rag.retriever import retriever_service
+from app.services.rag.chain import rag_chain
+from app.services.llm.concurrency import generation_limiter
+from app.services.llm.ollama_service import OllamaService
+from app.services.document.job_queue import ingestion_queue
+from app.services.document.ingestion_worker import ingestion_workers
 from app.core.config import settings
 
 
@@ -44,8 +50,19 @@ async def get_chroma_status() -> Any:
             "collection_name": vectorstore_service.collection_name,
             "collection_id": collection_id,
             "vector_count": count,
+            "sharding": getattr(vectorstore_service, "sharding", "none"),
             "chroma_url": vectorstore_service.base_url,
             "embedding_model": embedding_service.model,
+            "embedding_cache": embedding_service.cache_stats(),
+            "query_embedding_cache": embedding_service.query_cache_stats(),
+            "query_embedding_batcher": embedding_service.query_batcher_stats(),
+            "retrieval_cache": retriever_service.cache.stats() if retriever_service.cache else None,
+            "document_pruning": retriever_service.documents.stats() if retriever_service.pruning else None,
+            "answer_cache": rag_chain.answer_cache.stats() if rag_chain.answer_cache else None,
+            "llm_generation": generation_limiter.stats(),
+            "ollama_prefill": OllamaService.prefill_stats(),
+            "ingestion_jobs": await ingestion_queue.stats(),
+            "ingestion_workers": ingestion_workers.stats(),
             "settings": {
                 "chunk_size": settings.CHUNK_SIZE,
                 "chunk_overlap": settings.CHUNK_OVERLAP,
@@ -5,14 +5,15 @@
 僅支援 txt 和 md 格式
 """
 
+import hashlib
 import os
 import uuid
 import aiofiles
 from pathlib import Path
-from typing import Any, List, Optional
+from typing import Any, List, Optional, Tuple
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Form, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Form
 from fastapi.responses import FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, func
@@ -33,7 +34,7 @@ from app.schemas.document import (
     MessageResponse,
     UploadResponse,
 )
-from app.services.document.processor import DocumentProcessor
+from app.services.document.job_queue import ingestion_queue
 
 # 建立路由器
 router = APIRouter(
@@ -60,6 +61,72 @@ def generate_unique_filename(original_filename: str) -> str:
     return f"{timestamp}_{unique_id}.{ext}"
 
 
+async def save_upload_stream(
+    file: UploadFile,
+    target_dir: Path,
+    filename: str
+) -> Tuple[Path, int, str]:
+    """
+    逐塊儲存上傳檔案
+
+    業務邏輯：
+    - 每次讀取 UPLOAD_BLOCK_SIZE 寫入同目錄的暫存檔，記憶體用量與檔案大小無關
+    - 累計大小超過 MAX_FILE_SIZE 時立即中止並刪除暫存檔
+    - 寫入時同時計算 SHA-256
+    - 完成後以 os.replace 原子地移到目標路徑（不會留下寫到一半的文件）
+
+    Args:
+        file: 上傳檔案
+        target_dir: 目標目錄（UPLOAD_DIR/<group_id>）
+        filename: 儲存檔名
+
+    Returns:
+        Tuple[Path, int, str]: (檔案路徑, 檔案大小, SHA-256 hex)
+
+    Raises:
+        HTTPException: 檔案過大、空檔案（400）或寫入失敗（500）
+    """
+    target_dir.mkdir(parents=True, exist_ok=True)
+    file_path = target_dir / filename
+    temp_path = target_dir / f".{filename}.part"
+    digest = hashlib.sha256()
+    file_size = 0
+
+    try:
+        async with aiofiles.open(temp_path, "wb") as f:
+            while True:
+                block = await file.read(settings.UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                file_size += len(block)
+                if file_size > settings.MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"檔案大小超過限制。最大: {settings.MAX_FILE_SIZE // 1024 // 1024}MB"
+                    )
+                digest.update(block)
+                await f.write(block)
+
+        if file_size == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="不能上傳空檔案"
+            )
+
+        os.replace(temp_path, file_path)
+    except HTTPException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    except Exception as e:
+        temp_path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"檔案儲存失敗: {str(e)}"
+        )
+
+    return file_path, file_size, digest.hexdigest()
+
+
 async def check_group_permission(
     db: AsyncSession,
     user_id: int,
@@ -126,30 +193,6 @@ def can_view_document(member_role: GroupRole, doc_min_role: DocumentRole) -> boo
     return role_hierarchy[member_role.value] >= role_hierarchy[doc_min_role.value]
 
 
-# ============================================
-# 文件處理後台任務
-# ============================================
-
-async def process_document_task(document_id: int):
-    """後台處理文件任務"""
-    import logging
-    from app.core.database import AsyncSessionLocal
-    
-    logging.info(f"Starting document processing for document_id={document_id}")
-    
-    processor = DocumentProcessor()
-    try:
-        # 創建獨立的資料庫 session
-        async with AsyncSessionLocal() as db:
-            result = await processor.process_document(db, document_id)
-            if result.success:
-                logging.info(f"Document processing completed for document_id={document_id}, chunks={result.chunk_count}")
-            else:
-                logging.error(f"Document processing failed for document_id={document_id}: {result.error_message}")
-    except Exception as e:
-        logging.error(f"Document processing failed for document_id={document_id}: {e}")
-
-
 # ============================================
 # 文件上傳 API
 # ============================================
@@ -164,19 +207,17 @@ async def process_document_task(document_id: int):
 
     業務邏輯：
     1. 驗證檔案類型（僅支援 txt/md）
-    2. 驗證檔案大小
-    3. 驗證使用者在群組中的權限（需要 editor 以上）
-    4. 儲存檔案到本地
-    5. 建立文件記錄（狀態為 pending）
-    6. 觸發後台處理（分塊、向量化）
+    2. 驗證使用者在群組中的權限（需要 editor 以上）
+    3. 逐塊寫入暫存檔並驗證檔案大小、計算 SHA-256，完成後原子地移到群組目錄
+    4. 建立文件記錄（狀態為 pending）與入庫工作（同一個交易）
+    5. 由入庫 worker 從工作佇列取得並處理（分塊、向量化）
 
     注意：
     - 使用 multipart/form-data 格式
-    - 最大檔案大小由 MAX_FILE_SIZE 設定控制
+    - 最大檔案大小由 MAX_FILE_SIZE 設定控制（超過時返回 400；Content-Length 已超過時返回 413）
     """
 )
 async def upload_document(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(..., description="要上傳的文件"),
     group_id: int = Form(..., description="目標群組 ID"),
     min_view_role: DocumentRole = Form(
@@ -196,23 +237,7 @@ async def upload_document(
             detail=f"不支援的檔案類型: {file_ext}。僅支援: {', '.join(settings.ALLOWED_FILE_TYPES)}"
         )
 
-    # 2. 驗證檔案大小（讀取檔案內容來計算）
-    content = await file.read()
-    file_size = len(content)
-
-    if file_size > settings.MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"檔案大小超過限制。最大: {settings.MAX_FILE_SIZE // 1024 // 1024}MB"
-        )
-
-    if file_size == 0:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="不能上傳空檔案"
-        )
-
-    # 3. 檢查群組是否存在
+    # 2. 檢查群組是否存在
     group_result = await db.execute(
         select(Group).where(Group.id == group_id)
     )
@@ -224,23 +249,16 @@ async def upload_document(
             detail="群組不存在"
         )
 
-    # 4. 檢查使用者權限（需要 editor 以上）
+    # 3. 檢查使用者權限（需要 editor 以上）
     await check_group_permission(db, current_user.id, group_id, GroupRole.EDITOR)
 
-    # 5. 生成唯一檔名並儲存
+    # 4-5. 逐塊儲存檔案，同時驗證檔案大小並計算雜湊
     unique_filename = generate_unique_filename(file.filename)
-    group_storage_dir = Path(settings.UPLOAD_DIR) / str(group_id)
-    group_storage_dir.mkdir(parents=True, exist_ok=True)
-    file_path = group_storage_dir / unique_filename
-
-    try:
-        async with aiofiles.open(file_path, "wb") as f:
-            await f.write(content)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"檔案儲存失敗: {str(e)}"
-        )
+    file_path, file_size, content_sha256 = await save_upload_stream(
+        file,
+        Path(settings.UPLOAD_DIR) / str(group_id),
+        unique_filename
+    )
 
     # 6. 建立文件記錄
     new_document = Document(
@@ -248,6 +266,7 @@ async def upload_document(
         original_filename=file.filename,
         file_type=file_ext,
         file_size=file_size,
+        content_sha256=content_sha256,
         file_path=str(file_path),
         group_id=group_id,
         uploader_id=current_user.id,
@@ -257,15 +276,17 @@ async def upload_document(
         page_count=0
     )
     db.add(new_document)
+    await db.flush()
 
     # 7. 更新群組文件數
     group.document_count += 1
 
+    # 8. 建立入庫工作（與文件記錄一起提交，行程重啟也不會遺失）
+    ingestion_queue.enqueue(db, new_document.id)
+
     await db.commit()
     await db.refresh(new_document)
-
-    # 8. 觸發後台處理
-    background_tasks.add_task(process_document_task, new_document.id)
+    ingestion_queue.notify()
 
     return UploadResponse(
         message="文件上傳成功，正在處理中",
@@ -275,6 +296,7 @@ async def upload_document(
             original_filename=new_document.original_filename,
             file_type=new_document.file_type,
             file_size=new_document.file_size,
+            content_sha256=new_document.content_sha256,
             group_id=new_document.group_id,
             uploader_id=new_document.uploader_id,
             uploader_username=current_user.username,
@@ -376,6 +398,7 @@ async def list_documents(
             original_filename=doc.original_filename,
             file_type=doc.file_type,
             file_size=doc.file_size,
+            content_sha256=doc.content_sha256,
             group_id=doc.group_id,
             uploader_id=doc.uploader_id,
             uploader_username=doc.uploader.username if doc.uploader else None,
@@ -441,6 +464,7 @@ async def get_document(
         original_filename=document.original_filename,
         file_type=document.file_type,
         file_size=document.file_size,
+        content_sha256=document.content_sha256,
         group_id=document.group_id,
         uploader_id=document.uploader_id,
         uploader_username=document.uploader.username if document.uploader else None,
@@ -572,6 +596,7 @@ async def update_document(
         original_filename=document.original_filename,
         file_type=document.file_type,
         file_size=document.file_size,
+        content_sha256=document.content_sha256,
         group_id=document.group_id,
         uploader_id=document.uploader_id,
         uploader_username=document.uploader.username if document.uploader else None,
@@ -646,21 +671,49 @@ async def delete_document(
     # 4. 刪除向量庫資料
     try:
         from app.services.rag.vectorstore import vectorstore_service
-        # 使用 document_id 過濾並刪除所有相關的 chunks
-        await vectorstore_service.delete_by_filter({"document_id": document_id})
+        # 使用 document_id 過濾並刪除所有相關的 chunks（帶 group_id 以路由到對應分片）
+        await vectorstore_service.delete_by_filter({
+            "$and": [
+                {"document_id": {"$eq": document_id}},
+                {"group_id": {"$eq": document.group_id}}
+            ]
+        })
         print(f"已刪除文件 {document_id} 的向量資料")
     except Exception as e:
         print(f"刪除向量資料失敗: {e}")
 
+    try:
+        from app.services.rag.lexical_index import lexical_index_service
+        await lexical_index_service.delete_document(document.group_id, document_id)
+    except Exception as e:
+        print(f"刪除詞彙索引失敗: {e}")
+
+    try:
+        from app.services.rag.parent_store import parent_store
+        await parent_store.delete_document(document_id)
+    except Exception as e:
+        print(f"刪除父段落失敗: {e}")
+
+    try:
+        from app.services.rag.document_index import document_centroid_index
+        await document_centroid_index.delete_document(document_id)
+    except Exception as e:
+        print(f"刪除文件中心向量失敗: {e}")
+
     # 4. 更新群組文件數
     if document.group:
         document.group.document_count -= 1
 
     # 5. 刪除資料庫記錄
     original_filename = document.original_filename
+    group_id = document.group_id
     await db.delete(document)
     await db.commit()
 
+    # 6. 使群組的檢索快取失效
+    from app.services.rag.retrieval_cache import index_versions
+    await index_versions.bump(group_id)
+
     return MessageResponse(
         message="文件已刪除",
         detail=f"文件 '{original_filename}' 已成功刪除"
@@ -13,6 +13,7 @@ from sqlalchemy.orm import selectinload
 from app.api.deps import get_db, get_current_user
 from app.models.user import User
 from app.models.group import Group, GroupMember, GroupRole
+from app.services.rag.retrieval_cache import index_versions
 from app.schemas.group import (
     GroupCreate,
     GroupUpdate,
@@ -318,6 +319,9 @@ async def delete_group(
     await db.delete(group)
     await db.commit()
 
+    # 4. 使群組的檢索快取失效
+    await index_versions.bump(group_id)
+
     return MessageResponse(
         message="群組已刪除",
         detail=f"群組 '{group.name}' 已成功刪除"
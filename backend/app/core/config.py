@@ -58,6 +58,8 @@ class Settings(BaseSettings):
     # LLM 提供者選擇
     # ============================================
     LLM_PROVIDER: str = "ollama"  # ollama 或 gemini
+    LLM_MAX_CONCURRENT_GENERATIONS: int = 4  # 同時進行的 LLM 生成數上限（超過者排隊）
+    CLIENT_DISCONNECT_POLL_INTERVAL: float = 0.5  # 非串流問答檢查用戶端是否中斷連線的間隔（秒）
 
     # ============================================
     # Ollama LLM 配置 (本地模型)
@@ -65,6 +67,11 @@ class Settings(BaseSettings):
     OLLAMA_BASE_URL: str = "http://ollama:11434"
     OLLAMA_MODEL: str = "gpt-oss-20b"
     OLLAMA_TEMPERATURE: float = 0.3  # 0.0 = 確定性, 1.0 = 創造性
+    OLLAMA_KEEP_ALIVE: str = "30m"  # 模型與 KV 快取在記憶體保留的時間（空字串 = Ollama 預設 5m）
+    OLLAMA_NUM_CTX: int = 0  # 固定的 context 長度（0 = 依組裝後的 prompt 自動決定）
+    OLLAMA_NUM_CTX_MIN: int = 4096  # 自動決定時的下限
+    OLLAMA_NUM_CTX_MAX: int = 32768  # 自動決定時的上限
+    OLLAMA_NUM_PREDICT_RESERVE: int = 1024  # 自動決定時為回答保留的 token 數（未設定 max_tokens 時）
 
     # ============================================
     # Gemini API 配置 (雲端模型)
@@ -78,6 +85,32 @@ class Settings(BaseSettings):
     # ============================================
     EMBEDDING_MODEL: str = "nomic-embed-text"  # Ollama 模型名稱
     EMBEDDING_DEVICE: str = "cpu"  # cpu 或 cuda
+    EMBEDDING_BATCH_SIZE: int = 64  # 每次 /api/embed 請求送出的文本數
+    EMBEDDING_CONCURRENCY: int = 4  # 同時進行中的批次請求數
+    EMBEDDING_MAX_RETRIES: int = 3  # 單一批次失敗時的重試次數
+    EMBEDDING_CACHE_ENABLED: bool = True  # 持久化 embedding 快取
+    EMBEDDING_CACHE_PATH: str = "./storage/cache/embeddings.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 200000  # 超過後以 LRU 淘汰
+    QUERY_EMBEDDING_CACHE_ENABLED: bool = True  # 查詢向量 LRU + TTL 快取
+    QUERY_EMBEDDING_CACHE_MAX_ENTRIES: int = 2048
+    QUERY_EMBEDDING_CACHE_MAX_BYTES: int = 67108864  # 64MB（估算值）
+    QUERY_EMBEDDING_CACHE_TTL: float = 3600.0  # 秒
+    QUERY_EMBEDDING_CACHE_SHARED: bool = False  # 多個 worker 透過 SQLite 共用
+    QUERY_EMBEDDING_CACHE_PATH: str = "./storage/cache/query_embeddings.sqlite3"
+    EMBEDDING_QUERY_BATCH_ENABLED: bool = True  # 併發查詢微批次
+    EMBEDDING_QUERY_BATCH_WINDOW_MS: float = 5.0  # 收集窗口（毫秒）
+    EMBEDDING_QUERY_BATCH_MAX_SIZE: int = 32  # 單批最大查詢數
+
+    # ============================================
+    # 向量資料庫後端選擇
+    # ============================================
+    VECTOR_STORE_BACKEND: str = "chroma"  # chroma (遠端伺服器) 或 numpy (行程內)
+    NUMPY_STORE_DIR: str = "./storage/vectors"  # numpy 後端的資料目錄
+    VECTOR_INDEX_TYPE: str = "flat"  # numpy 後端索引: flat (精確) 或 ivf (近似)
+    IVF_NLIST: int = 0  # IVF 群數，0 = 自動 (約 4 * sqrt(n))
+    IVF_NPROBE: int = 8  # 查詢時掃描的群數 (越大召回越高、越慢)
+    IVF_MIN_SIZE: int = 20000  # 群組向量數達此值才建立 IVF 索引
+    IVF_REBUILD_GROWTH: float = 2.0  # 資料量成長超過訓練時的倍數即背景重建
 
     # ============================================
     # Chroma 向量資料庫配置 (伺服器模式)
@@ -85,6 +118,23 @@ class Settings(BaseSettings):
     CHROMA_HOST: str = "chroma"
     CHROMA_PORT: int = 8000
     CHROMA_COLLECTION_NAME: str = "library_documents"
+    CHROMA_SHARDING: str = "none"  # none (單一 collection) / group (每群組一個) / bucket (雜湊桶)
+    CHROMA_SHARD_BUCKETS: int = 16  # bucket 模式的桶數
+    INGEST_UPSERT_BATCH_SIZE: int = 256  # 文件入庫時每批向量化 + 寫入的 chunk 數
+    INGEST_UPSERT_MAX_RETRIES: int = 3  # 寫入向量庫失敗時的重試次數
+    INGEST_STREAMING_THRESHOLD: int = 4194304  # 4MB - 檔案達此大小 (bytes) 時串流解析與分塊；0 = 一律串流，-1 = 停用
+
+    # ============================================
+    # 文件入庫工作佇列 (ingestion_jobs 資料表)
+    # ============================================
+    INGEST_WORKERS_ENABLED: bool = True  # 是否在 API 行程內啟動入庫 worker（改用 python -m app.worker 時設為 false）
+    INGEST_CONCURRENCY: int = 2  # 每個行程同時處理的文件數
+    INGEST_JOB_POLL_INTERVAL: float = 2.0  # 沒有工作時的輪詢間隔（秒）
+    INGEST_JOB_LEASE_SECONDS: float = 300.0  # 工作租約長度（秒），worker 當機時過期後由他人接手
+    INGEST_JOB_HEARTBEAT_SECONDS: float = 30.0  # 處理期間延長租約的間隔（秒）
+    INGEST_JOB_MAX_ATTEMPTS: int = 3  # 最大嘗試次數
+    INGEST_JOB_RETRY_BACKOFF: float = 30.0  # 第一次重試的等待秒數（之後每次加倍）
+    INGEST_CPU_WORKERS: int = 2  # 獨立 worker 行程中解析 + 分塊使用的子行程數（0 = 使用執行緒）
 
     @property
     def CHROMA_SERVER_URL(self) -> str:
@@ -98,12 +148,24 @@ class Settings(BaseSettings):
         """
         return f"http://{self.CHROMA_HOST}:{self.CHROMA_PORT}"
 
+    # ============================================
+    # 上游 HTTP 連線池配置
+    # ============================================
+    OLLAMA_HTTP_MAX_CONNECTIONS: int = 20  # Ollama 連線池上限
+    CHROMA_HTTP_MAX_CONNECTIONS: int = 20  # Chroma 連線池上限
+    GEMINI_HTTP_MAX_CONNECTIONS: int = 20  # Gemini 連線池上限
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10  # 每個連線池保留的閒置連線數
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0  # 閒置連線保留時間（秒）
+    HTTP_CONNECT_TIMEOUT: float = 5.0  # 建立連線的超時時間（秒）
+    GEMINI_HTTP2: bool = True  # Gemini 使用 HTTP/2（需安裝 h2）
+
     # ============================================
     # 文件上傳配置 (簡化：僅支援純文字格式)
     # ============================================
     UPLOAD_DIR: str = "./storage/documents"
     MAX_FILE_SIZE: int = 10485760  # 10MB (bytes) - 純文字檔案通常較小
     ALLOWED_FILE_TYPES: set = {"txt", "md"}  # 僅支援 txt 和 markdown
+    UPLOAD_BLOCK_SIZE: int = 1048576  # 1MB - 上傳時每次讀取並寫入磁碟的大小 (每個上傳的記憶體用量)
 
     # ============================================
     # RAG 配置 (優化版)
@@ -112,6 +174,54 @@ class Settings(BaseSettings):
     CHUNK_OVERLAP: int = 200  # chunk 之間的重疊字元數 (增大以保持語意連貫)
     TOP_K_RETRIEVAL: int = 8  # 檢索時返回的文件數量 (增加以提供更多相關內容)
 
+    # 父子分塊 (小的子塊做向量比對，檢索時換成所屬的大段落；需重新處理文件才會生效)
+    HIERARCHICAL_CHUNKING_ENABLED: bool = False
+    PARENT_CHUNK_SIZE: int = 2400  # 父段落字元數 (送入 prompt 的單位)
+    CHILD_CHUNK_SIZE: int = 400  # 子塊字元數 (向量化的單位)
+    CHILD_CHUNK_OVERLAP: int = 80  # 子塊之間的重疊字元數
+    PARENT_STORE_PATH: str = "./storage/parents.sqlite3"  # 父段落儲存 (不進入向量庫)
+
+    # 混合檢索 (BM25 + 向量，以 RRF 融合)
+    HYBRID_SEARCH_ENABLED: bool = True  # 是否同時使用 BM25 詞彙檢索
+    LEXICAL_INDEX_DIR: str = "./storage/lexical"  # BM25 倒排索引目錄 (每群組一個檔案)
+    HYBRID_RRF_K: int = 60  # RRF 常數 (越大排名差異的影響越小)
+    HYBRID_VECTOR_WEIGHT: float = 1.0  # 向量檢索排名的權重
+    HYBRID_BM25_WEIGHT: float = 1.0  # BM25 檢索排名的權重
+
+    # 檢索結果快取 (群組索引版本改變時失效)
+    RETRIEVAL_CACHE_ENABLED: bool = True
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 1024  # 最大快取筆數
+    RETRIEVAL_CACHE_MAX_BYTES: int = 33554432  # 最大記憶體用量 (估算，32MB)
+    RETRIEVAL_CACHE_TTL: float = 600.0  # 存活時間 (秒)
+    INDEX_VERSION_PATH: str = "./storage/cache/index_versions.sqlite3"  # 群組索引版本 (多 worker 共用)
+
+    # 兩階段檢索 (先以文件中心向量挑出前 M 份文件，再只搜尋這些文件的切片)
+    DOCUMENT_PRUNING_ENABLED: bool = False  # 先以文件中心向量挑出相關文件 (未保存中心向量的文件一律搜尋)
+    DOCUMENT_PRUNING_TOP_M: int = 50  # 第二階段搜尋的文件數
+    DOCUMENT_PRUNING_MIN_DOCUMENTS: int = 200  # 群組文件數超過此值才剪枝
+    DOCUMENT_CENTROIDS_PER_DOC: int = 1  # 每份文件的中心向量數 (>1 時以 k-means 分群)
+    DOCUMENT_CENTROID_PATH: str = "./storage/cache/document_centroids.sqlite3"
+
+    # 檢索結果後處理
+    RETRIEVAL_MERGE_ADJACENT: bool = True  # 合併同一文件中重疊或相鄰的切片 (依 start_char / end_char)
+
+    # 語意答案快取 (相近問題直接重用答案，不呼叫 LLM)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIMILARITY: float = 0.95  # 問題向量 cosine 相似度門檻
+    ANSWER_CACHE_TTL: float = 3600.0  # 答案存活時間 (秒)
+    ANSWER_CACHE_MAX_PER_GROUP: int = 256  # 每個群組保留的答案數
+
+    # Prompt 組裝 (stable: 系統提示與對話歷史固定在前，檢索內容與時間放在最後，可重用 KV 快取)
+    PROMPT_LAYOUT: str = "stable"  # stable 或 legacy
+    CHAT_HISTORY_MESSAGES: int = 6  # 帶入 prompt 的歷史訊息數上限
+
+    # 上下文 token 預算 (依檢索排名放入片段，超出預算者裁切或捨棄)
+    CONTEXT_TOKEN_BUDGET: int = 8192  # 整個 prompt + 回答的 token 上限 (預設值)
+    CONTEXT_MODEL_TOKEN_BUDGETS: dict = {}  # 個別模型的上限，如 {"gpt-oss-20b": 16384}
+    CONTEXT_ANSWER_RESERVE: int = 1024  # 為回答保留的 token 數 (LLM 未設定 max_tokens 時)
+    CONTEXT_MIN_CHUNK_TOKENS: int = 64  # 裁切後片段的最少 token 數，低於此值直接捨棄
+    CONTEXT_TOKENIZER: str = "heuristic"  # heuristic (CJK/拉丁字元估算) 或 tiktoken:<encoding>
+
     # ============================================
     # CORS 配置
     # ============================================
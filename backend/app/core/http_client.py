@@ -0,0 +1,120 @@
+"""
+共用 HTTP 連線池
+
+為各上游服務（Ollama、Chroma、Gemini）維護長期存活的 httpx.AsyncClient，
+避免每次呼叫都重新建立 TCP / TLS 連線
+"""
+
+import logging
+from typing import Dict
+
+import httpx
+
+from app.core.config import settings
+
+
+class HTTPClientRegistry:
+    """
+    HTTP 客戶端註冊表
+
+    業務邏輯：
+    - 每個上游服務一個獨立的連線池（keep-alive）
+    - 在 FastAPI lifespan 啟動時建立，關閉時釋放
+    - 未啟動時（例如獨立腳本）第一次使用會自動建立
+    - 上游支援時啟用 HTTP/2（目前僅 Gemini）
+
+    配置：
+    - OLLAMA_HTTP_MAX_CONNECTIONS / CHROMA_HTTP_MAX_CONNECTIONS / GEMINI_HTTP_MAX_CONNECTIONS
+    - HTTP_MAX_KEEPALIVE_CONNECTIONS: 每個連線池保留的閒置連線數
+    - HTTP_KEEPALIVE_EXPIRY: 閒置連線保留時間（秒）
+    - HTTP_CONNECT_TIMEOUT: 建立連線的超時時間（秒）
+    - GEMINI_HTTP2: Gemini 是否使用 HTTP/2
+
+    注意：
+    - 讀取超時由各服務在每次請求時指定（timeout=...）
+    """
+
+    OLLAMA = "ollama"
+    CHROMA = "chroma"
+    GEMINI = "gemini"
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._http2: Dict[str, bool] = {}
+
+    def _pool_config(self, name: str) -> dict:
+        """取得上游服務的連線池設定"""
+        max_connections = {
+            self.OLLAMA: settings.OLLAMA_HTTP_MAX_CONNECTIONS,
+            self.CHROMA: settings.CHROMA_HTTP_MAX_CONNECTIONS,
+            self.GEMINI: settings.GEMINI_HTTP_MAX_CONNECTIONS,
+        }.get(name, settings.HTTP_MAX_KEEPALIVE_CONNECTIONS)
+
+        return {
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=min(
+                    settings.HTTP_MAX_KEEPALIVE_CONNECTIONS, max_connections
+                ),
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            "timeout": httpx.Timeout(60.0, connect=settings.HTTP_CONNECT_TIMEOUT),
+            "http2": name == self.GEMINI and settings.GEMINI_HTTP2 and self._http2_available(),
+        }
+
+    @staticmethod
+    def _http2_available() -> bool:
+        """檢查是否安裝 h2（httpx[http2]）"""
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            logging.warning("h2 not installed, falling back to HTTP/1.1")
+            return False
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """
+        取得上游服務的共用客戶端
+
+        Args:
+            name: 上游服務名稱（ollama / chroma / gemini）
+
+        Returns:
+            httpx.AsyncClient: 共用客戶端（不可由呼叫端關閉）
+        """
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            config = self._pool_config(name)
+            client = httpx.AsyncClient(**config)
+            self._clients[name] = client
+            self._http2[name] = config["http2"]
+        return client
+
+    async def startup(self) -> None:
+        """預先建立所有上游服務的連線池"""
+        for name in (self.OLLAMA, self.CHROMA, self.GEMINI):
+            self.get(name)
+
+    async def close(self) -> None:
+        """關閉所有連線池"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logging.warning(f"Failed to close HTTP client: {e}")
+
+    def stats(self) -> Dict[str, dict]:
+        """取得連線池狀態（用於調試）"""
+        return {
+            name: {
+                "closed": client.is_closed,
+                "http2": self._http2.get(name, False),
+            }
+            for name, client in self._clients.items()
+        }
+
+
+# 單例實例
+http_clients = HTTPClientRegistry()
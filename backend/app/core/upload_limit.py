@@ -0,0 +1,60 @@
+"""
+上傳大小限制中介軟體
+
+在讀取請求本體之前，依 Content-Length 拒絕超過大小限制的上傳
+"""
+
+import json
+from typing import Iterable
+
+
+class UploadSizeLimitMiddleware:
+    """
+    上傳大小限制（純 ASGI 中介軟體）
+
+    業務邏輯：
+    - 只檢查指定路徑的 POST 請求
+    - Content-Length 超過檔案大小限制加上 FORM_OVERHEAD 時直接返回 413，不讀取請求本體
+      （FastAPI 會在呼叫端點前解析整個 multipart 表單並暫存到磁碟）
+    - 沒有 Content-Length 的請求（chunked）交由端點逐塊檢查
+    """
+
+    # multipart 邊界、part 標頭與其他表單欄位的額外空間（bytes）
+    FORM_OVERHEAD = 64 * 1024
+
+    def __init__(self, app, paths: Iterable[str], max_file_size: int):
+        """
+        Args:
+            app: ASGI 應用
+            paths: 需要檢查的路徑
+            max_file_size: 檔案大小限制（bytes）
+        """
+        self.app = app
+        self.paths = set(paths)
+        self.max_file_size = max_file_size
+        self.max_body_size = max_file_size + self.FORM_OVERHEAD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in self.paths:
+            content_length = dict(scope["headers"]).get(b"content-length")
+            if content_length is not None and content_length.isdigit() \
+                    and int(content_length) > self.max_body_size:
+                await self._reject(send)
+                return
+        await self.app(scope, receive, send)
+
+    async def _reject(self, send) -> None:
+        body = json.dumps(
+            {"detail": f"檔案大小超過限制。最大: {self.max_file_size // 1024 // 1024}MB"},
+            ensure_ascii=False
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -8,9 +8,60 @@ FastAPI 應用程式入口
 - 提供健康檢查端點
 """
 
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
+from app.core.http_client import http_clients
+from app.core.upload_limit import UploadSizeLimitMiddleware
+
+# ============================================
+# 應用程式生命週期
+# ============================================
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    應用程式生命週期
+
+    啟動時:
+    - 建立上游服務（Ollama / Chroma / Gemini）的共用 HTTP 連線池
+    - 復原中斷的文件處理並啟動入庫 worker（INGEST_WORKERS_ENABLED）
+    - 初始化資料庫連線
+    - 載入 ML 模型（未來）
+    - 其他初始化任務
+
+    關閉時:
+    - 停止入庫 worker（未完成的工作交還佇列）
+    - 關閉共用 HTTP 連線池
+    - 關閉資料庫連線
+    - 釋放資源
+    """
+    print(f"🚀 {settings.APP_NAME} v{settings.APP_VERSION} 啟動中...")
+    print(f"📝 API 文件: http://localhost:8000/docs")
+    await http_clients.startup()
+    if settings.INGEST_WORKERS_ENABLED:
+        from app.services.document.job_queue import ingestion_queue
+        from app.services.document.ingestion_worker import ingestion_workers
+        try:
+            await ingestion_queue.recover()
+        except Exception as e:
+            logging.error(f"Failed to recover unfinished documents: {e}")
+        await ingestion_workers.start()
+    # TODO: 初始化資料庫
+    # from app.core.database import init_db
+    # await init_db()
+
+    yield
+
+    print(f"👋 {settings.APP_NAME} 正在關閉...")
+    if settings.INGEST_WORKERS_ENABLED:
+        await ingestion_workers.stop()
+    await http_clients.close()
+    # TODO: 關閉資料庫
+    # from app.core.database import close_db
+    # await close_db()
 
 # ============================================
 # 建立 FastAPI 應用
@@ -20,7 +71,19 @@ app = FastAPI(
     version=settings.APP_VERSION,
     description="基於 RAG 的智能文件問答系統",
     docs_url="/docs",   # Swagger UI 文件路徑
-    redoc_url="/redoc"  # ReDoc 文件路徑
+    redoc_url="/redoc",  # ReDoc 文件路徑
+    lifespan=lifespan
+)
+
+# ============================================
+# 上傳大小限制
+# ============================================
+# 依 Content-Length 提前拒絕過大的上傳（端點仍會逐塊檢查實際大小）
+# 在 CORS 之前加入，使 CORS 中介軟體位於外層，413 回應也帶有 CORS 標頭
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths=["/api/documents/upload"],
+    max_file_size=settings.MAX_FILE_SIZE,
 )
 
 # ============================================
@@ -77,39 +140,6 @@ def health_check():
         "environment": settings.ENVIRONMENT
     }
 
-# ============================================
-# 應用程式生命週期事件
-# ============================================
-@app.on_event("startup")
-async def startup_event():
-    """
-    應用程式啟動時執行
-
-    業務邏輯:
-    - 初始化資料庫連線
-    - 載入 ML 模型（未來）
-    - 其他初始化任務
-    """
-    print(f"🚀 {settings.APP_NAME} v{settings.APP_VERSION} 啟動中...")
-    print(f"📝 API 文件: http://localhost:8000/docs")
-    # TODO: 初始化資料庫
-    # from app.core.database import init_db
-    # await init_db()
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """
-    應用程式關閉時執行
-
-    業務邏輯:
-    - 關閉資料庫連線
-    - 釋放資源
-    """
-    print(f"👋 {settings.APP_NAME} 正在關閉...")
-    # TODO: 關閉資料庫
-    # from app.core.database import close_db
-    # await close_db()
-
 # ============================================
 # 註冊路由
 # ============================================
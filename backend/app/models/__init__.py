@@ -9,7 +9,8 @@ from app.models.user import User, UserRole
 from app.models.group import Group, GroupMember, GroupRole
 from app.models.document import Document, DocumentStatus, DocumentRole
 from app.models.conversation import Conversation
-from app.models.message import Message, MessageRole
+from app.models.message import Message, MessageRole, MessageStatus
+from app.models.ingestion_job import IngestionJob, IngestionJobStatus
 
 __all__ = [
     # User models
@@ -30,4 +31,9 @@ __all__ = [
     "Conversation",
     "Message",
     "MessageRole",
+    "MessageStatus",
+
+    # Ingestion job models
+    "IngestionJob",
+    "IngestionJobStatus",
 ]
@@ -29,6 +29,7 @@ class Document(Base):
     file_type = Column(String(20), nullable=False)
     file_size = Column(BigInteger, nullable=False)
     file_path = Column(String(500), nullable=False)
+    content_sha256 = Column(String(64), nullable=True, index=True)  # 上傳時計算的內容雜湊（hex）
     group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"))
     uploader_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     processing_status = Column(Enum(DocumentStatus), default=DocumentStatus.PENDING)
@@ -0,0 +1,79 @@
+"""
+文件入庫工作模型
+
+業務邏輯：
+- 每次需要處理文件（上傳、啟動時復原）即建立一筆工作
+- 工作由 worker 以租約（lease）取得，執行期間定期延長租約（heartbeat）
+- worker 當機或重啟時租約過期，其他 worker 可重新取得
+- 失敗時依指數退避重新排入佇列，超過最大次數後標記為失敗
+"""
+
+import enum
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Enum, Index
+from sqlalchemy.sql import func
+
+from app.core.database import Base
+
+
+class IngestionJobStatus(str, enum.Enum):
+    """
+    工作狀態枚舉
+
+    QUEUED: 等待處理（available_at 之後才可被取得）
+    RUNNING: 已被 worker 取得（租約有效期間內）
+    SUCCEEDED: 處理完成
+    FAILED: 超過最大重試次數或無法重試
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class IngestionJob(Base):
+    """
+    文件入庫工作表
+
+    關聯關係：
+    - 屬於一個文件 (document_id)，文件刪除時一併刪除
+    """
+    __tablename__ = "ingestion_jobs"
+    __table_args__ = (
+        Index("ix_ingestion_jobs_status_available_at", "status", "available_at"),
+    )
+
+    # 主鍵
+    id = Column(Integer, primary_key=True, index=True, comment="工作 ID")
+
+    # 外鍵
+    document_id = Column(
+        Integer,
+        ForeignKey("documents.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+        comment="文件 ID"
+    )
+
+    # 狀態與重試
+    status = Column(
+        Enum(IngestionJobStatus),
+        nullable=False,
+        default=IngestionJobStatus.QUEUED,
+        comment="狀態：queued/running/succeeded/failed"
+    )
+    attempts = Column(Integer, nullable=False, default=0, comment="已嘗試次數")
+    max_attempts = Column(Integer, nullable=False, default=3, comment="最大嘗試次數")
+    available_at = Column(DateTime, nullable=False, comment="可被取得的時間（UTC，重試退避）")
+    last_error = Column(Text, nullable=True, comment="最後一次失敗的錯誤訊息")
+
+    # 租約
+    lease_owner = Column(String(100), nullable=True, comment="持有租約的 worker")
+    lease_expires_at = Column(DateTime, nullable=True, comment="租約到期時間（UTC）")
+    heartbeat_at = Column(DateTime, nullable=True, comment="最後一次 heartbeat 時間（UTC）")
+
+    # 時間戳記
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="建立時間")
+    finished_at = Column(DateTime, nullable=True, comment="完成或最終失敗時間（UTC）")
+
+    def __repr__(self):
+        return f"<IngestionJob(id={self.id}, document_id={self.document_id}, status={self.status})>"
@@ -6,6 +6,7 @@
 - 助手訊息包含來源引用（JSON 格式）
 - 記錄 Token 數量和生成時間用於統計
 - 記錄使用的模型名稱
+- 記錄生成狀態：使用者中斷連線時保存已生成的部分內容並標記為已取消
 """
 
 import enum
@@ -27,6 +28,18 @@ class MessageRole(str, enum.Enum):
     ASSISTANT = "assistant"
 
 
+class MessageStatus(str, enum.Enum):
+    """
+    訊息生成狀態枚舉
+
+    COMPLETED: 生成完成
+    CANCELLED: 使用者中斷連線，生成被取消（content 為已生成的部分）；
+               對應的使用者訊息同樣標記，兩者都不列入對話歷史
+    """
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+
+
 class Message(Base):
     """
     訊息表
@@ -99,6 +112,13 @@ class Message(Base):
         nullable=True,
         comment="使用的模型名稱"
     )
+    status = Column(
+        Enum(MessageStatus),
+        nullable=False,
+        default=MessageStatus.COMPLETED,
+        server_default=MessageStatus.COMPLETED.name,
+        comment="生成狀態：completed/cancelled"
+    )
 
     # 時間戳記
     created_at = Column(
@@ -7,7 +7,7 @@
 from pydantic import BaseModel, Field, ConfigDict
 from typing import Optional, List, Dict, Any
 from datetime import datetime
-from app.models.message import MessageRole
+from app.models.message import MessageRole, MessageStatus
 
 
 # ============================================
@@ -45,6 +45,7 @@ class SourceReference(BaseModel):
     document_id: int
     document_name: str
     chunk_index: Optional[int] = None
+    chunk_indices: Optional[List[int]] = None  # 合併的相鄰切片索引
     content: str
     score: float
 
@@ -59,6 +60,7 @@ class MessageResponse(BaseModel):
     token_count: Optional[int] = None
     generation_time: Optional[float] = None
     model_used: Optional[str] = None
+    status: MessageStatus = MessageStatus.COMPLETED
     created_at: datetime
 
     model_config = ConfigDict(from_attributes=True, protected_namespaces=())
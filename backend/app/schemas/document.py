@@ -64,6 +64,7 @@ class DocumentResponse(BaseModel):
     original_filename: str
     file_type: str
     file_size: int
+    content_sha256: Optional[str] = None
     group_id: int
     uploader_id: int
     uploader_username: Optional[str] = None
@@ -0,0 +1,5 @@
+"""
+維運腳本套件
+
+以 python -m app.scripts.<name> 執行
+"""
@@ -0,0 +1,143 @@
+"""
+向量分片遷移
+
+將主 collection（CHROMA_COLLECTION_NAME）中的既有向量依 group_id 搬移到分片 collection
+
+使用方式（於 backend 目錄，先設定 CHROMA_SHARDING=group 或 bucket）：
+    python -m app.scripts.migrate_vector_shards --dry-run
+    python -m app.scripts.migrate_vector_shards
+    python -m app.scripts.migrate_vector_shards --keep-source
+
+業務邏輯：
+- 分頁讀取主 collection 的向量、文本與 metadata
+- 依 group_id 以 upsert 寫入對應分片（可重複執行）
+- 全部複製完成後才從主 collection 刪除已搬移的資料
+- 沒有 group_id 的資料保留在主 collection
+"""
+
+import argparse
+import asyncio
+from typing import Dict, List, Any
+
+from app.core.http_client import http_clients
+from app.services.rag.vectorstore import VectorStoreService
+
+
+async def _fetch_page(service: VectorStoreService, collection_id: str, offset: int, limit: int) -> Dict[str, Any]:
+    response = await service._client.post(
+        f"{service._collections_url}/{collection_id}/get",
+        json={
+            "limit": limit,
+            "offset": offset,
+            "include": ["embeddings", "documents", "metadatas"]
+        },
+        timeout=service.timeout
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def _upsert(service: VectorStoreService, name: str, items: List[Dict[str, Any]]) -> None:
+    collection_id = await service._ensure_collection(name)
+    response = await service._client.post(
+        f"{service._collections_url}/{collection_id}/upsert",
+        json={
+            "ids": [item["id"] for item in items],
+            "embeddings": [item["embedding"] for item in items],
+            "documents": [item["document"] for item in items],
+            "metadatas": [item["metadata"] for item in items],
+        },
+        timeout=service.timeout
+    )
+    response.raise_for_status()
+
+
+async def migrate(batch_size: int, keep_source: bool, dry_run: bool) -> None:
+    service = VectorStoreService()
+    if not service.is_sharded:
+        print("CHROMA_SHARDING=none，沒有需要遷移的分片。請先設定 CHROMA_SHARDING=group 或 bucket")
+        return
+
+    source_id = await service._ensure_collection(service.collection_name, create=False)
+    if source_id is None:
+        print(f"主 collection {service.collection_name} 不存在，無需遷移")
+        return
+
+    print(f"來源: {service.collection_name}，模式: {service.sharding}")
+
+    migrated_ids: List[str] = []
+    shard_counts: Dict[str, int] = {}
+    offset = 0
+
+    # 1. 分頁複製（不在此階段刪除，避免 offset 位移）
+    while True:
+        page = await _fetch_page(service, source_id, offset, batch_size)
+        ids = page.get("ids") or []
+        if not ids:
+            break
+
+        embeddings = page.get("embeddings") or []
+        documents = page.get("documents") or []
+        metadatas = page.get("metadatas") or []
+
+        shards: Dict[str, List[Dict[str, Any]]] = {}
+        for i, doc_id in enumerate(ids):
+            metadata = metadatas[i] or {}
+            name = service.shard_name(metadata.get("group_id"))
+            if name == service.collection_name:
+                continue
+            shards.setdefault(name, []).append({
+                "id": doc_id,
+                "embedding": embeddings[i],
+                "document": documents[i] if i < len(documents) else "",
+                "metadata": metadata,
+            })
+
+        for name, items in shards.items():
+            if not dry_run:
+                await _upsert(service, name, items)
+            shard_counts[name] = shard_counts.get(name, 0) + len(items)
+            migrated_ids.extend(item["id"] for item in items)
+
+        offset += len(ids)
+        print(f"  已處理 {offset} 筆，待搬移 {len(migrated_ids)} 筆")
+
+    for name, count in sorted(shard_counts.items()):
+        print(f"  {name}: {count} 筆")
+
+    if dry_run:
+        print(f"[dry-run] 共 {len(migrated_ids)} 筆將搬移到 {len(shard_counts)} 個分片")
+        return
+
+    # 2. 刪除來源中已搬移的資料
+    if not keep_source:
+        for i in range(0, len(migrated_ids), batch_size):
+            response = await service._client.post(
+                f"{service._collections_url}/{source_id}/delete",
+                json={"ids": migrated_ids[i:i + batch_size]},
+                timeout=service.timeout
+            )
+            response.raise_for_status()
+        print(f"已從 {service.collection_name} 移除 {len(migrated_ids)} 筆")
+
+    print(f"遷移完成：{len(migrated_ids)} 筆，{len(shard_counts)} 個分片")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="將既有向量搬移到分片 collection")
+    parser.add_argument("--batch-size", type=int, default=500, help="每頁讀取 / 寫入筆數")
+    parser.add_argument("--keep-source", action="store_true", help="搬移後保留主 collection 中的資料")
+    parser.add_argument("--dry-run", action="store_true", help="只統計，不寫入")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            await migrate(args.batch_size, args.keep_source, args.dry_run)
+        finally:
+            await http_clients.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
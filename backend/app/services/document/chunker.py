@@ -5,12 +5,15 @@
 使用語意分塊策略，保持文本的語意完整性
 """
 
-import re
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 from dataclasses import dataclass
 from app.core.config import settings
 
 
+# 原文中的位置區段 [start, end)
+Span = Tuple[int, int]
+
+
 @dataclass
 class TextChunk:
     """文本塊"""
@@ -31,6 +34,8 @@ class TextChunker:
     - 優先在段落、句子邊界切割
     - 避免切斷詞語
 
+    - 全程以原文位置區段運算，線性時間，start_char / end_char 精確對應原文
+
     分隔符優先級：
     1. 連續換行（段落）
     2. 單個換行
@@ -39,6 +44,9 @@ class TextChunker:
     5. 空格
     """
 
+    # 串流模式每次切割的視窗大小（以 chunk_size 為單位）
+    STREAM_WINDOW_CHUNKS = 64
+
     def __init__(
         self,
         chunk_size: int = None,
@@ -75,6 +83,8 @@ class TextChunker:
         """
         將文本切割成塊
 
+        每個塊的 content 恆等於 text[start_char:end_char]（原文不改寫，只去除塊首尾空白）
+
         Args:
             text: 要切割的文本
             metadata: 附加到每個塊的元數據
@@ -85,150 +95,197 @@ class TextChunker:
         if not text or not text.strip():
             return []
 
-        # 清理文本
-        text = self._clean_text(text)
-
-        # 遞歸切割
-        chunks_text = self._recursive_split(text, self.separators)
+        # 遞歸切割（以原文位置區段表示）
+        spans = self._recursive_split(text, 0, len(text), 0)
 
         # 合併過小的塊
-        merged_chunks = self._merge_small_chunks(chunks_text)
-
-        # 建立 TextChunk 物件
-        result = []
-        current_pos = 0
+        spans = self._merge_small_chunks(spans)
 
-        for idx, chunk_text in enumerate(merged_chunks):
-            # 找到這個塊在原文中的位置
-            start_pos = text.find(chunk_text, current_pos)
-            if start_pos == -1:
-                start_pos = current_pos
-
-            chunk = TextChunk(
-                content=chunk_text,
+        return [
+            TextChunk(
+                content=text[start:end],
                 chunk_index=idx,
-                start_char=start_pos,
-                end_char=start_pos + len(chunk_text),
+                start_char=start,
+                end_char=end,
                 metadata=metadata.copy() if metadata else None
             )
-            result.append(chunk)
-            current_pos = start_pos + len(chunk_text) - self.chunk_overlap
+            for idx, (start, end) in enumerate(spans)
+        ]
 
-        return result
+    def split_stream(
+        self,
+        blocks: Iterable[str],
+        metadata: Optional[dict] = None
+    ) -> Iterator[TextChunk]:
+        """
+        串流切割：逐塊讀入文字並依序產生文本塊，記憶體用量與文本長度無關
 
-    def _clean_text(self, text: str) -> str:
-        """清理文本"""
-        # 移除多餘的空白
-        text = re.sub(r" +", " ", text)
-        # 移除多餘的換行
-        text = re.sub(r"\n{3,}", "\n\n", text)
-        return text.strip()
+        - 文字累積到 STREAM_WINDOW_CHUNKS 個塊的視窗後切割，只輸出已不受後續文字影響的塊
+          （視窗尾端兩個 chunk_size 內的塊，以及可能與其合併的前一塊，留到下一輪）
+        - 下一輪從第一個未輸出的塊的起點重新切割，因此視窗接縫附近的邊界可能與 split() 略有不同
+        - start_char / end_char 為在整份文本中的位置，content 恆等於對應區段
 
-    def _recursive_split(
-        self,
-        text: str,
-        separators: List[str]
-    ) -> List[str]:
+        Args:
+            blocks: 依序的文字區塊
+            metadata: 附加到每個塊的元數據
+
+        Yields:
+            TextChunk: 文本塊（chunk_index 連續編號）
         """
-        遞歸切割文本
+        window = self.chunk_size * self.STREAM_WINDOW_CHUNKS
+        buffer = ""
+        base = 0  # buffer 開頭在整份文本中的位置
+        index = 0
+
+        for block in blocks:
+            buffer += block
+            if len(buffer) < window:
+                continue
 
-        嘗試使用當前分隔符切割，如果結果仍然太大，
-        則使用下一個分隔符繼續切割
+            spans = self._merge_small_chunks(self._recursive_split(buffer, 0, len(buffer), 0))
+            limit = len(buffer) - 2 * self.chunk_size
+            ready = 0
+            while ready < len(spans) and spans[ready][1] <= limit:
+                ready += 1
+            ready -= 1  # 最後一個完成的塊可能與下一個小塊合併
+            if ready <= 0:
+                continue
+
+            for start, end in spans[:ready]:
+                yield TextChunk(
+                    content=buffer[start:end],
+                    chunk_index=index,
+                    start_char=base + start,
+                    end_char=base + end,
+                    metadata=metadata.copy() if metadata else None
+                )
+                index += 1
+
+            cut = spans[ready][0]
+            buffer = buffer[cut:]
+            base += cut
+
+        for start, end in self._merge_small_chunks(self._recursive_split(buffer, 0, len(buffer), 0)):
+            yield TextChunk(
+                content=buffer[start:end],
+                chunk_index=index,
+                start_char=base + start,
+                end_char=base + end,
+                metadata=metadata.copy() if metadata else None
+            )
+            index += 1
+
+    @staticmethod
+    def _strip_span(text: str, start: int, end: int) -> Optional[Span]:
+        """去除區段首尾空白；全為空白時返回 None"""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return (start, end) if start < end else None
+
+    def _recursive_split(self, text: str, start: int, end: int, level: int) -> List[Span]:
         """
-        if len(text) <= self.chunk_size:
-            return [text] if text.strip() else []
+        遞歸切割文本區段 text[start:end]
 
-        if not separators:
-            # 沒有更多分隔符，強制切割
-            return self._force_split(text)
+        嘗試使用當前分隔符切割（分隔符保留在前一部分的結尾），貪婪地將相鄰部分
+        併入同一塊；單一部分仍太大時，使用下一個分隔符繼續切割
+
+        每一層只掃描一次區段，總成本為 O(文本長度 × 分隔符數)
+        """
+        if end - start <= self.chunk_size:
+            span = self._strip_span(text, start, end)
+            return [span] if span else []
 
-        separator = separators[0]
-        remaining_separators = separators[1:]
+        if level >= len(self.separators):
+            # 沒有更多分隔符，強制切割
+            return self._force_split(text, start, end)
 
-        # 使用當前分隔符切割
-        parts = text.split(separator)
+        separator = self.separators[level]
+        result: List[Span] = []
+        current: Optional[Span] = None
+        pos = start
 
-        result = []
-        current_chunk = ""
+        while pos < end:
+            found = text.find(separator, pos, end)
+            part_end = end if found == -1 else found + len(separator)
+            part_start, pos = pos, part_end
 
-        for i, part in enumerate(parts):
-            if not part.strip():
+            # 跳過空白部分（不含分隔符）
+            content_end = end if found == -1 else found
+            if self._strip_span(text, part_start, content_end) is None:
                 continue
 
-            # 加上分隔符（除了最後一個部分）
-            part_with_sep = part + (separator if i < len(parts) - 1 else "")
-
             # 檢查是否可以加入當前塊
-            potential_chunk = current_chunk + part_with_sep
+            if current is not None and part_end - current[0] <= self.chunk_size:
+                current = (current[0], part_end)
+                continue
+
+            # 保存當前塊
+            if current is not None:
+                span = self._strip_span(text, *current)
+                if span:
+                    result.append(span)
+                current = None
 
-            if len(potential_chunk) <= self.chunk_size:
-                current_chunk = potential_chunk
+            # 如果單個部分就超過大小，需要進一步切割
+            if part_end - part_start > self.chunk_size:
+                result.extend(self._recursive_split(text, part_start, part_end, level + 1))
             else:
-                # 保存當前塊
-                if current_chunk.strip():
-                    result.append(current_chunk.strip())
-
-                # 如果單個部分就超過大小，需要進一步切割
-                if len(part_with_sep) > self.chunk_size:
-                    sub_chunks = self._recursive_split(
-                        part_with_sep,
-                        remaining_separators
-                    )
-                    result.extend(sub_chunks)
-                    current_chunk = ""
-                else:
-                    current_chunk = part_with_sep
+                current = (part_start, part_end)
 
         # 處理最後一個塊
-        if current_chunk.strip():
-            result.append(current_chunk.strip())
+        if current is not None:
+            span = self._strip_span(text, *current)
+            if span:
+                result.append(span)
 
         return result
 
-    def _force_split(self, text: str) -> List[str]:
-        """強制按固定大小切割"""
-        result = []
-        start = 0
+    def _force_split(self, text: str, start: int, end: int) -> List[Span]:
+        """強制按固定大小切割（相鄰塊重疊 chunk_overlap 個字元）"""
+        result: List[Span] = []
 
-        while start < len(text):
-            end = min(start + self.chunk_size, len(text))
+        while start < end:
+            stop = min(start + self.chunk_size, end)
 
             # 嘗試在單詞邊界切割
-            if end < len(text):
+            if stop < end:
                 # 往回找空格
-                last_space = text.rfind(" ", start, end)
+                last_space = text.rfind(" ", start, stop)
                 if last_space > start + self.chunk_size // 2:
-                    end = last_space + 1
+                    stop = last_space + 1
 
-            chunk = text[start:end].strip()
-            if chunk:
-                result.append(chunk)
+            span = self._strip_span(text, start, stop)
+            if span:
+                result.append(span)
 
-            start = end - self.chunk_overlap
-            if start >= len(text):
+            if stop >= end:
                 break
+            # 確保每次至少前進一個字元
+            start = max(stop - self.chunk_overlap, start + 1)
 
         return result
 
-    def _merge_small_chunks(self, chunks: List[str]) -> List[str]:
-        """合併過小的塊"""
-        if not chunks:
+    def _merge_small_chunks(self, spans: List[Span]) -> List[Span]:
+        """合併過小的塊（合併後的區段包含兩塊之間的原文）"""
+        if not spans:
             return []
 
         min_size = self.chunk_size // 4  # 最小塊大小為目標的 1/4
-        result = []
-        current = ""
+        result: List[Span] = []
+        current: Optional[Span] = None
 
-        for chunk in chunks:
-            if len(chunk) < min_size and current:
+        for start, end in spans:
+            if end - start < min_size and current:
                 # 嘗試合併到前一個塊
-                if len(current) + len(chunk) <= self.chunk_size:
-                    current = current + " " + chunk
+                if end - current[0] <= self.chunk_size:
+                    current = (current[0], max(current[1], end))
                     continue
 
             if current:
                 result.append(current)
-            current = chunk
+            current = (start, end)
 
         if current:
             result.append(current)
@@ -236,5 +293,68 @@ class TextChunker:
         return result
 
 
+class HierarchicalChunker:
+    """
+    父子兩層分塊器
+
+    業務邏輯：
+    - 先將文本切成較大的父段落（不重疊），保留完整上下文
+    - 再將每個父段落切成較小的子塊，子塊用於向量化與精確比對
+    - 子塊的 metadata 記錄 parent_index，位置換算回原文的字元位置
+    - chunk_index 在整份文件中連續編號（子塊、父段落各自編號）
+    """
+
+    def __init__(
+        self,
+        parent_size: int = None,
+        child_size: int = None,
+        child_overlap: int = None
+    ):
+        """
+        初始化分塊器
+
+        Args:
+            parent_size: 父段落的最大字元數
+            child_size: 子塊的最大字元數
+            child_overlap: 子塊之間的重疊字元數
+        """
+        self.parent_chunker = TextChunker(chunk_size=parent_size or settings.PARENT_CHUNK_SIZE)
+        self.parent_chunker.chunk_overlap = 0  # 父段落不重疊（建構參數 0 會被視為未設定）
+        self.child_chunker = TextChunker(
+            chunk_size=child_size or settings.CHILD_CHUNK_SIZE,
+            chunk_overlap=child_overlap or settings.CHILD_CHUNK_OVERLAP
+        )
+
+    def split(
+        self,
+        text: str,
+        metadata: Optional[dict] = None
+    ) -> Tuple[List[TextChunk], List[TextChunk]]:
+        """
+        將文本切割成父段落與子塊
+
+        Args:
+            text: 要切割的文本
+            metadata: 附加到每個塊的元數據
+
+        Returns:
+            Tuple[List[TextChunk], List[TextChunk]]: (父段落列表, 子塊列表)
+        """
+        parents = self.parent_chunker.split(text, metadata)
+        children: List[TextChunk] = []
+
+        for parent in parents:
+            for child in self.child_chunker.split(parent.content):
+                children.append(TextChunk(
+                    content=child.content,
+                    chunk_index=len(children),
+                    start_char=parent.start_char + child.start_char,
+                    end_char=parent.start_char + child.end_char,
+                    metadata={**(metadata or {}), "parent_index": parent.chunk_index}
+                ))
+
+        return parents, children
+
+
 # 單例實例
 chunker = TextChunker()
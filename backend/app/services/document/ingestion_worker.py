@@ -0,0 +1,198 @@
+"""
+文件入庫 worker
+
+從工作佇列取得工作，以 DocumentProcessor.process_document 處理文件
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from typing import Dict, Any, List
+
+from app.core.database import AsyncSessionLocal
+from app.core.config import settings
+from app.services.document.job_queue import IngestionJobQueue, LeasedJob, ingestion_queue
+from app.services.document.processor import DocumentProcessor, processor as default_processor
+
+
+class IngestionWorkerPool:
+    """
+    文件入庫 worker 池
+
+    業務邏輯：
+    - 每個行程啟動 INGEST_CONCURRENCY 個 worker，各自從佇列取得工作，限制同時處理的文件數
+    - 沒有工作時等待 INGEST_JOB_POLL_INTERVAL 秒，或被同行程的 enqueue 喚醒
+    - 處理期間每 INGEST_JOB_HEARTBEAT_SECONDS 秒延長租約；租約被他人取得時中止處理
+    - 處理失敗交由佇列依退避重試；文件已不存在時不重試
+    - 關閉時等待進行中的工作至逾時，仍未完成者中止並交還佇列
+    """
+
+    def __init__(
+        self,
+        queue: IngestionJobQueue = None,
+        processor: DocumentProcessor = None,
+        concurrency: int = None,
+        poll_interval: float = None,
+        heartbeat_interval: float = None
+    ):
+        """
+        初始化 worker 池
+
+        Args:
+            queue: 工作佇列
+            processor: 文件處理器
+            concurrency: 同時處理的工作數
+            poll_interval: 沒有工作時的輪詢間隔（秒）
+            heartbeat_interval: 延長租約的間隔（秒）
+        """
+        self.queue = queue or ingestion_queue
+        self.processor = processor or default_processor
+        self.concurrency = max(1, concurrency or settings.INGEST_CONCURRENCY)
+        self.poll_interval = poll_interval or settings.INGEST_JOB_POLL_INTERVAL
+        self.heartbeat_interval = heartbeat_interval or settings.INGEST_JOB_HEARTBEAT_SECONDS
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.completed = 0
+        self.failed = 0
+        self._tasks: List[asyncio.Task] = []
+        self._active: Dict[str, LeasedJob] = {}
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        """啟動 worker"""
+        if self._tasks:
+            return
+        self._stopping = False
+        self._tasks = [
+            asyncio.create_task(self._run(f"{self.worker_prefix}/{i}"), name=f"ingestion-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        logging.info(f"Ingestion worker pool started: {self.concurrency} workers ({self.worker_prefix})")
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """
+        停止 worker
+
+        Args:
+            timeout: 等待進行中工作完成的秒數
+        """
+        if not self._tasks:
+            return
+        self._stopping = True
+        self.queue.notify()
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        logging.info("Ingestion worker pool stopped")
+
+    async def _run(self, worker_id: str) -> None:
+        """單一 worker 的主迴圈"""
+        while not self._stopping:
+            try:
+                job = await self.queue.lease(worker_id)
+            except Exception as e:
+                logging.warning(f"Ingestion worker {worker_id} failed to lease a job: {e}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            if job is None:
+                await self.queue.wait(self.poll_interval)
+                continue
+
+            await self._execute(job, worker_id)
+
+    async def _execute(self, job: LeasedJob, worker_id: str) -> None:
+        """執行工作：處理文件並定期延長租約"""
+        logging.info(
+            f"Ingestion job {job.id} started by {worker_id}: document {job.document_id} "
+            f"(attempt {job.attempt}/{job.max_attempts})"
+        )
+        self._active[worker_id] = job
+        body = asyncio.create_task(self._process(job.document_id))
+        try:
+            while True:
+                done, _ = await asyncio.wait({body}, timeout=self.heartbeat_interval)
+                if done:
+                    break
+                if not await self._heartbeat(job, worker_id):
+                    logging.warning(f"Ingestion job {job.id} lease lost, aborting document {job.document_id}")
+                    body.cancel()
+                    await asyncio.gather(body, return_exceptions=True)
+                    return
+
+            success, error, retry = body.result()
+            if success:
+                await self.queue.complete(job.id, worker_id)
+                self.completed += 1
+                logging.info(f"Ingestion job {job.id} completed: document {job.document_id}")
+            else:
+                await self.queue.fail(job.id, worker_id, error, retry=retry)
+                self.failed += 1
+        except asyncio.CancelledError:
+            # 關閉逾時：中止處理並交還工作，讓其他 worker（或重啟後）立即接手
+            body.cancel()
+            await asyncio.gather(body, return_exceptions=True)
+            await asyncio.shield(self._release(job, worker_id))
+            raise
+        except Exception as e:
+            logging.error(f"Ingestion job {job.id} bookkeeping failed: {e}")
+        finally:
+            self._active.pop(worker_id, None)
+
+    async def _process(self, document_id: int) -> tuple:
+        """
+        工作內容：處理文件
+
+        Returns:
+            tuple: (是否成功, 錯誤訊息, 是否可重試)
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await self.processor.process_document(db, document_id)
+        except Exception as e:
+            return False, str(e), True
+
+        if result.success:
+            return True, None, False
+        # 文件已被刪除或檔案無法解析時重試沒有意義
+        return False, result.error_message or "unknown error", result.retryable
+
+    async def _heartbeat(self, job: LeasedJob, worker_id: str) -> bool:
+        try:
+            return await self.queue.heartbeat(job.id, worker_id)
+        except Exception as e:
+            # 暫時無法連線資料庫時繼續處理；租約到期前仍會再嘗試
+            logging.warning(f"Ingestion job {job.id} heartbeat failed: {e}")
+            return True
+
+    async def _release(self, job: LeasedJob, worker_id: str) -> None:
+        try:
+            await self.queue.release(job.id, worker_id)
+            logging.info(f"Ingestion job {job.id} released back to the queue")
+        except Exception as e:
+            logging.warning(f"Failed to release ingestion job {job.id}, it will be re-leased after expiry: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """取得 worker 池統計"""
+        return {
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "active_jobs": [
+                {"job_id": job.id, "document_id": job.document_id, "attempt": job.attempt}
+                for job in self._active.values()
+            ],
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+# 單例實例
+ingestion_workers = IngestionWorkerPool()
@@ -0,0 +1,400 @@
+"""
+文件入庫工作佇列
+
+以資料庫資料表（ingestion_jobs）保存的持久化工作佇列，取代 FastAPI BackgroundTasks
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any
+
+from sqlalchemy import select, update, and_, or_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import AsyncSessionLocal
+from app.core.config import settings
+from app.models.document import Document, DocumentStatus
+from app.models.ingestion_job import IngestionJob, IngestionJobStatus
+
+
+def utcnow() -> datetime:
+    """目前的 UTC 時間（不含時區，與 ingestion_jobs 的 DateTime 欄位一致）"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@dataclass
+class LeasedJob:
+    """已取得租約的工作"""
+    id: int
+    document_id: int
+    attempt: int
+    max_attempts: int
+
+
+class IngestionJobQueue:
+    """
+    文件入庫工作佇列
+
+    業務邏輯：
+    - enqueue：建立工作（與文件記錄在同一個交易中提交）
+    - lease：以 SELECT ... FOR UPDATE SKIP LOCKED 取得一筆可執行的工作，
+      可執行 = 已到 available_at 的 queued 工作，或租約已過期且未用盡嘗試次數的 running 工作（worker 當機）
+    - sweep_exhausted：租約過期且已用盡嘗試次數的工作標記為 failed（由 lease 定期觸發）
+    - heartbeat：延長租約；租約已被他人取得時返回 False
+    - complete / fail：結束工作；失敗且未超過最大次數時依指數退避重新排入佇列
+      （文件狀態重設為 pending，等待重試）
+    - release：worker 關閉時交還未完成的工作（不計入嘗試次數）
+    - recover：啟動時將沒有進行中工作的 pending / processing 文件重新排入佇列
+
+    配置：
+    - INGEST_JOB_LEASE_SECONDS: 租約長度
+    - INGEST_JOB_MAX_ATTEMPTS: 最大嘗試次數
+    - INGEST_JOB_RETRY_BACKOFF: 第一次重試的等待秒數（之後每次加倍）
+
+    注意：
+    - 時間一律由應用程式以 UTC 計算，多台主機需校時
+    - 同一行程內 enqueue 後會喚醒等待中的 worker，不必等到下一次輪詢
+    """
+
+    # 清理用盡嘗試次數的過期工作的間隔（秒）
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(
+        self,
+        lease_seconds: float = None,
+        max_attempts: int = None,
+        retry_backoff: float = None
+    ):
+        """
+        初始化佇列
+
+        Args:
+            lease_seconds: 租約長度（秒）
+            max_attempts: 最大嘗試次數
+            retry_backoff: 第一次重試的等待秒數
+        """
+        self.lease_seconds = lease_seconds or settings.INGEST_JOB_LEASE_SECONDS
+        self.max_attempts = max_attempts or settings.INGEST_JOB_MAX_ATTEMPTS
+        self.retry_backoff = settings.INGEST_JOB_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self._wakeup = asyncio.Event()
+        self._last_sweep: Optional[datetime] = None
+
+    # ============================================
+    # 生產者
+    # ============================================
+
+    def enqueue(self, db: AsyncSession, document_id: int, delay: float = 0.0) -> IngestionJob:
+        """
+        建立工作（由呼叫端提交交易）
+
+        Args:
+            db: 資料庫 session
+            document_id: 文件 ID
+            delay: 延後執行的秒數
+
+        Returns:
+            IngestionJob: 新工作
+        """
+        job = IngestionJob(
+            document_id=document_id,
+            status=IngestionJobStatus.QUEUED,
+            attempts=0,
+            max_attempts=self.max_attempts,
+            available_at=utcnow() + timedelta(seconds=delay)
+        )
+        db.add(job)
+        return job
+
+    def notify(self) -> None:
+        """喚醒同一行程中等待工作的 worker（在 enqueue 的交易提交後呼叫）"""
+        self._wakeup.set()
+
+    async def wait(self, timeout: float) -> None:
+        """等待新工作通知或逾時"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    # ============================================
+    # 消費者
+    # ============================================
+
+    async def lease(self, worker_id: str) -> Optional[LeasedJob]:
+        """
+        取得一筆可執行的工作
+
+        Args:
+            worker_id: worker 識別名稱
+
+        Returns:
+            Optional[LeasedJob]: 取得的工作；沒有可執行的工作時為 None
+        """
+        now = utcnow()
+        if self._last_sweep is None or (now - self._last_sweep).total_seconds() >= self.SWEEP_INTERVAL:
+            self._last_sweep = now
+            try:
+                await self.sweep_exhausted()
+            except Exception as e:
+                logging.warning(f"Failed to sweep exhausted ingestion jobs: {e}")
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(IngestionJob.id, IngestionJob.status, IngestionJob.lease_owner, IngestionJob.attempts)
+                .where(or_(
+                    and_(
+                        IngestionJob.status == IngestionJobStatus.QUEUED,
+                        IngestionJob.available_at <= now
+                    ),
+                    and_(
+                        IngestionJob.status == IngestionJobStatus.RUNNING,
+                        IngestionJob.lease_expires_at < now,
+                        IngestionJob.attempts < IngestionJob.max_attempts
+                    )
+                ))
+                .order_by(IngestionJob.available_at, IngestionJob.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            row = result.first()
+            if row is None:
+                return None
+            job_id, status, previous_owner, attempts = row
+
+            # attempts 作為版本號：其他 worker 已先取得時更新 0 筆（不支援 SKIP LOCKED 的資料庫也安全）
+            updated = await db.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id == job_id, IngestionJob.attempts == attempts)
+                .values(
+                    status=IngestionJobStatus.RUNNING,
+                    attempts=attempts + 1,
+                    lease_owner=worker_id,
+                    lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                    heartbeat_at=now
+                )
+            )
+            if updated.rowcount == 0:
+                await db.rollback()
+                return None
+
+            job = await db.get(IngestionJob, job_id)
+            await db.commit()
+
+        if status == IngestionJobStatus.RUNNING:
+            logging.warning(f"Ingestion job {job_id} lease held by {previous_owner} expired, re-leased")
+        return LeasedJob(
+            id=job_id,
+            document_id=job.document_id,
+            attempt=attempts + 1,
+            max_attempts=job.max_attempts
+        )
+
+    async def heartbeat(self, job_id: int, worker_id: str) -> bool:
+        """
+        延長租約
+
+        Returns:
+            bool: 是否仍持有租約
+        """
+        now = utcnow()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(IngestionJob)
+                .where(
+                    IngestionJob.id == job_id,
+                    IngestionJob.lease_owner == worker_id,
+                    IngestionJob.status == IngestionJobStatus.RUNNING
+                )
+                .values(
+                    heartbeat_at=now,
+                    lease_expires_at=now + timedelta(seconds=self.lease_seconds)
+                )
+            )
+            await db.commit()
+            return result.rowcount > 0
+
+    async def complete(self, job_id: int, worker_id: str) -> None:
+        """標記工作完成"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id == job_id, IngestionJob.lease_owner == worker_id)
+                .values(
+                    status=IngestionJobStatus.SUCCEEDED,
+                    lease_owner=None,
+                    lease_expires_at=None,
+                    finished_at=utcnow()
+                )
+            )
+            await db.commit()
+
+    async def fail(self, job_id: int, worker_id: str, error: str, retry: bool = True) -> bool:
+        """
+        標記工作失敗
+
+        未超過最大嘗試次數且 retry=True 時，依指數退避重新排入佇列
+
+        Args:
+            job_id: 工作 ID
+            worker_id: worker 識別名稱
+            error: 錯誤訊息
+            retry: 是否允許重試
+
+        Returns:
+            bool: 是否已重新排入佇列
+        """
+        async with AsyncSessionLocal() as db:
+            job = await db.get(IngestionJob, job_id)
+            if job is None or job.lease_owner != worker_id:
+                return False
+
+            job.last_error = error
+            job.lease_owner = None
+            job.lease_expires_at = None
+            requeued = retry and job.attempts < job.max_attempts
+            if requeued:
+                delay = self.retry_backoff * (2 ** (job.attempts - 1))
+                job.status = IngestionJobStatus.QUEUED
+                job.available_at = utcnow() + timedelta(seconds=delay)
+                await self._reset_document(db, job.document_id)
+                logging.warning(
+                    f"Ingestion job {job_id} failed (attempt {job.attempts}/{job.max_attempts}), "
+                    f"retrying in {delay:.0f}s: {error}"
+                )
+            else:
+                job.status = IngestionJobStatus.FAILED
+                job.finished_at = utcnow()
+                logging.error(f"Ingestion job {job_id} failed permanently: {error}")
+            await db.commit()
+            return requeued
+
+    async def release(self, job_id: int, worker_id: str) -> None:
+        """交還未完成的工作，立即可被其他 worker 取得（不計入嘗試次數）"""
+        async with AsyncSessionLocal() as db:
+            job = await db.get(IngestionJob, job_id)
+            if job is None or job.lease_owner != worker_id:
+                return
+            job.status = IngestionJobStatus.QUEUED
+            job.attempts = max(0, job.attempts - 1)
+            job.available_at = utcnow()
+            job.lease_owner = None
+            job.lease_expires_at = None
+            await self._reset_document(db, job.document_id)
+            await db.commit()
+
+    async def sweep_exhausted(self) -> int:
+        """
+        將租約過期且已用盡嘗試次數的工作標記為失敗
+
+        worker 在處理某份文件時當機（OOM、解析器崩潰）不會呼叫 fail()，
+        這些工作不再被 lease() 取得，在此結束並將文件標記為 failed
+
+        Returns:
+            int: 標記為失敗的工作數
+        """
+        now = utcnow()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(IngestionJob)
+                .where(
+                    IngestionJob.status == IngestionJobStatus.RUNNING,
+                    IngestionJob.lease_expires_at < now,
+                    IngestionJob.attempts >= IngestionJob.max_attempts
+                )
+                .with_for_update(skip_locked=True)
+            )
+            jobs = result.scalars().all()
+            for job in jobs:
+                error = f"worker lease expired on attempt {job.attempts}/{job.max_attempts}"
+                job.status = IngestionJobStatus.FAILED
+                job.last_error = error
+                job.lease_owner = None
+                job.lease_expires_at = None
+                job.finished_at = now
+                await db.execute(
+                    update(Document)
+                    .where(Document.id == job.document_id)
+                    .values(processing_status=DocumentStatus.FAILED, error_message="處理逾時或 worker 異常終止")
+                )
+                logging.error(f"Ingestion job {job.id} failed permanently: {error}")
+            await db.commit()
+        return len(jobs)
+
+    @staticmethod
+    async def _reset_document(db: AsyncSession, document_id: int) -> None:
+        """將等待重新處理的文件重設為 pending"""
+        await db.execute(
+            update(Document)
+            .where(Document.id == document_id)
+            .values(processing_status=DocumentStatus.PENDING)
+        )
+
+    # ============================================
+    # 復原與統計
+    # ============================================
+
+    async def recover(self) -> int:
+        """
+        復原未完成的文件（啟動時呼叫）
+
+        沒有 queued / running 工作的 pending 或 processing 文件（行程重啟時中斷，
+        或在佇列啟用前以 BackgroundTasks 處理）重設為 pending 並重新排入佇列。
+        每個 uvicorn worker 與獨立 worker 行程啟動時都會呼叫，以 SELECT ... FOR UPDATE
+        鎖定文件列並以鎖定讀取檢查進行中的工作，同時啟動的行程不會重複排入。
+        租約過期的 running 工作不需處理，lease() 會直接重新取得（或由 sweep_exhausted 結束）。
+
+        Returns:
+            int: 重新排入佇列的文件數
+        """
+        async with AsyncSessionLocal() as db:
+            # 鎖定候選文件（依 ID 順序，避免死結）：同時啟動的行程在此排隊，
+            # 後到者於前者提交後才讀到其建立的工作，不會重複排入
+            result = await db.execute(
+                select(Document)
+                .where(Document.processing_status.in_([DocumentStatus.PENDING, DocumentStatus.PROCESSING]))
+                .order_by(Document.id)
+                .with_for_update()
+            )
+            candidates = result.scalars().all()
+
+            active = set()
+            if candidates:
+                active_result = await db.execute(
+                    select(IngestionJob.document_id)
+                    .where(
+                        IngestionJob.document_id.in_([d.id for d in candidates]),
+                        IngestionJob.status.in_([IngestionJobStatus.QUEUED, IngestionJobStatus.RUNNING])
+                    )
+                    .with_for_update()
+                )
+                active = set(active_result.scalars().all())
+
+            documents = [d for d in candidates if d.id not in active]
+            for document in documents:
+                if document.processing_status == DocumentStatus.PROCESSING:
+                    logging.warning(f"Document {document.id} was left in processing, re-queuing")
+                document.processing_status = DocumentStatus.PENDING
+                self.enqueue(db, document.id)
+            await db.commit()
+
+        if documents:
+            logging.info(f"Recovered {len(documents)} unfinished documents into the ingestion queue")
+            self.notify()
+        return len(documents)
+
+    async def stats(self) -> Dict[str, Any]:
+        """取得各狀態的工作數"""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(IngestionJob.status, func.count()).group_by(IngestionJob.status)
+            )).all()
+        counts = {status.value: 0 for status in IngestionJobStatus}
+        counts.update({status.value: count for status, count in rows})
+        return counts
+
+
+# 單例實例
+ingestion_queue = IngestionJobQueue()
@@ -4,10 +4,11 @@
 負責解析 TXT 和 Markdown 文件，提取純文字內容
 """
 
+import codecs
 import os
 import re
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 from dataclasses import dataclass
 
 
@@ -21,6 +22,89 @@ class ParsedDocument:
     file_type: str = ""
 
 
+class ParsedStream:
+    """
+    串流解析結果
+
+    逐塊產生與 DocumentParser.parse 的 content 相同的文字（去除開頭空白與 frontmatter），
+    記憶體用量與檔案大小無關；字數、行數在讀取過程中累計，讀取完畢後才是完整值
+
+    注意：
+    - 只能迭代一次
+    - 編碼由檔案開頭的樣本判定，之後無法以該編碼解碼的位元組以 U+FFFD 取代
+    - frontmatter 需完整出現在開頭樣本內才會移除
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        file_type: str,
+        encoding: str,
+        block_size: int,
+        head_size: int
+    ):
+        self.file_path = file_path
+        self.file_type = file_type
+        self.encoding = encoding
+        self.block_size = block_size
+        self.head_size = head_size
+        self.file_size = os.path.getsize(file_path)
+
+        self.title: Optional[str] = None
+        self.word_count = 0
+        self.line_count = 0
+        self.bytes_read = 0
+
+    @property
+    def progress(self) -> float:
+        """已讀取的比例（0-1）"""
+        return min(1.0, self.bytes_read / self.file_size) if self.file_size else 1.0
+
+    def __iter__(self) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+        head = ""
+        head_done = False
+
+        with open(self.file_path, "rb") as f:
+            while True:
+                data = f.read(self.block_size)
+                self.bytes_read += len(data)
+                text = decoder.decode(data, final=not data)
+
+                # 開頭樣本：與 parse() 相同地去除開頭空白、提取標題、移除 frontmatter
+                if not head_done:
+                    head += text
+                    if len(head) < self.head_size and data:
+                        continue
+                    head_done = True
+                    text = self._prepare_head(head)
+                    head = ""
+
+                if text:
+                    self.word_count += len(text)
+                    self.line_count += text.count("\n")
+                    yield text
+                if not data:
+                    break
+
+        # 與 parse() 的行數一致（最後一行沒有換行符）
+        self.line_count += 1
+
+    def _prepare_head(self, head: str) -> str:
+        head = head.lstrip()
+        lines = head[:4096].split("\n")
+        if self.file_type == "md":
+            self.title = DocumentParser._markdown_title(lines)
+            # 同 _remove_frontmatter，但只去除開頭空白（樣本結尾之後還有內容）
+            if head.startswith("---"):
+                end_index = head.find("---", 3)
+                if end_index != -1:
+                    head = head[end_index + 3:].lstrip()
+        else:
+            self.title = DocumentParser._text_title(lines)
+        return head
+
+
 class DocumentParser:
     """
     文件解析器
@@ -38,6 +122,10 @@ class DocumentParser:
 
     SUPPORTED_ENCODINGS = ["utf-8", "utf-8-sig", "gbk", "big5", "latin-1"]
 
+    # 串流模式：判定編碼的樣本大小與每次讀取的區塊大小（bytes）
+    ENCODING_SAMPLE_SIZE = 64 * 1024
+    STREAM_BLOCK_SIZE = 64 * 1024
+
     def __init__(self):
         pass
 
@@ -56,6 +144,49 @@ class DocumentParser:
             ValueError: 不支援的檔案格式
             UnicodeDecodeError: 編碼錯誤
         """
+        file_ext = self._check_file(file_path)
+
+        # 讀取檔案內容（嘗試多種編碼）
+        content = self._read_file_with_encoding(file_path)
+
+        # 解析內容
+        if file_ext == "md":
+            return self._parse_markdown(content, file_ext)
+        else:
+            return self._parse_text(content, file_ext)
+
+    def open_stream(self, file_path: str) -> ParsedStream:
+        """
+        以串流模式解析文件（大檔案使用，記憶體用量固定）
+
+        只讀取開頭 ENCODING_SAMPLE_SIZE bytes 判定編碼，之後逐塊解碼
+
+        Args:
+            file_path: 文件路徑
+
+        Returns:
+            ParsedStream: 可迭代的文字區塊
+
+        Raises:
+            FileNotFoundError: 檔案不存在
+            ValueError: 不支援的檔案格式
+        """
+        file_ext = self._check_file(file_path)
+        with open(file_path, "rb") as f:
+            sample = f.read(self.ENCODING_SAMPLE_SIZE)
+            at_eof = not f.read(1)
+
+        return ParsedStream(
+            file_path=file_path,
+            file_type=file_ext,
+            encoding=self.detect_encoding(sample, final=at_eof),
+            block_size=self.STREAM_BLOCK_SIZE,
+            head_size=self.ENCODING_SAMPLE_SIZE
+        )
+
+    @staticmethod
+    def _check_file(file_path: str) -> str:
+        """檢查檔案存在且格式受支援，返回檔案類型"""
         path = Path(file_path)
 
         if not path.exists():
@@ -65,36 +196,50 @@ class DocumentParser:
         file_ext = path.suffix.lower().lstrip(".")
         if file_ext not in ["txt", "md"]:
             raise ValueError(f"不支援的檔案格式: {file_ext}")
+        return file_ext
 
-        # 讀取檔案內容（嘗試多種編碼）
-        content = self._read_file_with_encoding(file_path)
+    def detect_encoding(self, sample: bytes, final: bool = True) -> str:
+        """
+        依樣本判定編碼（按 SUPPORTED_ENCODINGS 順序取第一個能解碼的編碼）
 
-        # 解析內容
-        if file_ext == "md":
-            return self._parse_markdown(content, file_ext)
-        else:
-            return self._parse_text(content, file_ext)
+        Args:
+            sample: 檔案開頭的位元組
+            final: 樣本是否為完整檔案（否則容許結尾被截斷的多位元組字元）
+
+        Returns:
+            str: 編碼名稱
+        """
+        for encoding in self.SUPPORTED_ENCODINGS:
+            try:
+                codecs.getincrementaldecoder(encoding)().decode(sample, final=final)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        return "utf-8"
 
     def _read_file_with_encoding(self, file_path: str) -> str:
         """
         嘗試使用多種編碼讀取檔案
 
+        檔案只讀取一次，依序嘗試以各編碼解碼記憶體中的內容
+
         Args:
             file_path: 檔案路徑
 
         Returns:
             str: 檔案內容
         """
+        with open(file_path, "rb") as f:
+            data = f.read()
+
         for encoding in self.SUPPORTED_ENCODINGS:
             try:
-                with open(file_path, "r", encoding=encoding) as f:
-                    return f.read()
+                return data.decode(encoding)
             except UnicodeDecodeError:
                 continue
 
         # 如果所有編碼都失敗，使用 errors='replace' 強制讀取
-        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
-            return f.read()
+        return data.decode("utf-8", errors="replace")
 
     def _parse_text(self, content: str, file_type: str) -> ParsedDocument:
         """解析純文字檔案"""
@@ -106,17 +251,9 @@ class DocumentParser:
         line_count = len(lines)
         word_count = len(content)
 
-        # 嘗試提取標題（第一行非空行）
-        title = None
-        for line in lines:
-            line = line.strip()
-            if line:
-                title = line[:100]  # 限制標題長度
-                break
-
         return ParsedDocument(
             content=content,
-            title=title,
+            title=self._text_title(lines),
             word_count=word_count,
             line_count=line_count,
             file_type=file_type
@@ -136,20 +273,7 @@ class DocumentParser:
         line_count = len(lines)
         word_count = len(content)
 
-        # 嘗試提取 H1 標題
-        title = None
-        for line in lines:
-            line_stripped = line.strip()
-            # 匹配 # 開頭的標題
-            if line_stripped.startswith("# "):
-                title = line_stripped[2:].strip()[:100]
-                break
-            # 跳過空行和元數據
-            if line_stripped and not line_stripped.startswith("---"):
-                # 如果沒有 H1，使用第一行非空內容
-                if title is None:
-                    title = line_stripped[:100]
-                break
+        title = self._markdown_title(lines)
 
         # 移除 YAML frontmatter（如果有）
         content = self._remove_frontmatter(content)
@@ -162,7 +286,31 @@ class DocumentParser:
             file_type=file_type
         )
 
-    def _remove_frontmatter(self, content: str) -> str:
+    @staticmethod
+    def _text_title(lines: list) -> Optional[str]:
+        """提取純文字標題（第一行非空行）"""
+        for line in lines:
+            line = line.strip()
+            if line:
+                return line[:100]  # 限制標題長度
+        return None
+
+    @staticmethod
+    def _markdown_title(lines: list) -> Optional[str]:
+        """提取 Markdown 標題（H1，沒有 H1 時使用第一行非空內容）"""
+        for line in lines:
+            line_stripped = line.strip()
+            # 匹配 # 開頭的標題
+            if line_stripped.startswith("# "):
+                return line_stripped[2:].strip()[:100]
+            # 跳過空行和元數據
+            if line_stripped and not line_stripped.startswith("---"):
+                # 如果沒有 H1，使用第一行非空內容
+                return line_stripped[:100]
+        return None
+
+    @staticmethod
+    def _remove_frontmatter(content: str) -> str:
         """移除 YAML frontmatter"""
         if content.startswith("---"):
             # 找到結束的 ---
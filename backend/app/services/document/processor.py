@@ -5,22 +5,53 @@
 """
 
 import asyncio
+import json
 import logging
-from typing import Optional, List, Callable
+import os
+from concurrent.futures import Executor
+from itertools import islice
+from typing import Optional, List, Callable, Tuple, AsyncIterator, Iterator
 from dataclasses import dataclass
 from datetime import datetime
 
+import httpx
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from app.models.document import Document, DocumentStatus
 from app.services.document.parser import DocumentParser, ParsedDocument
-from app.services.document.chunker import TextChunker, TextChunk
+from app.services.document.chunker import TextChunker, TextChunk, HierarchicalChunker
 from app.services.rag.embedder import embedding_service
 from app.services.rag.vectorstore import vectorstore_service
+from app.services.rag.lexical_index import lexical_index_service
+from app.services.rag.parent_store import parent_store
+from app.services.rag.document_index import CentroidAccumulator, document_centroid_index
+from app.services.rag.retrieval_cache import index_versions
 from app.core.config import settings
 
 
+def parse_and_chunk(
+    parser: DocumentParser,
+    chunker: TextChunker,
+    hierarchical_chunker: Optional[HierarchicalChunker],
+    file_path: str,
+    metadata: dict
+) -> Tuple[ParsedDocument, Optional[List[TextChunk]], List[TextChunk]]:
+    """
+    解析並分塊（CPU 密集階段）
+
+    模組層級函式，可送入 ProcessPoolExecutor 在子行程中執行（參數與返回值皆可 pickle）
+
+    Returns:
+        (解析結果, 父段落（未啟用父子分塊時為 None）, 切片)
+    """
+    parsed = parser.parse(file_path)
+    if hierarchical_chunker is not None:
+        parents, chunks = hierarchical_chunker.split(parsed.content, metadata)
+        return parsed, parents, chunks
+    return parsed, None, chunker.split(parsed.content, metadata)
+
+
 @dataclass
 class ProcessingResult:
     """處理結果"""
@@ -29,6 +60,19 @@ class ProcessingResult:
     chunk_count: int = 0
     error_message: Optional[str] = None
     chunks: Optional[List[TextChunk]] = None
+    retryable: bool = True  # 失敗時重試是否可能成功（文件已不存在、檔案無法解析時為 False）
+
+
+# 解析與分塊拋出的錯誤（不支援的格式、無法解碼、檔案遺失），重試不會得到不同結果
+# json.JSONDecodeError 雖是 ValueError，來自外部服務的回應，仍視為暫時性錯誤
+PERMANENT_ERRORS = (ValueError, FileNotFoundError, IsADirectoryError)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """判斷處理失敗的例外重試是否可能成功（連線、資料庫、向量庫錯誤）"""
+    if isinstance(error, json.JSONDecodeError):
+        return True
+    return not isinstance(error, PERMANENT_ERRORS)
 
 
 class DocumentProcessor:
@@ -38,23 +82,48 @@ class DocumentProcessor:
     業務邏輯：
     1. 解析文件內容
     2. 將內容分塊
-    3. 向量化並存入 Chroma
+    3. 向量化並存入 Chroma，同時寫入 BM25 詞彙索引
     4. 更新文件狀態
 
     處理流程：
     pending -> processing -> completed/failed
+
+    向量化管線：
+    - 以 INGEST_UPSERT_BATCH_SIZE 分批，向量化第 N 批時同時寫入第 N-1 批
+    - 同時只保留兩批向量在記憶體中，避免單一巨大請求逾時
+    - 使用 upsert 寫入，失敗重試不會產生重複資料
+    - 同時累加切片向量，完成後保存文件中心向量（兩階段檢索使用）
+
+    父子分塊（HIERARCHICAL_CHUNKING_ENABLED）：
+    - 父段落存入 ParentChunkStore，只有子塊向量化並寫入向量庫與 BM25 索引
+    - chunk_count 為子塊數
+
+    CPU 密集階段（解析 + 分塊）：
+    - 指定 cpu_executor（獨立 worker 行程的 ProcessPoolExecutor）時在子行程中執行
+    - 否則在預設執行緒池中執行，不阻塞事件迴圈
+    - 向量化與寫入維持在事件迴圈中以 async 執行
+
+    串流模式（檔案大小達 INGEST_STREAMING_THRESHOLD）：
+    - 以開頭樣本判定編碼後逐塊解碼，分塊器依序產生切片，逐批直接送入向量化管線
+    - 記憶體用量與檔案大小無關；不支援父子分塊（啟用時一律一次處理）
     """
 
     def __init__(
         self,
         parser: Optional[DocumentParser] = None,
-        chunker: Optional[TextChunker] = None
+        chunker: Optional[TextChunker] = None,
+        hierarchical_chunker: Optional[HierarchicalChunker] = None,
+        cpu_executor: Optional[Executor] = None
     ):
         self.parser = parser or DocumentParser()
         self.chunker = chunker or TextChunker(
             chunk_size=settings.CHUNK_SIZE,
             chunk_overlap=settings.CHUNK_OVERLAP
         )
+        self.hierarchical_chunker = hierarchical_chunker
+        if self.hierarchical_chunker is None and settings.HIERARCHICAL_CHUNKING_ENABLED:
+            self.hierarchical_chunker = HierarchicalChunker()
+        self.cpu_executor = cpu_executor
 
     async def process_document(
         self,
@@ -83,7 +152,8 @@ class DocumentProcessor:
             return ProcessingResult(
                 success=False,
                 document_id=document_id,
-                error_message="文件不存在"
+                error_message="文件不存在",
+                retryable=False
             )
 
         try:
@@ -94,28 +164,19 @@ class DocumentProcessor:
             if on_progress:
                 on_progress(10, "開始解析文件")
 
-            # 3. 解析文件
-            parsed = self.parser.parse(document.file_path)
-            logging.info(f"Document {document_id} parsed: {parsed.line_count} lines, {len(parsed.content)} chars")
-
-            if on_progress:
-                on_progress(30, "文件解析完成，開始分塊")
-
-            # 4. 分塊
+            # 3-5. 解析、分塊、向量化並存入 Chroma
             metadata = {
                 "document_id": document.id,
                 "group_id": document.group_id,
                 "filename": document.original_filename,
                 "file_type": document.file_type
             }
-            chunks = self.chunker.split(parsed.content, metadata)
-            logging.info(f"Document {document_id} chunked: {len(chunks)} chunks")
-
-            if on_progress:
-                on_progress(50, f"分塊完成，共 {len(chunks)} 個塊，開始向量化")
-
-            # 5. 向量化並存入 Chroma
-            await self._vectorize_chunks(chunks, document)
+            if self._use_streaming(document.file_path):
+                chunks = None
+                chunk_count, line_count = await self._process_streaming(document, metadata, on_progress)
+            else:
+                chunks, line_count = await self._process_in_memory(document, metadata, on_progress)
+                chunk_count = len(chunks)
             logging.info(f"Document {document_id} vectorized and stored in Chroma")
 
             if on_progress:
@@ -123,17 +184,20 @@ class DocumentProcessor:
 
             # 6. 更新文件狀態
             document.processing_status = DocumentStatus.COMPLETED
-            document.chunk_count = len(chunks)
-            document.page_count = parsed.line_count // 50 + 1  # 估算頁數
+            document.chunk_count = chunk_count
+            document.page_count = line_count // 50 + 1  # 估算頁數
             await db.commit()
 
+            # 群組內容已改變，使檢索快取失效
+            await index_versions.bump(document.group_id)
+
             if on_progress:
                 on_progress(100, "處理完成")
 
             return ProcessingResult(
                 success=True,
                 document_id=document_id,
-                chunk_count=len(chunks),
+                chunk_count=chunk_count,
                 chunks=chunks
             )
 
@@ -144,48 +208,253 @@ class DocumentProcessor:
             document.error_message = str(e)
             await db.commit()
 
+            # 失敗前可能已寫入部分切片
+            await index_versions.bump(document.group_id)
+
             return ProcessingResult(
                 success=False,
                 document_id=document_id,
-                error_message=str(e)
+                error_message=str(e),
+                retryable=is_retryable_error(e)
             )
 
-    async def _vectorize_chunks(self, chunks: List[TextChunk], document: Document):
+    def _use_streaming(self, file_path: str) -> bool:
+        """檔案大小達 INGEST_STREAMING_THRESHOLD 時使用串流模式（父子分塊模式不支援串流）"""
+        threshold = settings.INGEST_STREAMING_THRESHOLD
+        if threshold < 0 or self.hierarchical_chunker is not None:
+            return False
+        try:
+            return os.path.getsize(file_path) >= threshold
+        except OSError:
+            return False  # 交由解析器回報檔案不存在
+
+    async def _process_in_memory(
+        self,
+        document: Document,
+        metadata: dict,
+        on_progress: Optional[Callable[[int, str], None]] = None
+    ) -> Tuple[List[TextChunk], int]:
         """
-        向量化切片並存入 Chroma
+        一次解析並分塊整份文件後向量化
 
-        Args:
-            chunks: 文本切片列表
-            document: 文件物件
+        Returns:
+            (切片列表, 行數)
         """
-        if not chunks:
-            return
+        parsed, parents, chunks = await asyncio.get_running_loop().run_in_executor(
+            self.cpu_executor,
+            parse_and_chunk,
+            self.parser,
+            self.chunker,
+            self.hierarchical_chunker,
+            document.file_path,
+            metadata
+        )
+        logging.info(f"Document {document.id} parsed: {parsed.line_count} lines, {len(parsed.content)} chars")
 
-        # 準備資料
-        texts = [chunk.content for chunk in chunks]
-        ids = [f"doc_{document.id}_chunk_{chunk.chunk_index}" for chunk in chunks]
-        metadatas = [
-            {
-                "document_id": document.id,
-                "group_id": document.group_id,
-                "filename": document.original_filename,
-                "chunk_index": chunk.chunk_index,
-                "start_char": chunk.start_char,
-                "end_char": chunk.end_char
-            }
-            for chunk in chunks
-        ]
+        if on_progress:
+            on_progress(30, "文件解析完成")
+
+        # 保存父段落
+        if parents is not None:
+            await parent_store.put_document(document.id, document.group_id, parents)
+            logging.info(
+                f"Document {document.id} chunked: {len(parents)} parents, {len(chunks)} child chunks"
+            )
+        else:
+            logging.info(f"Document {document.id} chunked: {len(chunks)} chunks")
+
+        if on_progress:
+            on_progress(50, f"分塊完成，共 {len(chunks)} 個塊，開始向量化")
+
+        await self._vectorize_chunks(self._list_batches(chunks), document, on_progress, total=len(chunks))
+        return chunks, parsed.line_count
 
-        # 生成 embeddings
-        embedding_result = await embedding_service.embed_texts(texts)
+    async def _process_streaming(
+        self,
+        document: Document,
+        metadata: dict,
+        on_progress: Optional[Callable[[int, str], None]] = None
+    ) -> Tuple[int, int]:
+        """
+        串流解析並分塊，切片逐批送入向量化管線（記憶體用量與檔案大小無關）
+
+        解析與分塊在執行緒中逐批進行（產生器無法送入子行程）
 
-        # 存入 Chroma
-        await vectorstore_service.add_documents(
-            ids=ids,
-            documents=texts,
-            embeddings=embedding_result.embeddings,
-            metadatas=metadatas
+        Returns:
+            (切片數, 行數)
+        """
+        stream = self.parser.open_stream(document.file_path)
+        logging.info(
+            f"Document {document.id} streaming: {stream.file_size} bytes, encoding {stream.encoding}"
+        )
+        if on_progress:
+            on_progress(50, "串流解析、分塊並向量化")
+
+        chunk_count = await self._vectorize_chunks(
+            self._stream_batches(self.chunker.split_stream(stream, metadata)),
+            document,
+            on_progress,
+            progress=lambda: stream.progress
+        )
+        logging.info(
+            f"Document {document.id} parsed: {stream.line_count} lines, {stream.word_count} chars, "
+            f"{chunk_count} chunks"
         )
+        return chunk_count, stream.line_count
+
+    @staticmethod
+    async def _list_batches(chunks: List[TextChunk]) -> AsyncIterator[List[TextChunk]]:
+        """將切片列表依 INGEST_UPSERT_BATCH_SIZE 分批"""
+        batch_size = max(1, settings.INGEST_UPSERT_BATCH_SIZE)
+        for i in range(0, len(chunks), batch_size):
+            yield chunks[i:i + batch_size]
+
+    @staticmethod
+    async def _stream_batches(chunks: Iterator[TextChunk]) -> AsyncIterator[List[TextChunk]]:
+        """在執行緒中從切片產生器取出每批 INGEST_UPSERT_BATCH_SIZE 個切片"""
+        batch_size = max(1, settings.INGEST_UPSERT_BATCH_SIZE)
+        while True:
+            batch = await asyncio.to_thread(lambda: list(islice(chunks, batch_size)))
+            if not batch:
+                return
+            yield batch
+
+    async def _vectorize_chunks(
+        self,
+        batches: AsyncIterator[List[TextChunk]],
+        document: Document,
+        on_progress: Optional[Callable[[int, str], None]] = None,
+        total: Optional[int] = None,
+        progress: Optional[Callable[[], float]] = None
+    ) -> int:
+        """
+        向量化切片並存入 Chroma（分批管線）
+
+        Args:
+            batches: 依序的切片批次
+            document: 文件物件
+            on_progress: 進度回調函數（每批寫入完成後回報，50-90）
+            total: 切片總數（已知時依寫入數回報進度）
+            progress: 總數未知時（串流模式）取得完成比例的函數
+
+        Returns:
+            int: 寫入的切片數
+        """
+        # 重新處理時切片數可能變少，先移除舊切片以免殘留的高序號切片仍被檢索
+        await self._delete_document_chunks(document)
+
+        pending: Optional[asyncio.Task] = None
+        stored = 0
+        centroids = CentroidAccumulator(n_centroids=settings.DOCUMENT_CENTROIDS_PER_DOC)
+
+        async def wait_pending():
+            nonlocal stored
+            stored += await pending
+            if total is not None:
+                logging.info(f"Document {document.id}: stored {stored}/{total} chunks")
+                fraction, message = stored / total, f"向量化中：已寫入 {stored}/{total} 個塊"
+            else:
+                logging.info(f"Document {document.id}: stored {stored} chunks")
+                fraction, message = (progress() if progress else 0.0), f"向量化中：已寫入 {stored} 個塊"
+            if on_progress:
+                on_progress(50 + int(40 * fraction), message)
+
+        try:
+            async for batch in batches:
+                texts = [chunk.content for chunk in batch]
+
+                # 向量化本批（此時上一批仍在寫入）
+                embedding_result = await embedding_service.embed_texts(texts)
+                centroids.add(embedding_result.embeddings)
+
+                if pending is not None:
+                    await wait_pending()
+
+                pending = asyncio.create_task(self._upsert_batch(
+                    ids=[f"doc_{document.id}_chunk_{chunk.chunk_index}" for chunk in batch],
+                    texts=texts,
+                    embeddings=embedding_result.embeddings,
+                    metadatas=[self._chunk_metadata(chunk, document) for chunk in batch]
+                ))
+
+            if pending is not None:
+                await wait_pending()
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+        document_centroids = centroids.centroids()
+        if document_centroids is not None:
+            await document_centroid_index.put_document(document.id, document.group_id, document_centroids)
+        else:
+            await document_centroid_index.delete_document(document.id)
+        return stored
+
+    @staticmethod
+    async def _delete_document_chunks(document: Document) -> None:
+        """刪除文件在向量庫與詞彙索引中的所有切片（首次處理時沒有資料，不影響）"""
+        await vectorstore_service.delete_by_filter({
+            "$and": [
+                {"document_id": {"$eq": document.id}},
+                {"group_id": {"$eq": document.group_id}}
+            ]
+        })
+        await lexical_index_service.delete_document(document.group_id, document.id)
+
+    @staticmethod
+    def _chunk_metadata(chunk: TextChunk, document: Document) -> dict:
+        """建立切片的向量庫 metadata"""
+        metadata = {
+            "document_id": document.id,
+            "group_id": document.group_id,
+            "filename": document.original_filename,
+            "chunk_index": chunk.chunk_index,
+            "start_char": chunk.start_char,
+            "end_char": chunk.end_char
+        }
+        if chunk.metadata and "parent_index" in chunk.metadata:
+            metadata["parent_index"] = chunk.metadata["parent_index"]
+        return metadata
+
+    async def _upsert_batch(
+        self,
+        ids: List[str],
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[dict]
+    ) -> int:
+        """
+        寫入一批向量，暫時性錯誤（連線錯誤、429、5xx）以指數退避重試
+
+        Returns:
+            int: 寫入筆數
+        """
+        max_retries = settings.INGEST_UPSERT_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            try:
+                await vectorstore_service.upsert_documents(
+                    ids=ids,
+                    documents=texts,
+                    embeddings=embeddings,
+                    metadatas=metadatas
+                )
+                if settings.HYBRID_SEARCH_ENABLED:
+                    await lexical_index_service.add_chunks(ids, texts, metadatas)
+                return len(ids)
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                retryable = (
+                    isinstance(e, httpx.TransportError)
+                    or e.response.status_code == 429
+                    or e.response.status_code >= 500
+                )
+                if not retryable or attempt == max_retries:
+                    raise
+                delay = 0.5 * (2 ** attempt)
+                logging.warning(
+                    f"Vector upsert of {len(ids)} chunks failed ({e}), "
+                    f"retrying in {delay:.1f}s ({attempt + 1}/{max_retries})"
+                )
+                await asyncio.sleep(delay)
 
     async def process_documents_batch(
         self,
@@ -5,7 +5,7 @@ LLM 服務抽象基類
 """
 
 from abc import ABC, abstractmethod
-from typing import Optional, List, AsyncGenerator
+from typing import Optional, List, AsyncGenerator, Union
 from dataclasses import dataclass, field
 from datetime import datetime
 
@@ -44,6 +44,9 @@ class BaseLLMService(ABC):
     - generate(): 同步生成
     - generate_async(): 非同步生成
     - stream(): 串流生成
+
+    子類可覆寫：
+    - stream_chat(): 保留角色的多輪串流（預設退回 chat() 一次返回）
     """
 
     def __init__(
@@ -125,6 +128,30 @@ class BaseLLMService(ABC):
         """
         pass
 
+    async def stream_chat(
+        self,
+        messages: List[Message],
+        **kwargs
+    ) -> AsyncGenerator[Union[str, LLMResponse], None]:
+        """
+        串流多輪對話
+
+        與 chat() 使用相同的訊息結構（保留 system / user / assistant 角色），
+        因此串流與非串流路徑的 prompt 前綴一致
+
+        Args:
+            messages: 對話訊息
+            **kwargs: 額外參數
+
+        Yields:
+            str: 生成的文字片段
+            LLMResponse: 最後一項，包含完整內容與 token / 耗時統計
+        """
+        response = await self.chat(messages, **kwargs)
+        if response.content:
+            yield response.content
+        yield response
+
     @abstractmethod
     async def health_check(self) -> bool:
         """
@@ -0,0 +1,76 @@
+"""
+LLM 生成並行控制
+
+限制同時進行的 LLM 生成數量，避免 GPU 被過多請求同時佔用
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator
+
+from app.core.config import settings
+
+
+class GenerationLimiter:
+    """
+    LLM 生成名額
+
+    業務邏輯：
+    - 每次 LLM 生成（chat / stream_chat）需先取得一個名額，超過上限者排隊
+    - 名額以 async with 持有，生成完成、失敗或被取消（使用者中斷連線）時立即釋放
+    - 記錄進行中、排隊中與已取消的生成數量
+
+    配置：
+    - LLM_MAX_CONCURRENT_GENERATIONS: 同時進行的生成數上限
+    """
+
+    def __init__(self, max_concurrent: int = 4):
+        """
+        初始化生成名額
+
+        Args:
+            max_concurrent: 同時進行的生成數上限
+        """
+        self.max_concurrent = max(1, max_concurrent)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.cancelled = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        取得一個生成名額
+
+        使用方式：
+            async with generation_limiter.slot():
+                response = await llm.chat(messages)
+        """
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            yield
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """取得名額使用統計"""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "waiting": self.waiting,
+            "cancelled": self.cancelled,
+        }
+
+
+# 單例實例
+generation_limiter = GenerationLimiter(settings.LLM_MAX_CONCURRENT_GENERATIONS)
@@ -4,12 +4,13 @@ Google Gemini LLM 服務
 整合 Google Gemini API
 """
 
+import json
 import time
-import httpx
-from typing import Optional, List, AsyncGenerator
+from typing import Optional, List, AsyncGenerator, Union
 
 from app.services.llm.base import BaseLLMService, LLMResponse, Message
 from app.core.config import settings
+from app.core.http_client import http_clients
 
 
 class GeminiService(BaseLLMService):
@@ -58,6 +59,11 @@ class GeminiService(BaseLLMService):
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY 未設定")
 
+    @property
+    def _client(self):
+        """共用的 Gemini 連線池（支援時使用 HTTP/2）"""
+        return http_clients.get(http_clients.GEMINI)
+
     async def generate(
         self,
         prompt: str,
@@ -83,30 +89,16 @@ class GeminiService(BaseLLMService):
         """非同步多輪對話"""
         start_time = time.time()
 
-        # 轉換訊息格式
-        contents = self._convert_messages(messages)
-
         # 建立請求
-        payload = {
-            "contents": contents,
-            "generationConfig": {
-                "temperature": kwargs.get("temperature", self.temperature),
-                "topP": kwargs.get("top_p", 0.95),
-                "topK": kwargs.get("top_k", 40),
-            }
-        }
-
-        if self.max_tokens:
-            payload["generationConfig"]["maxOutputTokens"] = self.max_tokens
+        payload = self._build_payload(messages, **kwargs)
 
         # 發送請求
         model_name = kwargs.get("model", self.model)
         url = f"{self.BASE_URL}/models/{model_name}:generateContent?key={self.api_key}"
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            data = response.json()
+        response = await self._client.post(url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
 
         generation_time = time.time() - start_time
 
@@ -138,6 +130,22 @@ class GeminiService(BaseLLMService):
             }
         )
 
+    def _build_payload(self, messages: List[Message], **kwargs) -> dict:
+        """建立請求內容（串流與非串流共用，確保 prompt 一致）"""
+        payload = {
+            "contents": self._convert_messages(messages),
+            "generationConfig": {
+                "temperature": kwargs.get("temperature", self.temperature),
+                "topP": kwargs.get("top_p", 0.95),
+                "topK": kwargs.get("top_k", 40),
+            }
+        }
+
+        if self.max_tokens:
+            payload["generationConfig"]["maxOutputTokens"] = self.max_tokens
+
+        return payload
+
     def _convert_messages(self, messages: List[Message]) -> List[dict]:
         """將訊息轉換為 Gemini API 格式"""
         contents = []
@@ -180,53 +188,77 @@ class GeminiService(BaseLLMService):
 
         messages.append(Message(role="user", content=prompt))
 
-        # 轉換訊息格式
-        contents = self._convert_messages(messages)
+        async for chunk in self.stream_chat(messages, **kwargs):
+            if isinstance(chunk, str):
+                yield chunk
 
-        payload = {
-            "contents": contents,
-            "generationConfig": {
-                "temperature": kwargs.get("temperature", self.temperature),
-                "topP": kwargs.get("top_p", 0.95),
-                "topK": kwargs.get("top_k", 40),
-            }
-        }
+    async def stream_chat(
+        self,
+        messages: List[Message],
+        **kwargs
+    ) -> AsyncGenerator[Union[str, LLMResponse], None]:
+        """
+        串流多輪對話
 
-        if self.max_tokens:
-            payload["generationConfig"]["maxOutputTokens"] = self.max_tokens
+        使用 alt=sse 取得逐段的 JSON 事件；usageMetadata 與 finishReason
+        在最後的事件中，整理為 LLMResponse 返回
+
+        產生器被取消或提前關閉時，async with 會關閉上游串流，不再接收後續內容
+        """
+        start_time = time.time()
+        payload = self._build_payload(messages, **kwargs)
 
         model_name = kwargs.get("model", self.model)
-        url = f"{self.BASE_URL}/models/{model_name}:streamGenerateContent?key={self.api_key}"
-
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            async with client.stream("POST", url, json=payload) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line:
-                        import json
-                        # Gemini 串流回應格式可能包含多個 JSON 物件
-                        try:
-                            # 移除可能的前綴
-                            if line.startswith("data: "):
-                                line = line[6:]
-                            data = json.loads(line)
-                            candidates = data.get("candidates", [])
-                            if candidates:
-                                for part in candidates[0].get("content", {}).get("parts", []):
-                                    text = part.get("text", "")
-                                    if text:
-                                        yield text
-                        except json.JSONDecodeError:
-                            continue
+        url = f"{self.BASE_URL}/models/{model_name}:streamGenerateContent?alt=sse&key={self.api_key}"
+
+        parts: List[str] = []
+        usage_metadata: dict = {}
+        finish_reason = "STOP"
+        safety_ratings: list = []
+
+        async with self._client.stream("POST", url, json=payload, timeout=self.timeout) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                try:
+                    data = json.loads(line[6:])
+                except json.JSONDecodeError:
+                    continue
+
+                usage_metadata = data.get("usageMetadata") or usage_metadata
+                candidates = data.get("candidates", [])
+                if not candidates:
+                    continue
+
+                finish_reason = candidates[0].get("finishReason", finish_reason)
+                safety_ratings = candidates[0].get("safetyRatings", safety_ratings)
+                for part in candidates[0].get("content", {}).get("parts", []):
+                    text = part.get("text", "")
+                    if text:
+                        parts.append(text)
+                        yield text
+
+        yield LLMResponse(
+            content="".join(parts),
+            model=model_name,
+            prompt_tokens=usage_metadata.get("promptTokenCount"),
+            completion_tokens=usage_metadata.get("candidatesTokenCount"),
+            total_tokens=usage_metadata.get("totalTokenCount"),
+            generation_time=time.time() - start_time,
+            finish_reason=finish_reason,
+            metadata={
+                "safety_ratings": safety_ratings
+            }
+        )
 
     async def health_check(self) -> bool:
         """健康檢查"""
         try:
             # 發送一個簡單的請求來檢查 API 可用性
             url = f"{self.BASE_URL}/models/{self.model}?key={self.api_key}"
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url)
-                return response.status_code == 200
+            response = await self._client.get(url, timeout=10.0)
+            return response.status_code == 200
         except Exception:
             return False
 
@@ -234,14 +266,13 @@ class GeminiService(BaseLLMService):
         """列出可用模型"""
         try:
             url = f"{self.BASE_URL}/models?key={self.api_key}"
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url)
-                response.raise_for_status()
-                data = response.json()
-                return [
-                    model["name"].replace("models/", "")
-                    for model in data.get("models", [])
-                    if "generateContent" in model.get("supportedGenerationMethods", [])
-                ]
+            response = await self._client.get(url, timeout=10.0)
+            response.raise_for_status()
+            data = response.json()
+            return [
+                model["name"].replace("models/", "")
+                for model in data.get("models", [])
+                if "generateContent" in model.get("supportedGenerationMethods", [])
+            ]
         except Exception:
             return []
@@ -4,12 +4,14 @@ Ollama LLM 服務
 整合本地運行的 Ollama LLM
 """
 
+import json
 import time
-import httpx
-from typing import Optional, List, AsyncGenerator
+from typing import Optional, List, AsyncGenerator, Union, Dict, Any
 
 from app.services.llm.base import BaseLLMService, LLMResponse, Message
+from app.services.llm.tokens import estimate_messages_tokens
 from app.core.config import settings
+from app.core.http_client import http_clients
 
 
 class OllamaService(BaseLLMService):
@@ -21,12 +23,31 @@ class OllamaService(BaseLLMService):
     - 支援多種開源模型（如 gpt-oss-20b, qwen, llama 等）
     - 提供流式和非流式生成
 
+    Prompt 快取：
+    - 以 keep_alive 讓模型與 KV 快取留在記憶體，相同前綴的 prompt 不需重新 prefill
+    - num_ctx 依估算的 prompt 長度以 2 的冪次分級，且同一模型只增不減
+      （num_ctx 改變會讓 Ollama 重新載入模型並清空快取）
+    - 回應 metadata 記錄 prefill 耗時與估算的快取命中比例，並累計統計
+
     配置：
     - OLLAMA_BASE_URL: Ollama 服務地址
     - OLLAMA_MODEL: 預設模型
     - OLLAMA_TEMPERATURE: 生成溫度
+    - OLLAMA_KEEP_ALIVE: 模型保留時間
+    - OLLAMA_NUM_CTX / OLLAMA_NUM_CTX_MIN / OLLAMA_NUM_CTX_MAX: context 長度
     """
 
+    # 各模型目前使用的 num_ctx（跨實例共用，只增不減）
+    _num_ctx_by_model: Dict[str, int] = {}
+
+    # prefill 累計統計（跨實例共用）
+    _prefill_totals: Dict[str, float] = {
+        "requests": 0,
+        "estimated_prompt_tokens": 0,
+        "evaluated_prompt_tokens": 0,
+        "prefill_seconds": 0.0,
+    }
+
     def __init__(
         self,
         model: str = None,
@@ -52,6 +73,11 @@ class OllamaService(BaseLLMService):
         self.base_url = (base_url or settings.OLLAMA_BASE_URL).rstrip("/")
         self.timeout = timeout
 
+    @property
+    def _client(self):
+        """共用的 Ollama 連線池"""
+        return http_clients.get(http_clients.OLLAMA)
+
     async def generate(
         self,
         prompt: str,
@@ -88,10 +114,38 @@ class OllamaService(BaseLLMService):
         """呼叫 Ollama Chat API"""
         start_time = time.time()
 
+        prompt_estimate = estimate_messages_tokens(messages)
+        payload = self._build_payload(messages, stream=False, prompt_estimate=prompt_estimate, **kwargs)
+
+        response = await self._client.post(
+            f"{self.base_url}/api/chat",
+            json=payload,
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        generation_time = time.time() - start_time
+
+        # 解析回應
+        message = data.get("message", {})
+        content = message.get("content", "")
+
+        return self._build_response(data, content, generation_time, prompt_estimate)
+
+    def _build_payload(
+        self,
+        messages: List[dict],
+        stream: bool,
+        prompt_estimate: int = 0,
+        **kwargs
+    ) -> dict:
+        """建立 /api/chat 請求內容（串流與非串流共用，確保 prompt 一致）"""
+        model = kwargs.get("model", self.model)
         payload = {
-            "model": kwargs.get("model", self.model),
+            "model": model,
             "messages": messages,
-            "stream": False,
+            "stream": stream,
             "options": {
                 "temperature": kwargs.get("temperature", self.temperature),
             }
@@ -100,20 +154,44 @@ class OllamaService(BaseLLMService):
         if self.max_tokens:
             payload["options"]["num_predict"] = self.max_tokens
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                f"{self.base_url}/api/chat",
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
+        num_ctx = self._num_ctx(model, prompt_estimate)
+        if num_ctx:
+            payload["options"]["num_ctx"] = num_ctx
 
-        generation_time = time.time() - start_time
+        if settings.OLLAMA_KEEP_ALIVE:
+            payload["keep_alive"] = settings.OLLAMA_KEEP_ALIVE
 
-        # 解析回應
-        message = data.get("message", {})
-        content = message.get("content", "")
+        return payload
 
+    def _num_ctx(self, model: str, prompt_estimate: int) -> Optional[int]:
+        """
+        決定 num_ctx
+
+        - OLLAMA_NUM_CTX > 0 時固定使用該值
+        - 否則取「prompt 估算 + 回答保留」以上最小的 2 的冪次，限制在 MIN~MAX 之間
+        - 同一模型只增不減：縮小 num_ctx 會觸發模型重新載入，清空 KV 快取
+        """
+        if settings.OLLAMA_NUM_CTX > 0:
+            return settings.OLLAMA_NUM_CTX
+        if not prompt_estimate:
+            return self._num_ctx_by_model.get(model)
+
+        needed = prompt_estimate + (self.max_tokens or settings.OLLAMA_NUM_PREDICT_RESERVE)
+        bucket = max(settings.OLLAMA_NUM_CTX_MIN, 1 << (needed - 1).bit_length())
+        bucket = min(bucket, settings.OLLAMA_NUM_CTX_MAX)
+
+        num_ctx = max(bucket, self._num_ctx_by_model.get(model, 0))
+        self._num_ctx_by_model[model] = num_ctx
+        return num_ctx
+
+    def _build_response(
+        self,
+        data: dict,
+        content: str,
+        generation_time: float,
+        prompt_estimate: int = 0
+    ) -> LLMResponse:
+        """由最終回應（非串流回應或串流的 done 訊息）建立 LLMResponse"""
         # Token 統計（Ollama 提供）
         prompt_tokens = data.get("prompt_eval_count")
         completion_tokens = data.get("eval_count")
@@ -121,6 +199,16 @@ class OllamaService(BaseLLMService):
         if prompt_tokens and completion_tokens:
             total_tokens = prompt_tokens + completion_tokens
 
+        # Prefill 統計：prompt_eval_count 只計入實際重新計算的 token，
+        # 命中 KV 快取的前綴不計入，因此可由估算的 prompt 長度推得快取比例
+        prefill_time = None
+        if data.get("prompt_eval_duration") is not None:
+            prefill_time = data["prompt_eval_duration"] / 1e9
+        prompt_cache_ratio = None
+        if prompt_estimate and prompt_tokens is not None:
+            prompt_cache_ratio = round(max(0.0, 1 - prompt_tokens / prompt_estimate), 3)
+            self._record_prefill(prompt_estimate, prompt_tokens, prefill_time or 0.0)
+
         return LLMResponse(
             content=content,
             model=data.get("model", self.model),
@@ -133,10 +221,37 @@ class OllamaService(BaseLLMService):
                 "ollama_done": data.get("done", True),
                 "total_duration": data.get("total_duration"),
                 "load_duration": data.get("load_duration"),
+                "prompt_eval_duration": data.get("prompt_eval_duration"),
                 "eval_duration": data.get("eval_duration"),
+                "prefill_time": prefill_time,
+                "estimated_prompt_tokens": prompt_estimate or None,
+                "prompt_cache_ratio": prompt_cache_ratio,
             }
         )
 
+    @classmethod
+    def _record_prefill(cls, estimated: int, evaluated: int, seconds: float) -> None:
+        totals = cls._prefill_totals
+        totals["requests"] += 1
+        totals["estimated_prompt_tokens"] += estimated
+        totals["evaluated_prompt_tokens"] += min(evaluated, estimated)
+        totals["prefill_seconds"] += seconds
+
+    @classmethod
+    def prefill_stats(cls) -> Dict[str, Any]:
+        """取得 prefill 累計統計（估算的 prompt 快取命中率與平均 prefill 耗時）"""
+        totals = cls._prefill_totals
+        requests = totals["requests"]
+        estimated = totals["estimated_prompt_tokens"]
+        return {
+            "requests": requests,
+            "estimated_prompt_tokens": estimated,
+            "evaluated_prompt_tokens": totals["evaluated_prompt_tokens"],
+            "prompt_cache_ratio": round(1 - totals["evaluated_prompt_tokens"] / estimated, 3) if estimated else 0.0,
+            "avg_prefill_time": round(totals["prefill_seconds"] / requests, 3) if requests else 0.0,
+            "num_ctx": dict(cls._num_ctx_by_model),
+        }
+
     async def stream(
         self,
         prompt: str,
@@ -147,68 +262,82 @@ class OllamaService(BaseLLMService):
         messages = []
 
         if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
+            messages.append(Message(role="system", content=system_prompt))
 
-        messages.append({"role": "user", "content": prompt})
+        messages.append(Message(role="user", content=prompt))
 
-        payload = {
-            "model": kwargs.get("model", self.model),
-            "messages": messages,
-            "stream": True,
-            "options": {
-                "temperature": kwargs.get("temperature", self.temperature),
-            }
-        }
+        async for chunk in self.stream_chat(messages, **kwargs):
+            if isinstance(chunk, str):
+                yield chunk
 
-        if self.max_tokens:
-            payload["options"]["num_predict"] = self.max_tokens
+    async def stream_chat(
+        self,
+        messages: List[Message],
+        **kwargs
+    ) -> AsyncGenerator[Union[str, LLMResponse], None]:
+        """
+        串流多輪對話
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            async with client.stream(
-                "POST",
-                f"{self.base_url}/api/chat",
-                json=payload
-            ) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line:
-                        import json
-                        data = json.loads(line)
-                        message = data.get("message", {})
-                        content = message.get("content", "")
-                        if content:
-                            yield content
-                        if data.get("done", False):
-                            break
+        與 chat() 送出相同的 payload（僅 stream=True），最後一個 done 訊息帶有
+        prompt_eval_count / eval_count 與各階段耗時，轉為 LLMResponse 返回
+
+        產生器被取消或提前關閉時，async with 會關閉上游回應連線，
+        Ollama 偵測到連線中斷即停止生成
+        """
+        start_time = time.time()
+        formatted_messages = [
+            {"role": msg.role, "content": msg.content}
+            for msg in messages
+        ]
+        prompt_estimate = estimate_messages_tokens(formatted_messages)
+        payload = self._build_payload(formatted_messages, stream=True, prompt_estimate=prompt_estimate, **kwargs)
+        parts: List[str] = []
+
+        async with self._client.stream(
+            "POST",
+            f"{self.base_url}/api/chat",
+            json=payload,
+            timeout=self.timeout
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                content = data.get("message", {}).get("content", "")
+                if content:
+                    parts.append(content)
+                    yield content
+                if data.get("done", False):
+                    yield self._build_response(data, "".join(parts), time.time() - start_time, prompt_estimate)
+                    break
 
     async def health_check(self) -> bool:
         """健康檢查"""
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{self.base_url}/")
-                return response.status_code == 200
+            response = await self._client.get(f"{self.base_url}/", timeout=5.0)
+            return response.status_code == 200
         except Exception:
             return False
 
     async def list_models(self) -> List[str]:
         """列出可用模型"""
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{self.base_url}/api/tags")
-                response.raise_for_status()
-                data = response.json()
-                return [model["name"] for model in data.get("models", [])]
+            response = await self._client.get(f"{self.base_url}/api/tags", timeout=10.0)
+            response.raise_for_status()
+            data = response.json()
+            return [model["name"] for model in data.get("models", [])]
         except Exception:
             return []
 
     async def pull_model(self, model_name: str) -> bool:
         """下載模型"""
         try:
-            async with httpx.AsyncClient(timeout=None) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/pull",
-                    json={"name": model_name}
-                )
-                return response.status_code == 200
+            response = await self._client.post(
+                f"{self.base_url}/api/pull",
+                json={"name": model_name},
+                timeout=None
+            )
+            return response.status_code == 200
         except Exception:
             return False
@@ -0,0 +1,89 @@
+"""
+Token 數估算
+
+不載入模型 tokenizer 的情況下估算文字的 token 數，
+用於設定 num_ctx、計算 prompt 快取命中率與上下文 token 預算
+"""
+
+import logging
+import math
+from typing import Callable, Iterable, Union
+
+from app.services.llm.base import Message
+
+
+# 每則訊息的角色標記與分隔符號開銷（chat template）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _is_cjk(char: str) -> bool:
+    code = ord(char)
+    return (
+        0x4E00 <= code <= 0x9FFF       # CJK 統一表意文字
+        or 0x3400 <= code <= 0x4DBF    # CJK 擴充 A
+        or 0x3040 <= code <= 0x30FF    # 平假名、片假名
+        or 0xAC00 <= code <= 0xD7AF    # 韓文
+        or 0x3000 <= code <= 0x303F    # CJK 標點
+        or 0xFF00 <= code <= 0xFFEF    # 全形字元
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文字的 token 數
+
+    估算規則（刻意偏高，避免 num_ctx 不足而截斷 prompt）：
+    - CJK 字元：每字約 1 個 token
+    - 其他字元：約 4 個字元 1 個 token
+
+    Args:
+        text: 文字
+
+    Returns:
+        int: 估算的 token 數
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if _is_cjk(char))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def estimate_messages_tokens(messages: Iterable[Union[Message, dict]]) -> int:
+    """
+    估算對話訊息的 token 數（含每則訊息的固定開銷）
+
+    Args:
+        messages: Message 物件或 {"role", "content"} 字典
+
+    Returns:
+        int: 估算的 token 數
+    """
+    total = 0
+    for message in messages:
+        content = message["content"] if isinstance(message, dict) else message.content
+        total += estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    return total
+
+
+def get_token_counter(name: str = "heuristic") -> Callable[[str], int]:
+    """
+    取得 token 計數函式
+
+    Args:
+        name: "heuristic"（預設，estimate_tokens）或 "tiktoken:<encoding>"（需安裝 tiktoken）
+
+    Returns:
+        Callable[[str], int]: 輸入文字、返回 token 數
+    """
+    if name.startswith("tiktoken:"):
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(name.split(":", 1)[1])
+            return lambda text: len(encoding.encode(text, disallowed_special=())) if text else 0
+        except ImportError:
+            logging.warning("tiktoken not installed, falling back to heuristic token estimate")
+        except ValueError as e:
+            logging.warning(f"Unknown tiktoken encoding, falling back to heuristic token estimate: {e}")
+    elif name != "heuristic":
+        logging.warning(f"Unknown tokenizer '{name}', falling back to heuristic token estimate")
+    return estimate_tokens
@@ -0,0 +1,243 @@
+"""
+近似最近鄰索引（IVF-Flat）
+
+為大型群組提供次線性的向量檢索，搭配 NumpyVectorStore 使用
+"""
+
+import json
+import logging
+import math
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+class IVFFlatIndex:
+    """
+    IVF-Flat 索引
+
+    業務邏輯：
+    - 以球面 k-means 將向量分為 nlist 個群（倒排清單）
+    - 查詢時只掃描與查詢最相近的 nprobe 個群，再對候選向量做精確 cosine 計分
+    - 召回率 / 延遲由 nprobe 調整：nprobe 越大越接近精確搜尋
+    - 增量新增：新向量直接指派到最近的群
+    - 增量刪除：與分區矩陣同步壓縮指派陣列
+    - 資料量成長超過訓練時的 rebuild_growth 倍時，需重新訓練（由呼叫端在背景執行）
+
+    資料結構：
+    - centroids: (nlist, dim) 已正規化的群中心
+    - assignments: 與分區矩陣列對齊的群編號陣列（int32）
+
+    注意：
+    - 向量本身不存於索引中，由分區的記憶體映射矩陣提供
+    """
+
+    CENTROIDS_FILE = "ivf_centroids.npy"
+    ASSIGNMENTS_FILE = "ivf_assignments.npy"
+    META_FILE = "ivf_meta.json"
+
+    def __init__(
+        self,
+        nlist: int = 0,
+        nprobe: int = 8,
+        rebuild_growth: float = 2.0,
+        kmeans_iterations: int = 10,
+        seed: int = 42
+    ):
+        """
+        初始化索引
+
+        Args:
+            nlist: 群數（0 表示依資料量自動決定，約 4 * sqrt(n)）
+            nprobe: 查詢時掃描的群數
+            rebuild_growth: 資料量成長倍數超過此值時需要重新訓練
+            kmeans_iterations: k-means 迭代次數
+            seed: 隨機種子
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.rebuild_growth = rebuild_growth
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.trained_size = 0
+        self.lock = threading.RLock()
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    # ============================================
+    # 訓練
+    # ============================================
+
+    def _auto_nlist(self, n: int) -> int:
+        if self.nlist:
+            return min(self.nlist, n)
+        return max(1, min(n, int(4 * math.sqrt(n))))
+
+    def train_centroids(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        以球面 k-means 訓練群中心（不修改索引狀態，可在背景執行緒呼叫）
+
+        Args:
+            vectors: 已正規化的向量 (n, dim)
+
+        Returns:
+            np.ndarray: 群中心 (nlist, dim)
+        """
+        n = len(vectors)
+        nlist = self._auto_nlist(n)
+        rng = np.random.default_rng(self.seed)
+
+        # 取樣訓練（每群約 64 個樣本即足夠）
+        sample_size = min(n, max(nlist * 64, 10000))
+        sample_rows = np.sort(rng.choice(n, size=sample_size, replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(self.kmeans_iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+
+            # 空群重新以隨機樣本初始化
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        return centroids
+
+    def assign(self, vectors: np.ndarray, centroids: np.ndarray = None, batch: int = 65536) -> np.ndarray:
+        """將向量指派到最近的群"""
+        centroids = self.centroids if centroids is None else centroids
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), batch):
+            block = np.asarray(vectors[start:start + batch], dtype=np.float32)
+            labels[start:start + batch] = np.argmax(block @ centroids.T, axis=1)
+        return labels
+
+    def install(self, centroids: np.ndarray, assignments: np.ndarray) -> None:
+        """套用新的訓練結果"""
+        with self.lock:
+            self.centroids = centroids
+            self.assignments = assignments.astype(np.int32)
+            self.trained_size = len(assignments)
+
+    def needs_rebuild(self, size: int, min_size: int) -> bool:
+        """是否需要（重新）訓練"""
+        if size < min_size:
+            return False
+        if not self.is_trained:
+            return True
+        return size > self.trained_size * self.rebuild_growth
+
+    # ============================================
+    # 增量維護
+    # ============================================
+
+    def append(self, vectors: np.ndarray) -> None:
+        """新增向量（指派到既有的群）"""
+        with self.lock:
+            if not self.is_trained:
+                return
+            self.assignments = np.concatenate([self.assignments, self.assign(vectors)])
+
+    def compact(self, kept_rows: np.ndarray) -> None:
+        """刪除後與分區矩陣同步壓縮"""
+        with self.lock:
+            if not self.is_trained:
+                return
+            self.assignments = self.assignments[kept_rows]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.centroids = None
+            self.assignments = np.zeros(0, dtype=np.int32)
+            self.trained_size = 0
+
+    # ============================================
+    # 查詢
+    # ============================================
+
+    def candidate_rows(self, query: np.ndarray, size: int, nprobe: int = None) -> Optional[np.ndarray]:
+        """
+        取得查詢的候選列
+
+        Args:
+            query: 已正規化的查詢向量
+            size: 分區目前的有效列數
+            nprobe: 掃描的群數（覆蓋預設值）
+
+        Returns:
+            Optional[np.ndarray]: 候選列；索引未訓練或與分區不同步時返回 None（改用精確搜尋）
+        """
+        with self.lock:
+            if not self.is_trained or len(self.assignments) != size:
+                return None
+
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            centroid_scores = self.centroids @ query
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+            return np.nonzero(np.isin(self.assignments, probes))[0]
+
+    # ============================================
+    # 持久化
+    # ============================================
+
+    def save(self, directory: Path) -> None:
+        """保存索引到磁碟"""
+        with self.lock:
+            if not self.is_trained:
+                for name in (self.CENTROIDS_FILE, self.ASSIGNMENTS_FILE, self.META_FILE):
+                    (directory / name).unlink(missing_ok=True)
+                return
+            directory.mkdir(parents=True, exist_ok=True)
+            np.save(directory / self.CENTROIDS_FILE, self.centroids)
+            np.save(directory / self.ASSIGNMENTS_FILE, self.assignments)
+            (directory / self.META_FILE).write_text(json.dumps({
+                "trained_size": self.trained_size,
+                "nlist": int(len(self.centroids)),
+            }))
+
+    def load(self, directory: Path, vectors: np.ndarray = None) -> bool:
+        """
+        從磁碟載入索引
+
+        指派陣列與分區列數不一致時（例如寫入中途中斷），以現有群中心重新指派
+
+        Returns:
+            bool: 是否載入成功
+        """
+        centroids_path = directory / self.CENTROIDS_FILE
+        if not centroids_path.exists():
+            self.reset()
+            return False
+
+        try:
+            centroids = np.load(centroids_path)
+            meta = json.loads((directory / self.META_FILE).read_text())
+            assignments_path = directory / self.ASSIGNMENTS_FILE
+            assignments = np.load(assignments_path) if assignments_path.exists() else None
+        except Exception as e:
+            logging.warning(f"Failed to load IVF index from {directory}: {e}")
+            self.reset()
+            return False
+
+        with self.lock:
+            self.centroids = centroids
+            self.trained_size = meta.get("trained_size", 0)
+            if vectors is not None and (assignments is None or len(assignments) != len(vectors)):
+                assignments = self.assign(vectors)
+            self.assignments = assignments if assignments is not None else np.zeros(0, dtype=np.int32)
+        return True
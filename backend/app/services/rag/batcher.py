@@ -0,0 +1,177 @@
+"""
+Embedding 微批次調度器
+
+將同時到達的多個查詢向量化請求合併為一次多輸入 API 呼叫
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Dict, Any, Callable, Awaitable
+
+
+@dataclass
+class _PendingRequest:
+    """等待中的請求"""
+    text: str
+    future: asyncio.Future
+    enqueued_at: float
+
+
+class EmbeddingBatcher:
+    """
+    動態微批次調度器
+
+    業務邏輯：
+    - 收到第一個請求後開啟一個短時間窗口
+    - 窗口內到達的請求合併為同一批，達到上限時立即送出
+    - 批次以一次多輸入請求送往 embedding 服務
+    - 每個呼叫者取回自己的向量；相同文本只送出一次
+    - 送出批次後立即開始收集下一批，不等待上一批完成
+
+    配置：
+    - EMBEDDING_QUERY_BATCH_WINDOW_MS: 收集窗口（毫秒）
+    - EMBEDDING_QUERY_BATCH_MAX_SIZE: 單批最大請求數
+
+    指標：
+    - 批次數、平均 / 最大批次大小
+    - 平均 / 最大排隊延遲（從送入佇列到批次送出）
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], Awaitable[List[List[float]]]],
+        window_ms: float = 5.0,
+        max_batch_size: int = 32
+    ):
+        """
+        初始化調度器
+
+        Args:
+            embed_fn: 批次向量化函數，輸入文本列表，返回相同順序的向量列表
+            window_ms: 收集窗口（毫秒）
+            max_batch_size: 單批最大請求數
+        """
+        self.embed_fn = embed_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._arrived: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight: set = set()
+
+        # 指標
+        self.batch_count = 0
+        self.request_count = 0
+        self.max_batch_seen = 0
+        self.total_queue_delay = 0.0
+        self.max_queue_delay = 0.0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        """在目前的事件迴圈上啟動收集工作"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._arrived = asyncio.Event()
+            self._worker = loop.create_task(self._collect())
+        return self._queue
+
+    async def submit(self, text: str) -> List[float]:
+        """
+        提交單一文本並等待其向量
+
+        Args:
+            text: 要向量化的文本
+
+        Returns:
+            List[float]: 向量表示
+        """
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        queue.put_nowait(_PendingRequest(text=text, future=future, enqueued_at=time.perf_counter()))
+        self._arrived.set()
+        return await future
+
+    async def _collect(self):
+        """
+        持續收集請求並組成批次
+
+        窗口內以 get_nowait 取出請求，佇列為空時等待到達事件（逾時即送出）；
+        不以 wait_for 包住 queue.get()，逾時取消時已取出的請求可能遺失
+        """
+        queue = self._queue
+        arrived = self._arrived
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.window
+
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                arrived.clear()
+                try:
+                    await asyncio.wait_for(arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[_PendingRequest]):
+        """送出一個批次並把結果分派給各呼叫者"""
+        # 呼叫者已取消的請求不再送出
+        pending = [req for req in batch if not req.future.done()]
+        if not pending:
+            return
+
+        now = time.perf_counter()
+        for req in pending:
+            delay = now - req.enqueued_at
+            self.total_queue_delay += delay
+            self.max_queue_delay = max(self.max_queue_delay, delay)
+        self.batch_count += 1
+        self.request_count += len(pending)
+        self.max_batch_seen = max(self.max_batch_seen, len(pending))
+
+        texts = list(dict.fromkeys(req.text for req in pending))
+
+        try:
+            vectors = await self.embed_fn(texts)
+        except Exception as e:
+            logging.warning(f"Embedding batch of {len(texts)} queries failed: {e}")
+            for req in pending:
+                if not req.future.done():
+                    req.future.set_exception(e)
+            return
+
+        results = dict(zip(texts, vectors))
+        for req in pending:
+            if not req.future.done():
+                req.future.set_result(results[req.text])
+
+    def stats(self) -> Dict[str, Any]:
+        """取得調度器指標"""
+        return {
+            "window_ms": round(self.window * 1000, 2),
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batch_count,
+            "requests": self.request_count,
+            "avg_batch_size": round(self.request_count / self.batch_count, 2) if self.batch_count else 0.0,
+            "max_batch_size_seen": self.max_batch_seen,
+            "avg_queue_delay_ms": round(self.total_queue_delay / self.request_count * 1000, 2) if self.request_count else 0.0,
+            "max_queue_delay_ms": round(self.max_queue_delay * 1000, 2),
+        }
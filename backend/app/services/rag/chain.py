@@ -4,13 +4,22 @@ RAG Chain
 整合檢索和生成的完整 RAG 流程
 """
 
-from typing import List, Optional, Dict, Any
+import copy
+import logging
+import time
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime
 
+import numpy as np
+
 from app.services.rag.retriever import RetrieverService, retriever_service, RetrievalResult
-from app.services.llm.base import BaseLLMService, Message
+from app.services.rag.context_packer import ContextPacker, PackedContext
+from app.services.llm.base import BaseLLMService, LLMResponse, Message
 from app.services.llm.factory import get_llm_service
+from app.services.llm.concurrency import generation_limiter
+from app.services.llm.tokens import get_token_counter
 from app.core.config import settings
 
 
@@ -26,6 +35,162 @@ class RAGResponse:
     metadata: Dict[str, Any] = field(default_factory=dict)
 
 
+@dataclass
+class _CachedAnswer:
+    """答案快取項目"""
+    question: str
+    vector: np.ndarray  # 已正規化的問題向量
+    scope: Tuple  # (document_ids, LLM)
+    version: int  # 寫入時的群組索引版本
+    expires_at: float
+    response: RAGResponse
+
+
+class SemanticAnswerCache:
+    """
+    語意答案快取
+
+    業務邏輯：
+    - 以問題的 embedding 比對同群組過去的問題，cosine 相似度達門檻即命中
+    - 只有在群組索引版本未變、document_ids 範圍與 LLM 相同時才可重用
+    - 每筆答案有 TTL；每個群組依 LRU 保留有限筆數
+    - 權限：呼叫端已驗證群組存取權，快取以群組與文件範圍隔離
+
+    配置：
+    - ANSWER_CACHE_SIMILARITY: 相似度門檻
+    - ANSWER_CACHE_TTL: 存活時間（秒）
+    - ANSWER_CACHE_MAX_PER_GROUP: 每個群組的最大筆數
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl: float = 3600.0,
+        max_entries_per_group: int = 256
+    ):
+        """
+        初始化快取
+
+        Args:
+            threshold: cosine 相似度門檻
+            ttl: 存活時間（秒）
+            max_entries_per_group: 每個群組的最大筆數
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries_per_group = max_entries_per_group
+        self.hits = 0
+        self.misses = 0
+
+        self._groups: Dict[Any, "OrderedDict[int, _CachedAnswer]"] = {}
+        self._next_id = 0
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def lookup(
+        self,
+        group_id: Any,
+        vector: List[float],
+        scope: Tuple,
+        version: int
+    ) -> Optional[Tuple[RAGResponse, float, str]]:
+        """
+        尋找語意相近且仍有效的答案
+
+        Args:
+            group_id: 群組 ID
+            vector: 問題向量
+            scope: (document_ids, LLM) 範圍
+            version: 群組目前的索引版本
+
+        Returns:
+            Optional[Tuple[RAGResponse, float, str]]: (回應複本, 相似度, 原問題)；未命中為 None
+        """
+        entries = self._groups.get(group_id)
+        if not entries:
+            self.misses += 1
+            return None
+
+        # 移除過期或版本已變的項目
+        now = time.time()
+        for entry_id in [
+            entry_id for entry_id, entry in entries.items()
+            if entry.expires_at < now or entry.version != version
+        ]:
+            del entries[entry_id]
+
+        candidates = [(entry_id, entry) for entry_id, entry in entries.items() if entry.scope == scope]
+        if not candidates:
+            self.misses += 1
+            return None
+
+        query = self._normalize(vector)
+        similarities = np.stack([entry.vector for _, entry in candidates]) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        entry_id, entry = candidates[best]
+        entries.move_to_end(entry_id)
+        self.hits += 1
+        return copy.deepcopy(entry.response), float(similarities[best]), entry.question
+
+    def store(
+        self,
+        group_id: Any,
+        question: str,
+        vector: List[float],
+        scope: Tuple,
+        version: int,
+        response: RAGResponse
+    ) -> None:
+        """
+        保存答案
+
+        Args:
+            group_id: 群組 ID
+            question: 原問題
+            vector: 問題向量
+            scope: (document_ids, LLM) 範圍
+            version: 檢索前讀取的群組索引版本
+            response: RAG 回應
+        """
+        entries = self._groups.setdefault(group_id, OrderedDict())
+        self._next_id += 1
+        entries[self._next_id] = _CachedAnswer(
+            question=question,
+            vector=self._normalize(vector),
+            scope=scope,
+            version=version,
+            expires_at=time.time() + self.ttl,
+            response=copy.deepcopy(response)
+        )
+        while len(entries) > self.max_entries_per_group:
+            entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空快取"""
+        self._groups.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        total = self.hits + self.misses
+        return {
+            "groups": len(self._groups),
+            "entries": sum(len(entries) for entries in self._groups.values()),
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
 class RAGChain:
     """
     RAG Chain
@@ -42,10 +207,24 @@ class RAGChain:
     - 上下文：檢索到的相關文件
     - 對話歷史：之前的對話（可選）
     - 使用者問題：當前問題
+
+    答案快取：
+    - 沒有對話歷史的問題（答案只取決於問題與文件）會查詢語意答案快取
+    - 命中時不呼叫 LLM，回應 metadata 標記 cache_hit
+
+    Prompt 組裝（PROMPT_LAYOUT）：
+    - stable：系統提示 -> 對話歷史 -> [上下文 + 當前時間 + 問題]
+      系統提示與歷史逐字不變，每輪只新增最後一則訊息，Ollama 可重用前綴的 KV 快取
+    - legacy：系統提示（含時間）-> 上下文 -> 對話歷史 -> 問題（原本的結構）
+
+    上下文 token 預算：
+    - 預算 = 模型上限 - 系統提示 - 對話歷史 - 問題 - 回答保留
+    - 檢索片段依排名填入預算，放不下者裁切或捨棄；來源只列出實際放入的片段
+    - 上下文 token 數與裁切、捨棄的片段數記錄在回應 metadata
     """
 
-    # 系統提示模板 (優化版)
-    SYSTEM_PROMPT_TEMPLATE = """你是一個專業的知識庫問答助手。請根據提供的文件內容精確回答問題。
+    # 系統提示（不含任何每次請求都會變動的內容）
+    SYSTEM_PROMPT = """你是一個專業的知識庫問答助手。請根據提供的文件內容精確回答問題。
 
 ## 回答規則
 
@@ -57,10 +236,20 @@ class RAGChain:
    - 如有多個要點，使用條列式呈現
 4. **坦承不知**：如果文件中確實沒有相關資訊，請回答「根據目前的文件內容，尚無法找到關於此問題的資訊」
 5. **語言匹配**：使用與問題相同的語言回答
+"""
 
+    # 系統提示模板（legacy 組裝，時間放在系統提示中）
+    SYSTEM_PROMPT_TEMPLATE = SYSTEM_PROMPT + """
 當前時間：{current_time}
 """
 
+    # 問題模板（stable 組裝，變動的上下文與時間放在 prompt 最後）
+    QUESTION_TEMPLATE = """{context}當前時間：{current_time}
+
+## 問題
+
+{question}"""
+
     # 上下文模板 (優化版)
     CONTEXT_TEMPLATE = """## 參考文件內容
 
@@ -83,7 +272,9 @@ class RAGChain:
         self,
         retriever: RetrieverService = None,
         llm_service: BaseLLMService = None,
-        top_k: int = None
+        top_k: int = None,
+        answer_cache: Optional[SemanticAnswerCache] = None,
+        context_packer: Optional[ContextPacker] = None
     ):
         """
         初始化 RAG Chain
@@ -92,10 +283,25 @@ class RAGChain:
             retriever: 檢索服務
             llm_service: LLM 服務
             top_k: 檢索數量
+            answer_cache: 語意答案快取（預設依 ANSWER_CACHE_* 建立）
+            context_packer: 上下文打包器（預設依 CONTEXT_* 建立）
         """
         self.retriever = retriever or retriever_service
         self.llm = llm_service or get_llm_service()
         self.top_k = top_k or settings.TOP_K_RETRIEVAL
+        if answer_cache is None and settings.ANSWER_CACHE_ENABLED:
+            answer_cache = SemanticAnswerCache(
+                threshold=settings.ANSWER_CACHE_SIMILARITY,
+                ttl=settings.ANSWER_CACHE_TTL,
+                max_entries_per_group=settings.ANSWER_CACHE_MAX_PER_GROUP
+            )
+        self.answer_cache = answer_cache
+        self.context_packer = context_packer or ContextPacker(
+            chunk_template=self.CHUNK_TEMPLATE,
+            context_template=self.CONTEXT_TEMPLATE,
+            token_counter=get_token_counter(settings.CONTEXT_TOKENIZER),
+            min_chunk_tokens=settings.CONTEXT_MIN_CHUNK_TOKENS
+        )
 
     async def query(
         self,
@@ -104,7 +310,8 @@ class RAGChain:
         document_ids: Optional[List[int]] = None,
         conversation_history: Optional[List[Dict[str, str]]] = None,
         top_k: int = None,
-        llm_provider: str = None
+        llm_provider: str = None,
+        access_scope: Optional[str] = None
     ) -> RAGResponse:
         """
         執行 RAG 查詢
@@ -116,20 +323,44 @@ class RAGChain:
             conversation_history: 對話歷史（可選）
             top_k: 檢索數量（覆蓋預設值）
             llm_provider: LLM 提供者（覆蓋預設值）
+            access_scope: 呼叫者的權限範圍（例如群組角色）；答案快取只在相同範圍內共用
 
         Returns:
             RAGResponse: RAG 回應
         """
         k = top_k or self.top_k
         retrieval_results = []
+        started = time.perf_counter()
+
+        # 選擇 LLM
+        llm = get_llm_service(llm_provider) if llm_provider else self.llm
+
+        # 0. 語意答案快取（只用於沒有對話歷史的問題）
+        cache_key = None
+        if self.answer_cache is not None and not conversation_history:
+            cache_key = await self._answer_cache_key(question, group_id, document_ids, llm, access_scope)
+            if cache_key is not None:
+                vector, scope, version = cache_key
+                cached = self.answer_cache.lookup(group_id, vector, scope, version)
+                if cached is not None:
+                    response, similarity, cached_question = cached
+                    response.generation_time = round(time.perf_counter() - started, 3)
+                    response.metadata.update({
+                        "cache_hit": True,
+                        "cache_similarity": round(similarity, 4),
+                        "cached_question": cached_question
+                    })
+                    return response
 
         # 1. 嘗試檢索相關文件
+        retrieval_failed = False
         try:
             if document_ids:
                 retrieval_results = await self.retriever.retrieve_for_documents(
                     query=question,
                     document_ids=document_ids,
-                    top_k=k
+                    top_k=k,
+                    group_id=group_id
                 )
             else:
                 retrieval_results = await self.retriever.retrieve_for_group(
@@ -139,72 +370,152 @@ class RAGChain:
                 )
         except Exception as e:
             # 如果檢索失敗（如 Ollama 未啟動），直接使用 LLM
-            import logging
             logging.warning(f"RAG retrieval failed, using direct LLM: {e}")
             retrieval_results = []
+            retrieval_failed = True
 
-        # 2. 構建上下文
-        context = self._build_context(retrieval_results)
+        # 2. 在 token 預算內構建上下文
+        packed = self._pack_context(retrieval_results, question, conversation_history, llm)
 
         # 3. 構建訊息
         messages = self._build_messages(
             question=question,
-            context=context,
+            context=packed.text,
             conversation_history=conversation_history
         )
 
-        # 4. 選擇 LLM
-        llm = get_llm_service(llm_provider) if llm_provider else self.llm
-
-        # 5. 呼叫 LLM
-        llm_response = await llm.chat(messages)
+        # 4. 呼叫 LLM（取得生成名額；呼叫端取消時名額立即釋放）
+        async with generation_limiter.slot():
+            llm_response = await llm.chat(messages)
 
-        # 6. 構建來源資訊
-        sources = [
-            {
-                "document_id": r.document_id,
-                "document_name": r.document_name,
-                "chunk_index": r.chunk_index,
-                "content": r.content[:200] + "..." if len(r.content) > 200 else r.content,
-                "score": round(r.score, 3)
-            }
-            for r in retrieval_results
-        ]
+        # 6. 構建來源資訊（只列出實際放入上下文的片段）
+        sources = self._build_sources(packed.results)
 
         # 7. 計算信心分數（基於檢索分數）
-        confidence = 0.0
-        if retrieval_results:
-            confidence = sum(r.score for r in retrieval_results) / len(retrieval_results)
+        confidence = self._confidence(retrieval_results)
 
-        return RAGResponse(
+        response = RAGResponse(
             answer=llm_response.content,
             sources=sources,
             model=llm_response.model,
             retrieval_count=len(retrieval_results),
             generation_time=llm_response.generation_time,
-            confidence=round(confidence, 3),
+            confidence=confidence,
             metadata={
                 "prompt_tokens": llm_response.prompt_tokens,
                 "completion_tokens": llm_response.completion_tokens,
-                "total_tokens": llm_response.total_tokens
+                "total_tokens": llm_response.total_tokens,
+                "cache_hit": False,
+                **self._context_metadata(packed),
+                **self._prefill_metadata(llm_response)
             }
         )
 
-    def _build_context(self, retrieval_results: List[RetrievalResult]) -> str:
-        """構建上下文文本"""
+        # 8. 保存到答案快取（檢索失敗時的答案不具代表性，不保存）
+        if cache_key is not None and not retrieval_failed:
+            vector, scope, version = cache_key
+            self.answer_cache.store(group_id, question, vector, scope, version, response)
+
+        return response
+
+    async def _answer_cache_key(
+        self,
+        question: str,
+        group_id: int,
+        document_ids: Optional[List[int]],
+        llm: BaseLLMService,
+        access_scope: Optional[str] = None
+    ) -> Optional[Tuple[List[float], Tuple, int]]:
+        """
+        取得答案快取所需的問題向量、範圍與群組索引版本
+
+        版本需在檢索前讀取，檢索期間若有文件變更，保存的答案會立即失效
+        範圍包含呼叫者的權限範圍，權限不同的成員不會取得彼此的答案（來源可能包含對方不可見的文件）
+
+        Returns:
+            Optional[Tuple]: (問題向量, 範圍, 版本)；無法取得時返回 None（略過快取）
+        """
+        try:
+            vector = await self.retriever.embedding.embed_query(question)
+            version = await self.retriever.versions.get(group_id)
+        except Exception as e:
+            logging.warning(f"Answer cache unavailable: {e}")
+            return None
+
+        scope = (
+            tuple(sorted(document_ids)) if document_ids else None,
+            f"{type(llm).__name__}:{llm.model}",
+            access_scope
+        )
+        return vector, scope, version
+
+    @staticmethod
+    def _build_sources(retrieval_results: List[RetrievalResult]) -> List[Dict[str, Any]]:
+        """構建來源資訊"""
+        return [
+            {
+                "document_id": r.document_id,
+                "document_name": r.document_name,
+                "chunk_index": r.chunk_index,
+                "chunk_indices": r.chunk_indices or None,
+                "content": r.content[:200] + "..." if len(r.content) > 200 else r.content,
+                "score": round(r.score, 3)
+            }
+            for r in retrieval_results
+        ]
+
+    @staticmethod
+    def _context_metadata(packed: PackedContext) -> Dict[str, Any]:
+        """上下文打包統計"""
+        return {
+            "context_tokens": packed.tokens,
+            "context_token_budget": packed.budget,
+            "context_chunks": len(packed.results),
+            "context_chunks_trimmed": packed.trimmed,
+            "context_chunks_dropped": packed.dropped,
+        }
+
+    @staticmethod
+    def _prefill_metadata(llm_response: LLMResponse) -> Dict[str, Any]:
+        """取出各階段耗時與 prefill 統計（Ollama 提供；其他 LLM 為空）"""
+        return {
+            k: v for k, v in llm_response.metadata.items()
+            if k.endswith("_duration") or k in ("prefill_time", "estimated_prompt_tokens", "prompt_cache_ratio")
+        }
+
+    @staticmethod
+    def _confidence(retrieval_results: List[RetrievalResult]) -> float:
+        """計算信心分數（基於檢索分數）"""
         if not retrieval_results:
-            return ""
+            return 0.0
+        return round(sum(r.score for r in retrieval_results) / len(retrieval_results), 3)
 
-        chunks = []
-        for r in retrieval_results:
-            chunk_text = self.CHUNK_TEMPLATE.format(
-                filename=r.document_name or f"Document {r.document_id}",
-                content=r.content
-            )
-            chunks.append(chunk_text)
+    def _pack_context(
+        self,
+        retrieval_results: List[RetrievalResult],
+        question: str,
+        conversation_history: Optional[List[Dict[str, str]]],
+        llm: BaseLLMService
+    ) -> PackedContext:
+        """
+        在 token 預算內構建上下文
+
+        預算 = 模型上限 - 回答保留 - 不含上下文時的訊息 token 數（系統提示、歷史、問題）
+        """
+        limit = settings.CONTEXT_MODEL_TOKEN_BUDGETS.get(llm.model, settings.CONTEXT_TOKEN_BUDGET)
+        reserve = llm.max_tokens or settings.CONTEXT_ANSWER_RESERVE
+        base_tokens = self.context_packer.count_messages(
+            self._build_messages(question, "", conversation_history)
+        )
+        budget = max(0, limit - reserve - base_tokens)
 
-        contexts = "\n".join(chunks)
-        return self.CONTEXT_TEMPLATE.format(contexts=contexts)
+        packed = self.context_packer.pack(retrieval_results, budget)
+        if packed.trimmed or packed.dropped:
+            logging.info(
+                f"Context packed to {packed.tokens}/{budget} tokens: "
+                f"{len(packed.results)} chunks kept, {packed.trimmed} trimmed, {packed.dropped} dropped"
+            )
+        return packed
 
     def _build_messages(
         self,
@@ -212,31 +523,40 @@ class RAGChain:
         context: str,
         conversation_history: Optional[List[Dict[str, str]]] = None
     ) -> List[Message]:
-        """構建 LLM 訊息"""
-        messages = []
-
-        # 系統提示
-        system_prompt = self.SYSTEM_PROMPT_TEMPLATE.format(
-            current_time=datetime.now().strftime("%Y-%m-%d %H:%M")
-        )
-        messages.append(Message(role="system", content=system_prompt))
-
-        # 上下文
-        if context:
-            messages.append(Message(role="user", content=context))
-            messages.append(Message(role="assistant", content="我已閱讀以上文件內容，請提出您的問題。"))
-
-        # 對話歷史
-        if conversation_history:
-            for msg in conversation_history[-6:]:  # 最多保留最近 3 輪對話
-                messages.append(Message(
-                    role=msg["role"],
-                    content=msg["content"]
-                ))
-
-        # 當前問題
-        messages.append(Message(role="user", content=question))
+        """構建 LLM 訊息（依 PROMPT_LAYOUT 組裝）"""
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M")
+        history = [
+            Message(role=msg["role"], content=msg["content"])
+            for msg in (conversation_history or [])[-settings.CHAT_HISTORY_MESSAGES:]
+        ]
 
+        if settings.PROMPT_LAYOUT == "legacy":
+            messages = [Message(
+                role="system",
+                content=self.SYSTEM_PROMPT_TEMPLATE.format(current_time=current_time)
+            )]
+
+            # 上下文
+            if context:
+                messages.append(Message(role="user", content=context))
+                messages.append(Message(role="assistant", content="我已閱讀以上文件內容，請提出您的問題。"))
+
+            # 對話歷史 + 當前問題
+            messages.extend(history)
+            messages.append(Message(role="user", content=question))
+            return messages
+
+        # stable：固定前綴（系統提示 + 歷史），變動內容全部放在最後一則訊息
+        messages = [Message(role="system", content=self.SYSTEM_PROMPT)]
+        messages.extend(history)
+        messages.append(Message(
+            role="user",
+            content=self.QUESTION_TEMPLATE.format(
+                context=context + "\n" if context else "",
+                current_time=current_time,
+                question=question
+            )
+        ))
         return messages
 
     async def query_stream(
@@ -253,47 +573,74 @@ class RAGChain:
 
         與 query() 相同，但串流返回答案
         用於即時顯示生成內容
+
+        呼叫端取消或關閉此產生器時，會關閉上游 LLM 串流並釋放生成名額
+
+        Yields:
+            依序產生：
+            - {"type": "sources", "data": [...], "confidence": float, "model": str}: 檢索到的來源（生成前送出）
+            - str: 答案的文字片段
+            - {"type": "usage", "data": {...}}: 生成結束後的模型與統計資訊
         """
         k = top_k or self.top_k
 
-        # 1-3: 與 query() 相同
-        if document_ids:
-            retrieval_results = await self.retriever.retrieve_for_documents(
-                query=question,
-                document_ids=document_ids,
-                top_k=k
-            )
-        else:
-            retrieval_results = await self.retriever.retrieve_for_group(
-                query=question,
-                group_id=group_id,
-                top_k=k
-            )
-
-        context = self._build_context(retrieval_results)
-        messages = self._build_messages(question, context, conversation_history)
+        # 1. 檢索（失敗時與 query() 相同，直接使用 LLM）
+        try:
+            if document_ids:
+                retrieval_results = await self.retriever.retrieve_for_documents(
+                    query=question,
+                    document_ids=document_ids,
+                    top_k=k,
+                    group_id=group_id
+                )
+            else:
+                retrieval_results = await self.retriever.retrieve_for_group(
+                    query=question,
+                    group_id=group_id,
+                    top_k=k
+                )
+        except Exception as e:
+            logging.warning(f"RAG retrieval failed, using direct LLM: {e}")
+            retrieval_results = []
 
-        # 4. 選擇 LLM 並串流生成
+        # 2. 選擇 LLM 並在 token 預算內構建上下文，先送出來源，讓前端在生成前即可顯示
         llm = get_llm_service(llm_provider) if llm_provider else self.llm
+        packed = self._pack_context(retrieval_results, question, conversation_history, llm)
+        yield {
+            "type": "sources",
+            "data": self._build_sources(packed.results),
+            "confidence": self._confidence(retrieval_results),
+            "model": llm.model
+        }
 
-        # 構建完整 prompt
-        full_prompt = "\n".join([m.content for m in messages if m.role == "user"])
-        system_prompt = next((m.content for m in messages if m.role == "system"), None)
+        messages = self._build_messages(question, packed.text, conversation_history)
 
-        # 串流返回
-        async for chunk in llm.stream(full_prompt, system_prompt):
-            yield chunk
+        # 3. 串流生成（與 query() 相同的訊息結構）
 
-        # 返回來源資訊（作為最終訊息）
-        sources = [
-            {
-                "document_id": r.document_id,
-                "document_name": r.document_name,
-                "score": round(r.score, 3)
-            }
-            for r in retrieval_results
-        ]
-        yield {"type": "sources", "data": sources}
+        usage = {"model": llm.model, **self._context_metadata(packed)}
+        stream = llm.stream_chat(messages)
+        try:
+            async with generation_limiter.slot():
+                async for chunk in stream:
+                    if isinstance(chunk, LLMResponse):
+                        usage = {
+                            "model": chunk.model,
+                            "prompt_tokens": chunk.prompt_tokens,
+                            "completion_tokens": chunk.completion_tokens,
+                            "total_tokens": chunk.total_tokens,
+                            "generation_time": chunk.generation_time,
+                            "finish_reason": chunk.finish_reason,
+                            **self._context_metadata(packed),
+                            **self._prefill_metadata(chunk)
+                        }
+                    else:
+                        yield chunk
+        finally:
+            # 呼叫端提前關閉（使用者中斷連線）時一併關閉上游串流，讓模型停止生成
+            await stream.aclose()
+
+        # 4. 生成結束
+        yield {"type": "usage", "data": usage}
 
 
 # 單例實例
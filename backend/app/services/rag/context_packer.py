@@ -0,0 +1,143 @@
+"""
+上下文打包
+
+依 token 預算挑選並裁切檢索結果，組成送入 LLM 的上下文
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional
+
+from app.services.llm.base import Message
+from app.services.llm.tokens import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+from app.services.rag.retriever import RetrievalResult
+
+
+# 裁切片段時附加的標記
+TRIM_MARKER = "…"
+
+
+@dataclass
+class PackedContext:
+    """打包結果"""
+    text: str  # 上下文文本（無片段時為空字串）
+    results: List[RetrievalResult] = field(default_factory=list)  # 實際放入的檢索結果（原始物件）
+    tokens: int = 0  # 上下文的 token 數
+    budget: int = 0  # 可用的 token 預算
+    trimmed: int = 0  # 被裁切的片段數
+    dropped: int = 0  # 被捨棄的片段數
+
+
+class ContextPacker:
+    """
+    上下文打包器
+
+    業務邏輯：
+    - 依檢索排名（分數高者優先）逐一放入片段，並計入模板本身的 token 數
+    - 放不下的片段：剩餘預算足夠時裁切後放入，否則捨棄
+    - 預算用完後，排名較後的片段全部捨棄
+
+    token 計數：
+    - 可傳入任何 Callable[[str], int]（如 tiktoken），預設使用 estimate_tokens 估算
+    """
+
+    def __init__(
+        self,
+        chunk_template: str,
+        context_template: str,
+        token_counter: Optional[Callable[[str], int]] = None,
+        min_chunk_tokens: int = 64
+    ):
+        """
+        初始化打包器
+
+        Args:
+            chunk_template: 單個片段模板（含 {filename}、{content}）
+            context_template: 上下文模板（含 {contexts}）
+            token_counter: token 計數函式
+            min_chunk_tokens: 裁切後片段內容的最少 token 數（低於此值直接捨棄）
+        """
+        self.chunk_template = chunk_template
+        self.context_template = context_template
+        self.count = token_counter or estimate_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def count_messages(self, messages: Iterable[Message]) -> int:
+        """計算訊息的 token 數（含每則訊息的固定開銷）"""
+        return sum(self.count(message.content) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def pack(self, results: List[RetrievalResult], budget: int) -> PackedContext:
+        """
+        在預算內打包檢索結果
+
+        Args:
+            results: 檢索結果（已依排名排序）
+            budget: 上下文可用的 token 預算
+
+        Returns:
+            PackedContext: 打包結果
+        """
+        if not results:
+            return PackedContext(text="", budget=budget)
+
+        # 上下文外框（標題與結尾說明）與每個片段外框的固定開銷
+        remaining = budget - self.count(self.context_template.format(contexts=""))
+        chunks: List[str] = []
+        packed: List[RetrievalResult] = []
+        trimmed = 0
+
+        for r in results:
+            filename = r.document_name or f"Document {r.document_id}"
+            chunk_text = self._format_chunk(filename, r.content)
+            tokens = self.count(chunk_text) + 1  # 片段之間的換行
+            if tokens <= remaining:
+                chunks.append(chunk_text)
+                packed.append(r)
+                remaining -= tokens
+                continue
+
+            # 放不下：剩餘預算扣除外框後仍足夠時，裁切內容後放入
+            content_budget = remaining - 1 - self.count(self._format_chunk(filename, TRIM_MARKER))
+            if content_budget >= self.min_chunk_tokens:
+                content = self._trim(r.content, content_budget)
+                if content:
+                    chunks.append(self._format_chunk(filename, content + TRIM_MARKER))
+                    packed.append(r)
+                    trimmed += 1
+            break
+
+        if not chunks:
+            return PackedContext(text="", budget=budget, dropped=len(results))
+
+        text = self.context_template.format(contexts="\n".join(chunks))
+        return PackedContext(
+            text=text,
+            results=packed,
+            tokens=self.count(text),
+            budget=budget,
+            trimmed=trimmed,
+            dropped=len(results) - len(packed)
+        )
+
+    def _format_chunk(self, filename: str, content: str) -> str:
+        return self.chunk_template.format(filename=filename, content=content)
+
+    def _trim(self, content: str, max_tokens: int) -> str:
+        """
+        取內容在 max_tokens 內的最長前綴
+
+        以二分搜尋字元長度，盡量在換行或句號處截斷
+        """
+        low, high = 0, len(content)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count(content[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+
+        prefix = content[:low]
+        # 截斷點往前找換行或句號，但最多只捨棄 20% 的內容
+        cut = max(prefix.rfind(sep) for sep in ("\n", "。", ". "))
+        if cut >= int(low * 0.8):
+            prefix = prefix[:cut + 1]
+        return prefix.rstrip()
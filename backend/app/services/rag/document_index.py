@@ -0,0 +1,299 @@
+"""
+文件中心向量索引
+
+每份文件保存一個（或數個）中心向量，檢索時先挑出最相關的文件，再只在這些文件中搜尋切片
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.document import Document
+from app.services.rag.ann_index import IVFFlatIndex
+from app.services.rag.retrieval_cache import IndexVersionRegistry, index_versions
+
+
+class CentroidAccumulator:
+    """
+    文件中心向量累加器
+
+    文件入庫時逐批加入切片向量，只保留總和與固定大小的蓄水池樣本，
+    記憶體用量與文件大小無關
+
+    - n_centroids = 1：所有切片向量正規化後的平均
+    - n_centroids > 1：對樣本做球面 k-means（切片數不足時退化為單一中心）
+    """
+
+    def __init__(self, n_centroids: int = 1, sample_size: int = 1024, seed: int = 42):
+        self.n_centroids = max(1, n_centroids)
+        self.sample_size = sample_size
+        self.count = 0
+        self._sum: Optional[np.ndarray] = None
+        self._sample: List[np.ndarray] = []
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, embeddings: Sequence[Sequence[float]]) -> None:
+        """加入一批切片向量"""
+        if not len(embeddings):
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+        batch_sum = vectors.sum(axis=0)
+        self._sum = batch_sum if self._sum is None else self._sum + batch_sum
+
+        if self.n_centroids > 1:
+            for vector in vectors:
+                self.count += 1
+                if len(self._sample) < self.sample_size:
+                    self._sample.append(vector)
+                else:
+                    slot = int(self._rng.integers(0, self.count))
+                    if slot < self.sample_size:
+                        self._sample[slot] = vector
+        else:
+            self.count += len(vectors)
+
+    def centroids(self) -> Optional[np.ndarray]:
+        """
+        取得中心向量
+
+        Returns:
+            Optional[np.ndarray]: 已正規化的中心向量 (n, dim)；沒有任何切片時為 None
+        """
+        if self._sum is None:
+            return None
+
+        if self.n_centroids > 1 and len(self._sample) >= self.n_centroids * 4:
+            kmeans = IVFFlatIndex(nlist=self.n_centroids)
+            return kmeans.train_centroids(np.stack(self._sample))
+
+        norm = np.linalg.norm(self._sum) or 1.0
+        return (self._sum / norm).astype(np.float32)[None, :]
+
+
+class DocumentCentroidIndex:
+    """
+    文件中心向量索引
+
+    業務邏輯：
+    - 文件處理完成時保存其中心向量（SQLite，多個 worker 共用）
+    - 查詢時以 cosine 相似度為群組內的文件排序（多個中心取最高分），返回前 M 份文件
+    - 群組文件數未達門檻時不剪枝（返回 None），直接搜尋全部切片
+    - 未保存中心向量的文件（功能啟用前處理的文件）無法排序，一律加入候選文件；
+      這類文件不少於 top_m 份，或候選文件超過群組的一半時，改為搜尋全部切片
+    - 每個群組的中心矩陣與文件清單快取在記憶體，群組索引版本改變時重新載入
+
+    注意：
+    - SQLite 操作為同步 I/O，透過 asyncio.to_thread 執行
+    """
+
+    def __init__(self, path: str = None, versions: IndexVersionRegistry = None):
+        """
+        初始化索引
+
+        Args:
+            path: SQLite 檔案路徑
+            versions: 群組索引版本登錄（決定記憶體快取何時失效）
+        """
+        self.path = path or settings.DOCUMENT_CENTROID_PATH
+        self.versions = versions or index_versions
+        self.pruned_queries = 0
+        self.full_queries = 0
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # group_id -> (版本, 群組全部文件 ID, 中心向量所屬文件 ID 陣列, 中心矩陣)
+        self._groups: Dict[Any, Tuple[int, np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS centroids ("
+            "document_id INTEGER NOT NULL, centroid_no INTEGER NOT NULL, group_id INTEGER, "
+            "vector BLOB NOT NULL, PRIMARY KEY (document_id, centroid_no)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_centroids_group ON centroids (group_id)")
+        conn.commit()
+        self._conn = conn
+        return conn
+
+    # ============================================
+    # 寫入
+    # ============================================
+
+    def _put_document_sync(self, document_id: int, group_id: Optional[int], centroids: np.ndarray) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM centroids WHERE document_id = ?", (document_id,))
+                conn.executemany(
+                    "INSERT INTO centroids (document_id, centroid_no, group_id, vector) VALUES (?, ?, ?, ?)",
+                    [
+                        (document_id, i, group_id, np.asarray(vector, dtype=np.float32).tobytes())
+                        for i, vector in enumerate(centroids)
+                    ]
+                )
+
+    async def put_document(self, document_id: int, group_id: Optional[int], centroids: np.ndarray) -> None:
+        """
+        保存文件的中心向量（覆寫原有的中心向量）
+
+        Args:
+            document_id: 文件 ID
+            group_id: 群組 ID
+            centroids: 已正規化的中心向量 (n, dim)
+        """
+        await asyncio.to_thread(self._put_document_sync, document_id, group_id, centroids)
+
+    def _delete_document_sync(self, document_id: int) -> int:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute("DELETE FROM centroids WHERE document_id = ?", (document_id,)).rowcount
+
+    async def delete_document(self, document_id: int) -> int:
+        """
+        刪除文件的中心向量
+
+        Args:
+            document_id: 文件 ID
+
+        Returns:
+            int: 刪除筆數
+        """
+        return await asyncio.to_thread(self._delete_document_sync, document_id)
+
+    # ============================================
+    # 查詢
+    # ============================================
+
+    def _load_group_sync(self, group_id: Any) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT document_id, vector FROM centroids WHERE group_id = ? ORDER BY document_id, centroid_no",
+                (group_id,)
+            ).fetchall()
+
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+        document_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        return document_ids, matrix
+
+    @staticmethod
+    async def _load_group_documents(group_id: Any) -> np.ndarray:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Document.id).where(Document.group_id == group_id))
+            return np.array(sorted(result.scalars().all()), dtype=np.int64)
+
+    async def _group_matrix(self, group_id: Any) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """取得群組全部文件 ID、中心向量所屬文件 ID 與中心矩陣"""
+        version = await self.versions.get(group_id)
+        cached = self._groups.get(group_id)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2], cached[3]
+
+        # 先讀版本再讀資料：讀取期間有變動時快取內容只會比版本新，下次查詢會再重新載入
+        group_documents = await self._load_group_documents(group_id)
+        document_ids, matrix = await asyncio.to_thread(self._load_group_sync, group_id)
+        self._groups[group_id] = (version, group_documents, document_ids, matrix)
+        return group_documents, document_ids, matrix
+
+    async def top_documents(
+        self,
+        group_id: Any,
+        query_embedding: Sequence[float],
+        top_m: int,
+        document_ids: Optional[List[int]] = None,
+        min_documents: int = 0
+    ) -> Optional[List[int]]:
+        """
+        依中心向量相似度挑出最相關的文件
+
+        Args:
+            group_id: 群組 ID
+            query_embedding: 查詢向量
+            top_m: 返回的文件數
+            document_ids: 只在這些文件中挑選（可選）
+            min_documents: 候選文件數未超過此值時不剪枝
+
+        Returns:
+            Optional[List[int]]: 文件 ID（有中心向量者依相似度由高到低，之後為沒有中心向量的文件）；
+                不需剪枝或無法剪枝時為 None
+        """
+        try:
+            group_documents, ids, matrix = await self._group_matrix(group_id)
+        except Exception as e:
+            logging.warning(f"Document centroid lookup failed for group {group_id}: {e}")
+            self.full_queries += 1
+            return None
+
+        if document_ids:
+            group_documents = group_documents[np.isin(group_documents, document_ids)]
+            mask = np.isin(ids, document_ids)
+            ids, matrix = ids[mask], matrix[mask]
+
+        # 沒有中心向量的文件無法判斷相關性，必須保留在候選中
+        missing = group_documents[~np.isin(group_documents, ids)]
+        candidates = len(np.unique(ids))
+        query = np.asarray(query_embedding, dtype=np.float32)
+        total = candidates + len(missing)
+        if total <= max(top_m, min_documents) or matrix.shape[1] != len(query):
+            self.full_queries += 1
+            return None
+
+        # 缺少中心向量的文件太多時，剪枝後的候選清單不比整個群組小多少，
+        # 大型 document_id $in 過濾反而比不過濾慢，直接搜尋全部切片
+        if len(missing) >= top_m or (top_m + len(missing)) * 2 > total:
+            self.full_queries += 1
+            return None
+
+        scores = matrix @ (query / (np.linalg.norm(query) or 1.0))
+
+        # 多個中心時每份文件取最高分
+        order = np.argsort(-scores)
+        selected: List[int] = []
+        seen = set()
+        for row in order:
+            document_id = int(ids[row])
+            if document_id in seen:
+                continue
+            seen.add(document_id)
+            selected.append(document_id)
+            if len(selected) == top_m:
+                break
+
+        self.pruned_queries += 1
+        return selected + [int(document_id) for document_id in missing]
+
+    def stats(self) -> Dict[str, Any]:
+        """取得索引統計"""
+        return {
+            "cached_groups": len(self._groups),
+            "cached_centroids": sum(len(ids) for _, _, ids, _ in self._groups.values()),
+            "pruned_queries": self.pruned_queries,
+            "full_queries": self.full_queries,
+        }
+
+
+# 單例實例
+document_centroid_index = DocumentCentroidIndex()
@@ -4,11 +4,17 @@ Embedding 服務
 將文本轉換為向量表示
 """
 
+import asyncio
+import logging
 import httpx
 from typing import List, Optional
 from dataclasses import dataclass
 
 from app.core.config import settings
+from app.core.http_client import http_clients
+from app.services.rag.embedding_cache import EmbeddingCache
+from app.services.rag.query_cache import QueryEmbeddingCache
+from app.services.rag.batcher import EmbeddingBatcher
 
 
 @dataclass
@@ -25,12 +31,21 @@ class EmbeddingService:
 
     業務邏輯：
     - 使用 Ollama 的 embedding API（支援 BGE-M3 等模型）
-    - 批量處理文本以提高效率
+    - 批量處理文本以提高效率：一次 /api/embed 請求送出多個輸入
+    - 以有限併發同時送出多個批次，結果維持輸入順序
+    - 批次失敗時以指數退避重試
+    - 持久化快取：只有快取未命中的文本才送往 Ollama
+    - 查詢向量快取：重複問題直接使用記憶體中的向量
+    - 微批次調度：併發的查詢在短窗口內合併送出
     - 支援中英文混合文本
 
     配置：
     - EMBEDDING_MODEL: Embedding 模型名稱
     - OLLAMA_BASE_URL: Ollama 服務地址
+    - EMBEDDING_BATCH_SIZE: 每批文本數
+    - EMBEDDING_CONCURRENCY: 同時進行的批次數
+    - EMBEDDING_MAX_RETRIES: 批次重試次數
+    - EMBEDDING_CACHE_ENABLED / EMBEDDING_CACHE_PATH / EMBEDDING_CACHE_MAX_ENTRIES: 快取設定
 
     注意：
     - BGE-M3 模型需要先透過 ollama pull nomic-embed-text 或類似命令下載
@@ -41,7 +56,12 @@ class EmbeddingService:
         self,
         model: str = None,
         base_url: str = None,
-        timeout: float = 60.0
+        timeout: float = 60.0,
+        batch_size: int = None,
+        concurrency: int = None,
+        max_retries: int = None,
+        cache: Optional[EmbeddingCache] = None,
+        query_cache: Optional[QueryEmbeddingCache] = None
     ):
         """
         初始化 Embedding 服務
@@ -50,14 +70,57 @@ class EmbeddingService:
             model: Embedding 模型名稱
             base_url: Ollama 服務地址
             timeout: 請求超時時間（秒）
+            batch_size: 每批文本數
+            concurrency: 同時進行的批次數
+            max_retries: 批次失敗重試次數
+            cache: 持久化 embedding 快取（預設依 EMBEDDING_CACHE_ENABLED 建立）
+            query_cache: 查詢向量快取（預設依 QUERY_EMBEDDING_CACHE_ENABLED 建立）
         """
         self.model = model or settings.EMBEDDING_MODEL
         self.base_url = (base_url or settings.OLLAMA_BASE_URL).rstrip("/")
         self.timeout = timeout
+        self.batch_size = max(1, batch_size or settings.EMBEDDING_BATCH_SIZE)
+        self.concurrency = max(1, concurrency or settings.EMBEDDING_CONCURRENCY)
+        self.max_retries = max_retries if max_retries is not None else settings.EMBEDDING_MAX_RETRIES
 
         # 預設維度（根據模型不同可能需要調整）
         self._dimensions = 1024  # BGE-M3 預設維度
 
+        # 舊版 Ollama 不支援 /api/embed，偵測到後改用逐筆的 /api/embeddings
+        self._use_legacy_api = False
+
+        # 持久化快取：相同 (model, text) 只向量化一次
+        if cache is None and settings.EMBEDDING_CACHE_ENABLED:
+            cache = EmbeddingCache(
+                path=settings.EMBEDDING_CACHE_PATH,
+                model=self.model,
+                max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES
+            )
+        self.cache = cache
+
+        # 查詢向量快取：重複的問題不再呼叫 Ollama
+        if query_cache is None and settings.QUERY_EMBEDDING_CACHE_ENABLED:
+            query_cache = QueryEmbeddingCache(
+                model=self.model,
+                max_entries=settings.QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+                max_bytes=settings.QUERY_EMBEDDING_CACHE_MAX_BYTES,
+                ttl=settings.QUERY_EMBEDDING_CACHE_TTL,
+                shared_path=(
+                    settings.QUERY_EMBEDDING_CACHE_PATH
+                    if settings.QUERY_EMBEDDING_CACHE_SHARED else None
+                )
+            )
+        self.query_cache = query_cache
+
+        # 微批次調度：合併同時到達的查詢為一次多輸入請求
+        self.query_batcher: Optional[EmbeddingBatcher] = None
+        if settings.EMBEDDING_QUERY_BATCH_ENABLED:
+            self.query_batcher = EmbeddingBatcher(
+                embed_fn=self._embed_uncached,
+                window_ms=settings.EMBEDDING_QUERY_BATCH_WINDOW_MS,
+                max_batch_size=settings.EMBEDDING_QUERY_BATCH_MAX_SIZE
+            )
+
     async def embed_text(self, text: str) -> List[float]:
         """
         將單個文本轉換為向量
@@ -88,28 +151,14 @@ class EmbeddingService:
                 dimensions=self._dimensions
             )
 
-        embeddings = []
-
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            for text in texts:
-                # Ollama embedding API
-                response = await client.post(
-                    f"{self.base_url}/api/embeddings",
-                    json={
-                        "model": self.model,
-                        "prompt": text
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-
-                # 回應格式: {"embedding": [...]}
-                embedding = data.get("embedding", [])
-                embeddings.append(embedding)
+        if self.cache is None:
+            embeddings = await self._embed_uncached(texts)
+        else:
+            embeddings = await self._embed_with_cache(texts)
 
-                # 更新維度資訊
-                if embedding and self._dimensions != len(embedding):
-                    self._dimensions = len(embedding)
+        # 更新維度資訊
+        if embeddings and embeddings[0] and self._dimensions != len(embeddings[0]):
+            self._dimensions = len(embeddings[0])
 
         return EmbeddingResult(
             embeddings=embeddings,
@@ -117,6 +166,158 @@ class EmbeddingService:
             dimensions=self._dimensions
         )
 
+    async def _embed_with_cache(self, texts: List[str]) -> List[List[float]]:
+        """
+        先查快取，只向量化未命中的文本
+
+        同一批次中重複的文本（例如多份文件共用的樣板內容）也只送出一次
+        """
+        try:
+            cached = await self.cache.get_many(texts)
+        except Exception as e:
+            logging.warning(f"Embedding cache lookup failed, bypassing cache: {e}")
+            return await self._embed_uncached(texts)
+
+        missing = list(dict.fromkeys(
+            text for text, vector in zip(texts, cached) if vector is None
+        ))
+
+        computed = {}
+        if missing:
+            vectors = await self._embed_uncached(missing)
+            computed = dict(zip(missing, vectors))
+            try:
+                await self.cache.put_many(missing, vectors)
+            except Exception as e:
+                logging.warning(f"Embedding cache write failed: {e}")
+
+        return [
+            vector if vector is not None else computed[text]
+            for text, vector in zip(texts, cached)
+        ]
+
+    async def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        """以有限併發分批呼叫 Ollama，結果維持輸入順序"""
+        batches = [
+            texts[i:i + self.batch_size]
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        client = http_clients.get(http_clients.OLLAMA)
+
+        async def run_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self._embed_batch_with_retry(client, batch)
+
+        tasks = [asyncio.create_task(run_batch(batch)) for batch in batches]
+        try:
+            # gather 依照傳入順序返回，因此結果與輸入順序一致
+            batch_results = await asyncio.gather(*tasks)
+        except BaseException:
+            # 任一批次最終失敗時，取消其餘仍在進行的批次
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        return [embedding for batch in batch_results for embedding in batch]
+
+    async def _embed_batch_with_retry(
+        self,
+        client: httpx.AsyncClient,
+        texts: List[str]
+    ) -> List[List[float]]:
+        """
+        送出單一批次，失敗時以指數退避重試
+
+        只重試連線錯誤、429 與 5xx，其餘 4xx 視為請求本身有誤直接拋出
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self._embed_batch(client, texts)
+            except httpx.HTTPStatusError as e:
+                status_code = e.response.status_code
+                if status_code != 429 and status_code < 500:
+                    raise
+                error = e
+            except httpx.TransportError as e:
+                error = e
+
+            if attempt >= self.max_retries:
+                raise error
+
+            delay = 0.5 * (2 ** attempt)
+            attempt += 1
+            logging.warning(
+                f"Embedding batch of {len(texts)} failed ({error}), "
+                f"retry {attempt}/{self.max_retries} in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+
+    async def _embed_batch(
+        self,
+        client: httpx.AsyncClient,
+        texts: List[str]
+    ) -> List[List[float]]:
+        """
+        呼叫 Ollama 多輸入 embedding API
+
+        請求格式: {"model": ..., "input": [...]}
+        回應格式: {"embeddings": [[...], ...]}
+        """
+        if self._use_legacy_api:
+            return await self._embed_batch_legacy(client, texts)
+
+        response = await client.post(
+            f"{self.base_url}/api/embed",
+            json={
+                "model": self.model,
+                "input": texts
+            },
+            timeout=self.timeout
+        )
+
+        if response.status_code == 404 and "model" not in response.text.lower():
+            # 端點不存在（Ollama < 0.3），改用舊版 API
+            logging.warning("Ollama /api/embed not available, falling back to /api/embeddings")
+            self._use_legacy_api = True
+            return await self._embed_batch_legacy(client, texts)
+
+        response.raise_for_status()
+        embeddings = response.json().get("embeddings", [])
+
+        if len(embeddings) != len(texts):
+            raise ValueError(
+                f"Embedding 數量不符: 送出 {len(texts)} 筆，收到 {len(embeddings)} 筆"
+            )
+
+        return embeddings
+
+    async def _embed_batch_legacy(
+        self,
+        client: httpx.AsyncClient,
+        texts: List[str]
+    ) -> List[List[float]]:
+        """使用舊版單筆 /api/embeddings 端點處理一個批次"""
+        embeddings = []
+
+        for text in texts:
+            response = await client.post(
+                f"{self.base_url}/api/embeddings",
+                json={
+                    "model": self.model,
+                    "prompt": text
+                },
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+
+            # 回應格式: {"embedding": [...]}
+            embeddings.append(response.json().get("embedding", []))
+
+        return embeddings
+
     async def embed_query(self, query: str) -> List[float]:
         """
         將查詢文本轉換為向量
@@ -124,24 +325,52 @@ class EmbeddingService:
         與 embed_text 相同，但語意上用於查詢
         某些 embedding 模型對查詢和文件有不同處理
 
+        查詢使用獨立的 LRU + TTL 快取（鍵為正規化後的文本），
+        不寫入文件用的持久化快取，避免大量問題擠掉文件向量
+
         Args:
             query: 查詢文本
 
         Returns:
             List[float]: 向量表示
         """
-        return await self.embed_text(query)
+        if self.query_cache is not None:
+            cached = await self.query_cache.get(query)
+            if cached is not None:
+                return cached
+
+        if self.query_batcher is not None:
+            embedding = await self.query_batcher.submit(query)
+        else:
+            embedding = (await self._embed_uncached([query]))[0]
+
+        if self.query_cache is not None:
+            await self.query_cache.put(query, embedding)
+
+        return embedding
 
     @property
     def dimensions(self) -> int:
         """取得向量維度"""
         return self._dimensions
 
+    def cache_stats(self) -> Optional[dict]:
+        """取得快取統計（未啟用時返回 None）"""
+        return self.cache.stats() if self.cache else None
+
+    def query_cache_stats(self) -> Optional[dict]:
+        """取得查詢向量快取統計（未啟用時返回 None）"""
+        return self.query_cache.stats() if self.query_cache else None
+
+    def query_batcher_stats(self) -> Optional[dict]:
+        """取得查詢微批次指標（未啟用時返回 None）"""
+        return self.query_batcher.stats() if self.query_batcher else None
+
     async def health_check(self) -> bool:
         """健康檢查"""
         try:
-            # 嘗試生成一個簡單的 embedding
-            await self.embed_text("test")
+            # 嘗試生成一個簡單的 embedding（略過快取以確認 Ollama 可用）
+            await self._embed_uncached(["test"])
             return True
         except Exception:
             return False
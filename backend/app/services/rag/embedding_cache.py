@@ -0,0 +1,214 @@
+"""
+Embedding 快取
+
+以內容雜湊為鍵的持久化 embedding 快取（SQLite）
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Sequence
+
+
+class EmbeddingCache:
+    """
+    持久化 Embedding 快取
+
+    業務邏輯：
+    - 鍵為 sha256(model + text)，相同文本只需向量化一次
+    - 使用本地 SQLite 檔案保存，重啟後仍有效
+    - 以最後存取時間做 LRU 淘汰，限制總筆數
+    - 模型名稱改變時自動清空快取
+    - 記錄命中 / 未命中次數
+
+    注意：
+    - SQLite 操作為同步 I/O，透過 asyncio.to_thread 執行避免阻塞事件迴圈
+    - 多個 uvicorn worker 可共用同一檔案（WAL 模式）
+    """
+
+    # 單次 SQL IN 查詢的最大參數數量
+    _QUERY_CHUNK = 500
+
+    def __init__(self, path: str, model: str, max_entries: int = 200000):
+        """
+        初始化快取
+
+        Args:
+            path: SQLite 檔案路徑
+            model: Embedding 模型名稱
+            max_entries: 最大保留筆數
+        """
+        self.path = path
+        self.model = model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._count = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """開啟資料庫並在模型改變時清空快取"""
+        if self._conn is not None:
+            return self._conn
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access "
+            "ON embeddings (last_access)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+        )
+
+        row = conn.execute("SELECT value FROM meta WHERE name = 'model'").fetchone()
+        if row is None or row[0] != self.model:
+            if row is not None:
+                logging.info(
+                    f"Embedding model changed ({row[0]} -> {self.model}), clearing embedding cache"
+                )
+            conn.execute("DELETE FROM embeddings")
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('model', ?)",
+                (self.model,)
+            )
+        conn.commit()
+
+        self._count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._conn = conn
+        return conn
+
+    def _key(self, text: str) -> str:
+        """計算快取鍵"""
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _encode(vector: Sequence[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _decode(blob: bytes) -> List[float]:
+        values = array("f")
+        values.frombytes(blob)
+        return values.tolist()
+
+    def _get_many_sync(self, texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [self._key(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+
+        with self._lock:
+            conn = self._connect()
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), self._QUERY_CHUNK):
+                chunk = unique_keys[i:i + self._QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = self._decode(blob)
+
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+
+        return results
+
+    def _put_many_sync(self, texts: List[str], vectors: List[List[float]]) -> None:
+        now = time.time()
+        rows = [
+            (self._key(text), self._encode(vector), now)
+            for text, vector in zip(texts, vectors)
+            if vector
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                rows
+            )
+            self._count += conn.total_changes - before
+
+            # LRU 淘汰：刪除最久未使用的項目
+            excess = self._count - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                    (excess,)
+                )
+                self._count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            conn.commit()
+
+    async def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        批量查詢快取
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            List[Optional[List[float]]]: 與輸入順序對應的向量，未命中為 None
+        """
+        if not texts:
+            return []
+        return await asyncio.to_thread(self._get_many_sync, texts)
+
+    async def put_many(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """
+        批量寫入快取
+
+        Args:
+            texts: 文本列表
+            vectors: 對應的向量列表
+        """
+        if not texts:
+            return
+        await asyncio.to_thread(self._put_many_sync, texts, vectors)
+
+    def clear(self) -> None:
+        """清空快取"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM embeddings")
+            conn.commit()
+            self._count = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        total = self.hits + self.misses
+        return {
+            "model": self.model,
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,385 @@
+"""
+詞彙索引服務
+
+以 BM25 對文件切片做關鍵字檢索，補足向量檢索對精確詞彙（編號、料號、人名）的不足
+"""
+
+import asyncio
+import json
+import logging
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Tuple
+
+from app.core.config import settings
+from app.services.rag.vectorstore import SearchResult
+
+
+# CJK 統一表意文字、日文假名、韓文音節
+_CJK_PATTERN = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+_TOKEN_RE = re.compile(rf"[{_CJK_PATTERN}]+|[a-z0-9]+(?:[._\-/][a-z0-9]+)*")
+_CJK_RE = re.compile(rf"[{_CJK_PATTERN}]")
+_SPLIT_RE = re.compile(r"[._\-/]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    CJK 感知的分詞
+
+    - Unicode NFKC 正規化並轉小寫
+    - 連續的 CJK 字元切成重疊的雙字詞（bigram），單一字元則保留單字
+    - 英數詞以非英數字元分隔；含 . _ - / 的詞（如 AB-123、v1.2）同時保留完整詞與各部分
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        List[str]: 詞列表（可重複，用於計算詞頻）
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group()
+        if _CJK_RE.match(token):
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token)
+            parts = _SPLIT_RE.split(token)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part)
+
+    return tokens
+
+
+class _GroupLexicalIndex:
+    """
+    單一群組的倒排索引（SQLite 檔案）
+
+    資料表：
+    - chunks: 切片內容、所屬文件、長度（詞數）與 metadata
+    - postings: 詞 -> 切片的詞頻
+    - meta: 切片總數與總長度（計算 BM25 的 N 與平均長度）
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "chunk_id TEXT PRIMARY KEY, document_id INTEGER, length INTEGER NOT NULL, "
+            "content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks (document_id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term, chunk_id)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (chunk_id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('chunk_count', 0), ('total_length', 0)")
+        conn.commit()
+        self._conn = conn
+        return conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @staticmethod
+    def _remove_chunks(conn: sqlite3.Connection, chunk_ids: List[str]) -> int:
+        """刪除切片及其倒排記錄，並更新統計（需在交易中呼叫）"""
+        removed = 0
+        for i in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            row = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks WHERE chunk_id IN ({placeholders})",
+                batch
+            ).fetchone()
+            if not row[0]:
+                continue
+            conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", batch)
+            conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+            conn.execute("UPDATE meta SET value = value - ? WHERE name = 'chunk_count'", (row[0],))
+            conn.execute("UPDATE meta SET value = value - ? WHERE name = 'total_length'", (row[1],))
+            removed += row[0]
+        return removed
+
+
+class LexicalIndexService:
+    """
+    BM25 詞彙索引服務
+
+    業務邏輯：
+    - 文件處理時與向量同步寫入（相同切片 ID，重複寫入等同覆寫）
+    - 每個群組一個 SQLite 檔案，查詢只讀取該群組的倒排記錄
+    - 刪除文件時增量移除其切片與倒排記錄
+    - 查詢時以 BM25 計分，可限制在指定文件內
+
+    配置：
+    - LEXICAL_INDEX_DIR: 索引目錄
+
+    注意：
+    - SQLite 操作為同步 I/O，透過 asyncio.to_thread 執行
+    """
+
+    # BM25 參數
+    K1 = 1.2
+    B = 0.75
+
+    # 出現在超過此比例切片中的詞幾乎不具鑑別力，查詢時略過（除非查詢只有這類詞）
+    COMMON_TERM_RATIO = 0.5
+
+    def __init__(self, directory: str = None):
+        """
+        初始化詞彙索引服務
+
+        Args:
+            directory: 索引目錄
+        """
+        self.root = Path(directory or settings.LEXICAL_INDEX_DIR)
+        self._indexes: Dict[str, _GroupLexicalIndex] = {}
+        self._indexes_lock = threading.Lock()
+
+    def _group_key(self, group_id: Any) -> str:
+        return "none" if group_id is None else str(group_id)
+
+    def _index_path(self, group_id: Any) -> Path:
+        return self.root / f"group_{self._group_key(group_id)}.sqlite3"
+
+    def _get_index(self, group_id: Any, create: bool = True) -> Optional[_GroupLexicalIndex]:
+        key = self._group_key(group_id)
+        with self._indexes_lock:
+            index = self._indexes.get(key)
+            if index is None:
+                path = self._index_path(group_id)
+                if not create and not path.exists():
+                    return None
+                index = _GroupLexicalIndex(path)
+                self._indexes[key] = index
+            return index
+
+    # ============================================
+    # 寫入
+    # ============================================
+
+    def _add_sync(
+        self,
+        group_id: Any,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ) -> None:
+        index = self._get_index(group_id)
+        rows = []
+        postings = []
+        total_length = 0
+
+        for chunk_id, content, metadata in zip(ids, documents, metadatas):
+            terms = Counter(tokenize(content))
+            length = sum(terms.values())
+            total_length += length
+            rows.append((
+                chunk_id, metadata.get("document_id"), length, content,
+                json.dumps(metadata, ensure_ascii=False)
+            ))
+            postings.extend((term, chunk_id, tf) for term, tf in terms.items())
+
+        with index.lock:
+            conn = index.connect()
+            with conn:
+                index._remove_chunks(conn, list(ids))
+                conn.executemany(
+                    "INSERT INTO chunks (chunk_id, document_id, length, content, metadata) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    postings
+                )
+                conn.execute("UPDATE meta SET value = value + ? WHERE name = 'chunk_count'", (len(rows),))
+                conn.execute("UPDATE meta SET value = value + ? WHERE name = 'total_length'", (total_length,))
+
+    async def add_chunks(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ) -> None:
+        """
+        寫入切片（依 metadata 的 group_id 分到各群組索引）
+
+        Args:
+            ids: 切片 ID 列表（與向量庫相同）
+            documents: 切片文本列表
+            metadatas: metadata 列表（需包含 group_id、document_id）
+        """
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(self._group_key(metadata.get("group_id")), []).append(i)
+
+        for indexes in groups.values():
+            group_id = metadatas[indexes[0]].get("group_id")
+            await asyncio.to_thread(
+                self._add_sync,
+                group_id,
+                [ids[i] for i in indexes],
+                [documents[i] for i in indexes],
+                [metadatas[i] for i in indexes]
+            )
+
+    def _delete_document_sync(self, group_id: Any, document_id: int) -> int:
+        index = self._get_index(group_id, create=False)
+        if index is None:
+            return 0
+
+        with index.lock:
+            conn = index.connect()
+            with conn:
+                chunk_ids = [
+                    row[0] for row in conn.execute(
+                        "SELECT chunk_id FROM chunks WHERE document_id = ?", (document_id,)
+                    )
+                ]
+                return index._remove_chunks(conn, chunk_ids)
+
+    async def delete_document(self, group_id: Any, document_id: int) -> int:
+        """
+        刪除文件的所有切片
+
+        Args:
+            group_id: 群組 ID
+            document_id: 文件 ID
+
+        Returns:
+            int: 刪除的切片數
+        """
+        return await asyncio.to_thread(self._delete_document_sync, group_id, document_id)
+
+    # ============================================
+    # 查詢
+    # ============================================
+
+    def _search_sync(
+        self,
+        query: str,
+        group_id: Any,
+        top_k: int,
+        document_ids: Optional[List[int]]
+    ) -> List[SearchResult]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        index = self._get_index(group_id, create=False)
+        if index is None:
+            return []
+
+        with index.lock:
+            conn = index.connect()
+            stats = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+            n = stats.get("chunk_count", 0)
+            if not n:
+                return []
+            avgdl = stats.get("total_length", 0) / n or 1.0
+
+            placeholders = ",".join("?" * len(terms))
+            df = dict(conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term",
+                terms
+            ).fetchall())
+            if not df:
+                return []
+
+            selective = [t for t in df if df[t] <= n * self.COMMON_TERM_RATIO]
+            terms = selective or list(df)
+
+            sql = (
+                "SELECT p.term, p.chunk_id, p.tf, c.length FROM postings p "
+                "JOIN chunks c ON c.chunk_id = p.chunk_id "
+                f"WHERE p.term IN ({','.join('?' * len(terms))})"
+            )
+            params: List[Any] = list(terms)
+            if document_ids:
+                sql += f" AND c.document_id IN ({','.join('?' * len(document_ids))})"
+                params.extend(document_ids)
+
+            scores: Dict[str, float] = {}
+            for term, chunk_id, tf, length in conn.execute(sql, params):
+                idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+                norm = tf + self.K1 * (1 - self.B + self.B * length / avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.K1 + 1) / norm
+
+            top: List[Tuple[str, float]] = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+            if not top:
+                return []
+
+            placeholders = ",".join("?" * len(top))
+            rows = {
+                row[0]: row for row in conn.execute(
+                    f"SELECT chunk_id, content, metadata FROM chunks WHERE chunk_id IN ({placeholders})",
+                    [chunk_id for chunk_id, _ in top]
+                )
+            }
+
+        return [
+            SearchResult(
+                id=chunk_id,
+                content=rows[chunk_id][1],
+                metadata=json.loads(rows[chunk_id][2]),
+                score=score
+            )
+            for chunk_id, score in top
+            if chunk_id in rows
+        ]
+
+    async def search(
+        self,
+        query: str,
+        group_id: Any,
+        top_k: int = 10,
+        document_ids: Optional[List[int]] = None
+    ) -> List[SearchResult]:
+        """
+        BM25 查詢
+
+        Args:
+            query: 查詢文本
+            group_id: 群組 ID
+            top_k: 返回數量
+            document_ids: 限制在這些文件中搜尋
+
+        Returns:
+            List[SearchResult]: 搜尋結果（score 為 BM25 分數，由高到低）
+        """
+        try:
+            return await asyncio.to_thread(self._search_sync, query, group_id, top_k, document_ids)
+        except Exception as e:
+            logging.warning(f"Lexical search failed for group {group_id}: {e}")
+            return []
+
+
+# 單例實例
+lexical_index_service = LexicalIndexService()
@@ -0,0 +1,807 @@
+"""
+NumPy 向量資料庫服務
+
+在行程內以記憶體映射矩陣保存向量，提供與 VectorStoreService 相同的介面
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Callable, Set
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows：無跨行程檔案鎖，只支援單一寫入行程
+    fcntl = None
+
+from app.core.config import settings
+from app.services.rag.vectorstore import SearchResult, extract_field_values
+from app.services.rag.ann_index import IVFFlatIndex
+
+
+# ============================================
+# 過濾條件
+# ============================================
+
+def _match_condition(value: Any, condition: Any) -> bool:
+    """比對單一欄位條件（Chroma where 語法）"""
+    if not isinstance(condition, dict):
+        return value == condition
+
+    for op, expected in condition.items():
+        if op == "$eq" and not value == expected:
+            return False
+        if op == "$ne" and not value != expected:
+            return False
+        if op == "$in" and value not in expected:
+            return False
+        if op == "$nin" and value in expected:
+            return False
+        if op in ("$gt", "$gte", "$lt", "$lte"):
+            if value is None:
+                return False
+            if op == "$gt" and not value > expected:
+                return False
+            if op == "$gte" and not value >= expected:
+                return False
+            if op == "$lt" and not value < expected:
+                return False
+            if op == "$lte" and not value <= expected:
+                return False
+    return True
+
+
+def build_predicate(where: Optional[Dict[str, Any]]) -> Callable[[Dict[str, Any]], bool]:
+    """
+    將 Chroma where 條件轉換為判斷函數
+
+    支援 $and / $or 以及 $eq, $ne, $in, $nin, $gt, $gte, $lt, $lte
+    """
+    if not where:
+        return lambda metadata: True
+
+    def predicate(metadata: Dict[str, Any]) -> bool:
+        for key, condition in where.items():
+            if key == "$and":
+                if not all(build_predicate(c)(metadata) for c in condition):
+                    return False
+            elif key == "$or":
+                if not any(build_predicate(c)(metadata) for c in condition):
+                    return False
+            elif not _match_condition(metadata.get(key), condition):
+                return False
+        return True
+
+    return predicate
+
+
+def _only_fields(where: Optional[Dict[str, Any]], fields: Set[str]) -> bool:
+    """where 條件是否只包含指定欄位的 $eq / $in（可由索引完全處理）"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_only_fields(sub, fields) for sub in condition):
+                return False
+        elif key not in fields:
+            return False
+        elif isinstance(condition, dict) and not set(condition) <= {"$eq", "$in"}:
+            return False
+    return True
+
+
+# ============================================
+# 群組分區
+# ============================================
+
+class _GroupPartition:
+    """
+    單一群組的向量分區
+
+    檔案結構：
+    - vectors.f32: float32 記憶體映射矩陣（capacity x dim，已正規化）
+    - records.jsonl: 每行一筆 {id, document, metadata}，行號即矩陣列號
+
+    寫入順序為先寫向量再追加記錄，記錄數即有效列數，
+    中途失敗時多出的向量列會被忽略
+
+    刪除時將保留的列寫入新的 vectors.f32.tmp / records.jsonl.tmp，再依序以 os.replace 替換：
+    向量檔替換後即視為提交，載入時若只剩 records.jsonl.tmp 則補完替換，
+    兩個暫存檔都在則捨棄（尚未提交）。其他行程已映射的舊向量檔不受影響
+
+    所有寫入與重新載入都持有目錄內 .lock 的 fcntl 排他鎖，多個行程（API 與獨立 worker）
+    可安全共用同一目錄
+
+    啟用 ANN 索引時，另保存 IVF 群中心與指派陣列（ivf_*.npy），
+    資料量達門檻或大幅成長時於背景執行緒重新訓練
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    RECORDS_FILE = "records.jsonl"
+    LOCK_FILE = ".lock"
+    # 壓縮時每次複製的列數
+    COMPACT_BATCH = 65536
+
+    def __init__(
+        self,
+        directory: Path,
+        index: Optional[IVFFlatIndex] = None,
+        index_min_size: int = 0
+    ):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.index = index
+        self.index_min_size = index_min_size
+        self._rebuilding = False
+        self._delete_generation = 0
+        self._lock_file = None
+
+        self.dim = 0
+        self.capacity = 0
+        self.size = 0
+        self.matrix: Optional[np.memmap] = None
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.id_to_row: Dict[str, int] = {}
+        self.document_rows: Dict[Any, List[int]] = {}
+
+        self._records_stat = None
+        with self.file_lock():
+            self._load()
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.directory / self.VECTORS_FILE
+
+    @property
+    def _records_path(self) -> Path:
+        return self.directory / self.RECORDS_FILE
+
+    @property
+    def _vectors_tmp_path(self) -> Path:
+        return self.directory / (self.VECTORS_FILE + ".tmp")
+
+    @property
+    def _records_tmp_path(self) -> Path:
+        return self.directory / (self.RECORDS_FILE + ".tmp")
+
+    @contextmanager
+    def file_lock(self):
+        """
+        取得分區鎖（執行緒鎖 + 跨行程 fcntl 排他鎖）
+
+        同一執行緒可重入：已持有時不再鎖定檔案
+        """
+        with self.lock:
+            if self._lock_file is not None or fcntl is None:
+                yield
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            lock_file = open(self.directory / self.LOCK_FILE, "a")
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._lock_file = lock_file
+                yield
+            finally:
+                self._lock_file = None
+                lock_file.close()  # 關閉檔案即釋放 flock
+
+    def _recover_compaction(self):
+        """處理中斷的壓縮（需持有檔案鎖）"""
+        if self._vectors_tmp_path.exists():
+            # 向量檔尚未替換：壓縮未提交，捨棄暫存檔
+            self._vectors_tmp_path.unlink(missing_ok=True)
+            self._records_tmp_path.unlink(missing_ok=True)
+        elif self._records_tmp_path.exists():
+            # 向量檔已替換：補完記錄檔替換
+            os.replace(self._records_tmp_path, self._records_path)
+            logging.warning(f"Completed interrupted compaction in {self.directory}")
+
+    def _stat_records(self):
+        try:
+            stat = os.stat(self._records_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        """從磁碟載入分區（需持有檔案鎖）"""
+        self._recover_compaction()
+        self.ids, self.documents, self.metadatas = [], [], []
+
+        if self._records_path.exists():
+            with open(self._records_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    self.ids.append(record["id"])
+                    self.documents.append(record.get("document", ""))
+                    self.metadatas.append(record.get("metadata") or {})
+
+        self.size = len(self.ids)
+        self.matrix = None
+        self.dim = 0
+        self.capacity = 0
+
+        if self._vectors_path.exists() and self.size:
+            meta = json.loads((self.directory / "meta.json").read_text())
+            self.dim = meta["dim"]
+            self.capacity = os.path.getsize(self._vectors_path) // (4 * self.dim)
+            self.matrix = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r+",
+                shape=(self.capacity, self.dim)
+            )
+
+        self._rebuild_indexes()
+        self._records_stat = self._stat_records()
+
+        # 重新載入後列號可能改變，使進行中的背景重建失效
+        self._delete_generation += 1
+        if self.index is not None:
+            vectors = self.matrix[:self.size] if self.matrix is not None else None
+            self.index.load(self.directory, vectors)
+
+    def _rebuild_indexes(self):
+        self.id_to_row = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.document_rows = {}
+        for row, metadata in enumerate(self.metadatas):
+            self.document_rows.setdefault(metadata.get("document_id"), []).append(row)
+
+    def refresh(self):
+        """其他行程寫入後重新載入"""
+        if self._stat_records() == self._records_stat:
+            return
+        with self.file_lock():
+            if self._stat_records() != self._records_stat:
+                self._load()
+
+    def _ensure_capacity(self, needed: int, dim: int):
+        """確保矩陣容量足夠（倍增擴充檔案大小）"""
+        if self.dim and self.dim != dim:
+            raise ValueError(f"向量維度不符: 分區為 {self.dim}，收到 {dim}")
+
+        if needed <= self.capacity:
+            return
+
+        new_capacity = max(needed, self.capacity * 2, 1024)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * dim * 4)
+
+        self.dim = dim
+        self.capacity = new_capacity
+        (self.directory / "meta.json").write_text(json.dumps({"dim": dim}))
+        self.matrix = np.memmap(
+            self._vectors_path, dtype=np.float32, mode="r+",
+            shape=(self.capacity, self.dim)
+        )
+
+    def add(
+        self,
+        ids: List[str],
+        vectors: np.ndarray,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ):
+        """新增向量（已存在的 ID 會先刪除，等同 upsert）"""
+        with self.file_lock():
+            self.refresh()
+
+            existing = [doc_id for doc_id in ids if doc_id in self.id_to_row]
+            if existing:
+                self.delete_rows([self.id_to_row[doc_id] for doc_id in existing])
+
+            start = self.size
+            self._ensure_capacity(start + len(ids), vectors.shape[1])
+            self.matrix[start:start + len(ids)] = vectors
+            self.matrix.flush()
+
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                for doc_id, document, metadata in zip(ids, documents, metadatas):
+                    f.write(json.dumps(
+                        {"id": doc_id, "document": document, "metadata": metadata},
+                        ensure_ascii=False
+                    ) + "\n")
+
+            for offset, (doc_id, metadata) in enumerate(zip(ids, metadatas)):
+                row = start + offset
+                self.id_to_row[doc_id] = row
+                self.document_rows.setdefault(metadata.get("document_id"), []).append(row)
+            self.ids.extend(ids)
+            self.documents.extend(documents)
+            self.metadatas.extend(metadatas)
+            self.size += len(ids)
+            self._records_stat = self._stat_records()
+
+            if self.index is not None:
+                self.index.append(vectors)
+                self.index.save(self.directory)
+                self._maybe_schedule_rebuild()
+
+    def delete_rows(self, rows: List[int]) -> int:
+        """刪除指定列並壓縮矩陣（寫入新檔後原子替換）"""
+        with self.file_lock():
+            if not rows:
+                return 0
+
+            keep = np.ones(self.size, dtype=bool)
+            keep[rows] = False
+            kept_rows = np.nonzero(keep)[0]
+
+            ids = [self.ids[i] for i in kept_rows]
+            documents = [self.documents[i] for i in kept_rows]
+            metadatas = [self.metadatas[i] for i in kept_rows]
+
+            # 1. 寫入壓縮後的向量與記錄暫存檔
+            capacity = max(len(kept_rows), 1024)
+            if self.matrix is not None:
+                with open(self._vectors_tmp_path, "wb") as f:
+                    f.truncate(capacity * self.dim * 4)
+                compacted = np.memmap(
+                    self._vectors_tmp_path, dtype=np.float32, mode="r+",
+                    shape=(capacity, self.dim)
+                )
+                for i in range(0, len(kept_rows), self.COMPACT_BATCH):
+                    batch = kept_rows[i:i + self.COMPACT_BATCH]
+                    compacted[i:i + len(batch)] = self.matrix[batch]
+                compacted.flush()
+                del compacted
+                self._fsync(self._vectors_tmp_path)
+
+            with open(self._records_tmp_path, "w", encoding="utf-8") as f:
+                for doc_id, document, metadata in zip(ids, documents, metadatas):
+                    f.write(json.dumps(
+                        {"id": doc_id, "document": document, "metadata": metadata},
+                        ensure_ascii=False
+                    ) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            # 2. 替換向量檔（提交點），再替換記錄檔
+            if self.matrix is not None:
+                self.matrix = None
+                os.replace(self._vectors_tmp_path, self._vectors_path)
+                self.capacity = capacity
+                self.matrix = np.memmap(
+                    self._vectors_path, dtype=np.float32, mode="r+",
+                    shape=(self.capacity, self.dim)
+                )
+            os.replace(self._records_tmp_path, self._records_path)
+
+            self.ids, self.documents, self.metadatas = ids, documents, metadatas
+            self.size = len(kept_rows)
+
+            self._delete_generation += 1
+            if self.index is not None:
+                if self.size < self.index_min_size:
+                    self.index.reset()
+                else:
+                    self.index.compact(kept_rows)
+                self.index.save(self.directory)
+
+            self._rebuild_indexes()
+            self._records_stat = self._stat_records()
+            return len(rows)
+
+    @staticmethod
+    def _fsync(path: Path) -> None:
+        with open(path, "rb") as f:
+            os.fsync(f.fileno())
+
+    # ============================================
+    # ANN 索引背景重建
+    # ============================================
+
+    def _maybe_schedule_rebuild(self):
+        """資料量達門檻或大幅成長時，於背景執行緒重新訓練索引"""
+        if self._rebuilding or not self.index.needs_rebuild(self.size, self.index_min_size):
+            return
+        self._rebuilding = True
+        threading.Thread(target=self._rebuild_index, daemon=True).start()
+
+    def _rebuild_index(self):
+        """
+        重新訓練 IVF 索引
+
+        訓練與指派在鎖外以快照進行，查詢期間繼續使用舊索引；
+        完成後在鎖內補上快照之後新增的列並切換。若期間有刪除（列號改變），放棄本次結果
+        """
+        try:
+            with self.lock:
+                snapshot_size = self.size
+                generation = self._delete_generation
+                matrix = self.matrix
+
+            centroids = self.index.train_centroids(matrix[:snapshot_size])
+            assignments = self.index.assign(matrix[:snapshot_size], centroids)
+
+            with self.file_lock():
+                if generation != self._delete_generation:
+                    logging.info(f"IVF rebuild for {self.directory} discarded (rows changed)")
+                    return
+                if self.size > snapshot_size:
+                    tail = self.index.assign(self.matrix[snapshot_size:self.size], centroids)
+                    assignments = np.concatenate([assignments, tail])
+                self.index.install(centroids, assignments)
+                self.index.save(self.directory)
+                logging.info(
+                    f"IVF index rebuilt for {self.directory}: "
+                    f"{len(centroids)} lists, {self.size} vectors"
+                )
+        except Exception as e:
+            logging.error(f"IVF rebuild for {self.directory} failed: {e}")
+        finally:
+            self._rebuilding = False
+
+    def candidate_rows(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        依過濾條件取得候選列（在計分前套用）
+
+        Returns:
+            Optional[np.ndarray]: 候選列索引；None 表示全部列
+        """
+        document_ids = extract_field_values(where, "document_id")
+
+        if document_ids is not None:
+            rows = sorted(
+                row
+                for doc_id in document_ids
+                for row in self.document_rows.get(doc_id, [])
+            )
+        elif _only_fields(where, {"group_id"}):
+            return None
+        else:
+            rows = range(self.size)
+
+        if not _only_fields(where, {"group_id", "document_id"}):
+            predicate = build_predicate(where)
+            rows = [row for row in rows if predicate(self.metadatas[row])]
+
+        return np.asarray(rows, dtype=np.int64)
+
+    def search(
+        self,
+        query: np.ndarray,
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[tuple]:
+        """
+        Cosine top-k 搜尋
+
+        結果在持有鎖時組成，避免其他執行緒刪除或重新載入後列號對應到別的記錄
+
+        Returns:
+            List[tuple]: (id, document, metadata, score) 列表，分數由高到低
+        """
+        with self.lock:
+            self.refresh()
+            if not self.size or self.matrix is None:
+                return []
+
+            rows = self.candidate_rows(where)
+            if rows is None and self.index is not None:
+                # 無文件層級過濾時才使用 ANN；候選不足 k 筆則退回精確搜尋
+                ann_rows = self.index.candidate_rows(query, self.size)
+                if ann_rows is not None and len(ann_rows) >= n_results:
+                    rows = ann_rows
+
+            if rows is None:
+                scores = self.matrix[:self.size] @ query
+                row_ids = None
+            else:
+                if not len(rows):
+                    return []
+                scores = self.matrix[rows] @ query
+                row_ids = rows
+
+            k = min(n_results, len(scores))
+            if k < len(scores):
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(scores))
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            for i in top:
+                row = int(row_ids[i]) if row_ids is not None else int(i)
+                results.append((self.ids[row], self.documents[row], self.metadatas[row], float(scores[i])))
+            return results
+
+
+# ============================================
+# 向量資料庫服務
+# ============================================
+
+class NumpyVectorStore:
+    """
+    NumPy 向量資料庫服務
+
+    業務邏輯：
+    - 與 VectorStoreService 相同的介面（add_documents / query / delete_by_filter / count）
+    - 向量依 group_id 分區，存於 float32 記憶體映射矩陣
+    - 寫入時正規化向量，cosine 相似度即為矩陣乘積
+    - top-k 以 argpartition 取得，不需完整排序
+    - document_id / group_id 過濾在計分前套用
+    - 可選的 IVF-Flat 近似索引：大型群組只掃描最相近的 nprobe 個群
+
+    配置：
+    - VECTOR_STORE_BACKEND=numpy: 啟用此後端
+    - NUMPY_STORE_DIR: 資料目錄
+    - VECTOR_INDEX_TYPE: flat（精確）或 ivf（近似）
+    - IVF_NLIST / IVF_NPROBE / IVF_MIN_SIZE / IVF_REBUILD_GROWTH: IVF 參數
+
+    注意：
+    - 適用於中小型部署，省去 Chroma 服務與網路往返
+    - 多個 worker 共用目錄時，讀取前會檢查檔案是否被其他行程更新；
+      寫入與重新載入以每個分區的 fcntl 檔案鎖在行程間互斥（不支援 fcntl 的平台只支援單一寫入行程）
+    """
+
+    def __init__(
+        self,
+        directory: str = None,
+        collection_name: str = None,
+        index_type: str = None
+    ):
+        """
+        初始化向量資料庫服務
+
+        Args:
+            directory: 資料目錄
+            collection_name: Collection 名稱（作為子目錄）
+            index_type: 索引類型（flat 或 ivf，預設讀取 VECTOR_INDEX_TYPE）
+        """
+        self.index_type = (index_type or settings.VECTOR_INDEX_TYPE).lower()
+        if self.index_type not in ("flat", "ivf"):
+            raise ValueError(f"不支援的索引類型: {self.index_type}。支援的選項: flat, ivf")
+        self.collection_name = collection_name or settings.CHROMA_COLLECTION_NAME
+        self.root = Path(directory or settings.NUMPY_STORE_DIR) / self.collection_name
+        self.base_url = f"numpy://{self.root}"
+        self._partitions: Dict[Any, _GroupPartition] = {}
+        self._lock = threading.Lock()
+
+    # ============================================
+    # 分區管理
+    # ============================================
+
+    def _partition_dir(self, group_key: str) -> Path:
+        return self.root / f"group_{group_key}"
+
+    def _get_partition(self, group_id: Any) -> _GroupPartition:
+        """取得分區（以 group_id 的字串形式為鍵，與目錄名稱一致）"""
+        group_key = str(group_id)
+        with self._lock:
+            partition = self._partitions.get(group_key)
+            if partition is None:
+                partition = _GroupPartition(
+                    self._partition_dir(group_key),
+                    index=self._create_index(),
+                    index_min_size=settings.IVF_MIN_SIZE
+                )
+                self._partitions[group_key] = partition
+            return partition
+
+    def _create_index(self) -> Optional[IVFFlatIndex]:
+        if self.index_type != "ivf":
+            return None
+        return IVFFlatIndex(
+            nlist=settings.IVF_NLIST,
+            nprobe=settings.IVF_NPROBE,
+            rebuild_growth=settings.IVF_REBUILD_GROWTH
+        )
+
+    def _all_group_keys(self) -> List[str]:
+        """列出所有分區"""
+        group_keys = set(self._partitions)
+        if self.root.exists():
+            for path in self.root.iterdir():
+                if path.is_dir() and path.name.startswith("group_"):
+                    group_keys.add(path.name[len("group_"):])
+        return sorted(group_keys)
+
+    def _target_groups(self, where: Optional[Dict[str, Any]]) -> List[str]:
+        """依過濾條件決定要查詢的分區"""
+        group_ids = extract_field_values(where, "group_id")
+        if group_ids is None:
+            return self._all_group_keys()
+        group_keys = {str(g) for g in group_ids}
+        return sorted(
+            key for key in group_keys
+            if key in self._partitions or self._partition_dir(key).exists()
+        )
+
+    @staticmethod
+    def _normalize(vectors: List[List[float]]) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    async def _ensure_collection(self) -> str:
+        """與 VectorStoreService 相容：確保資料目錄存在"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.collection_name
+
+    # ============================================
+    # 公開介面
+    # ============================================
+
+    def _add_sync(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: Optional[List[Dict[str, Any]]]
+    ):
+        metadatas = metadatas or [{} for _ in ids]
+        vectors = self._normalize(embeddings)
+
+        # 依 group_id 分組寫入
+        by_group: Dict[Any, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            by_group.setdefault(metadata.get("group_id"), []).append(i)
+
+        for group_id, indexes in by_group.items():
+            self._get_partition(group_id).add(
+                ids=[ids[i] for i in indexes],
+                vectors=vectors[indexes],
+                documents=[documents[i] for i in indexes],
+                metadatas=[metadatas[i] for i in indexes]
+            )
+
+    async def add_documents(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> bool:
+        """
+        新增文件到向量資料庫
+
+        Args:
+            ids: 文件 ID 列表
+            embeddings: 向量列表
+            documents: 原始文本列表
+            metadatas: 元資料列表（需包含 group_id 以決定分區）
+
+        Returns:
+            bool: 是否成功
+        """
+        if not ids:
+            return True
+        await asyncio.to_thread(self._add_sync, ids, embeddings, documents, metadatas)
+        return True
+
+    async def upsert_documents(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> bool:
+        """新增或覆寫文件（分區寫入本身即為 upsert 語意）"""
+        return await self.add_documents(ids, embeddings, documents, metadatas)
+
+    def _query_sync(
+        self,
+        query_embedding: List[float],
+        n_results: int,
+        where: Optional[Dict[str, Any]]
+    ) -> List[SearchResult]:
+        query = self._normalize([query_embedding])[0]
+
+        candidates = []
+        for group_id in self._target_groups(where):
+            partition = self._get_partition(group_id)
+            for doc_id, document, metadata, score in partition.search(query, n_results, where):
+                candidates.append(SearchResult(
+                    id=doc_id,
+                    content=document,
+                    metadata=metadata,
+                    score=score
+                ))
+
+        candidates.sort(key=lambda r: r.score, reverse=True)
+        return candidates[:n_results]
+
+    async def query(
+        self,
+        query_embedding: List[float],
+        n_results: int = 5,
+        where: Optional[Dict[str, Any]] = None,
+        include: List[str] = None
+    ) -> List[SearchResult]:
+        """
+        查詢相似文件
+
+        Args:
+            query_embedding: 查詢向量
+            n_results: 返回結果數量
+            where: 過濾條件
+            include: 與 Chroma 介面相容，未使用
+
+        Returns:
+            List[SearchResult]: 搜尋結果列表（score 為 cosine 相似度）
+        """
+        return await asyncio.to_thread(self._query_sync, query_embedding, n_results, where)
+
+    def _delete_sync(self, where: Optional[Dict[str, Any]], ids: Optional[List[str]]) -> int:
+        deleted = 0
+        for group_id in self._target_groups(where):
+            partition = self._get_partition(group_id)
+            with partition.file_lock():
+                partition.refresh()
+                if ids is not None:
+                    rows = [partition.id_to_row[i] for i in ids if i in partition.id_to_row]
+                else:
+                    rows = partition.candidate_rows(where)
+                    rows = list(range(partition.size)) if rows is None else rows.tolist()
+                deleted += partition.delete_rows(rows)
+
+                if partition.size == 0:
+                    with self._lock:
+                        self._partitions.pop(str(group_id), None)
+                    shutil.rmtree(partition.directory, ignore_errors=True)
+        return deleted
+
+    async def delete_by_ids(self, ids: List[str]) -> bool:
+        """
+        根據 ID 刪除文件
+
+        Args:
+            ids: 要刪除的文件 ID 列表
+
+        Returns:
+            bool: 是否成功
+        """
+        await asyncio.to_thread(self._delete_sync, None, ids)
+        return True
+
+    async def delete_by_filter(self, where: Dict[str, Any]) -> bool:
+        """
+        根據條件刪除文件
+
+        Args:
+            where: 過濾條件（例如 {"document_id": 1}）
+
+        Returns:
+            bool: 是否成功
+        """
+        await asyncio.to_thread(self._delete_sync, where, None)
+        return True
+
+    def _count_sync(self) -> int:
+        total = 0
+        for group_id in self._all_group_keys():
+            partition = self._get_partition(group_id)
+            with partition.lock:
+                partition.refresh()
+                total += partition.size
+        return total
+
+    async def count(self) -> int:
+        """取得文件數量"""
+        return await asyncio.to_thread(self._count_sync)
+
+    async def health_check(self) -> bool:
+        """健康檢查"""
+        try:
+            await self._ensure_collection()
+            return os.access(self.root, os.W_OK)
+        except Exception:
+            return False
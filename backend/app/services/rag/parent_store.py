@@ -0,0 +1,147 @@
+"""
+父段落儲存
+
+父子分塊模式下，父段落只存一份在本地 SQLite，不進入向量庫
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Dict, Tuple
+
+from app.core.config import settings
+
+
+class ParentChunkStore:
+    """
+    父段落儲存
+
+    業務邏輯：
+    - 以 (document_id, parent_index) 為鍵保存父段落內容與原文位置
+    - 重新處理文件時整份覆寫；刪除文件時一併刪除
+    - 檢索時依子塊 metadata 的 parent_index 批次取回父段落
+
+    注意：
+    - SQLite 操作為同步 I/O，透過 asyncio.to_thread 執行
+    - 多個 uvicorn worker 可共用同一檔案（WAL 模式）
+    """
+
+    # 單次 SQL 查詢的最大鍵數
+    _QUERY_CHUNK = 400
+
+    def __init__(self, path: str = None):
+        """
+        初始化儲存
+
+        Args:
+            path: SQLite 檔案路徑
+        """
+        self.path = path or settings.PARENT_STORE_PATH
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS parents ("
+            "document_id INTEGER NOT NULL, parent_index INTEGER NOT NULL, group_id INTEGER, "
+            "content TEXT NOT NULL, start_char INTEGER NOT NULL, end_char INTEGER NOT NULL, "
+            "PRIMARY KEY (document_id, parent_index)) WITHOUT ROWID"
+        )
+        conn.commit()
+        self._conn = conn
+        return conn
+
+    def _put_document_sync(self, document_id: int, group_id: Optional[int], parents: list) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM parents WHERE document_id = ?", (document_id,))
+                conn.executemany(
+                    "INSERT INTO parents (document_id, parent_index, group_id, content, start_char, end_char) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (document_id, p.chunk_index, group_id, p.content, p.start_char, p.end_char)
+                        for p in parents
+                    ]
+                )
+
+    async def put_document(self, document_id: int, group_id: Optional[int], parents: list) -> None:
+        """
+        保存文件的所有父段落（覆寫該文件原有的父段落）
+
+        Args:
+            document_id: 文件 ID
+            group_id: 群組 ID
+            parents: 父段落列表（TextChunk）
+        """
+        await asyncio.to_thread(self._put_document_sync, document_id, group_id, parents)
+
+    def _get_many_sync(self, keys: List[Tuple[int, int]]) -> Dict[Tuple[int, int], dict]:
+        found: Dict[Tuple[int, int], dict] = {}
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(keys), self._QUERY_CHUNK):
+                batch = keys[i:i + self._QUERY_CHUNK]
+                condition = " OR ".join("(document_id = ? AND parent_index = ?)" for _ in batch)
+                params = [value for key in batch for value in key]
+                for document_id, parent_index, content, start_char, end_char in conn.execute(
+                    f"SELECT document_id, parent_index, content, start_char, end_char "
+                    f"FROM parents WHERE {condition}",
+                    params
+                ):
+                    found[(document_id, parent_index)] = {
+                        "content": content,
+                        "start_char": start_char,
+                        "end_char": end_char
+                    }
+        return found
+
+    async def get_many(self, keys: List[Tuple[int, int]]) -> Dict[Tuple[int, int], dict]:
+        """
+        批次取得父段落
+
+        Args:
+            keys: (document_id, parent_index) 列表
+
+        Returns:
+            Dict: 鍵 -> {"content", "start_char", "end_char"}；找不到的鍵不在結果中
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        try:
+            return await asyncio.to_thread(self._get_many_sync, keys)
+        except Exception as e:
+            logging.warning(f"Parent chunk lookup failed: {e}")
+            return {}
+
+    def _delete_document_sync(self, document_id: int) -> int:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute("DELETE FROM parents WHERE document_id = ?", (document_id,)).rowcount
+
+    async def delete_document(self, document_id: int) -> int:
+        """
+        刪除文件的所有父段落
+
+        Args:
+            document_id: 文件 ID
+
+        Returns:
+            int: 刪除筆數
+        """
+        return await asyncio.to_thread(self._delete_document_sync, document_id)
+
+
+# 單例實例
+parent_store = ParentChunkStore()
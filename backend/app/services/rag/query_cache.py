@@ -0,0 +1,256 @@
+"""
+查詢向量快取
+
+快取使用者問題的 embedding，避免重複問題每次都呼叫 Ollama
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """
+    正規化查詢文本作為快取鍵
+
+    - Unicode NFKC（全形轉半形）
+    - 轉小寫
+    - 合併連續空白並去除頭尾空白
+    """
+    text = unicodedata.normalize("NFKC", query)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip().lower()
+
+
+class QueryEmbeddingCache:
+    """
+    查詢向量 LRU + TTL 快取
+
+    業務邏輯：
+    - 以正規化後的查詢文本為鍵
+    - 記憶體內 LRU，依筆數與估算的位元組數限制大小
+    - 每筆資料有存活時間（TTL），過期即視為未命中
+    - 可選的共用層：多個 uvicorn worker 透過同一個 SQLite 檔案共用快取
+
+    配置：
+    - QUERY_EMBEDDING_CACHE_MAX_ENTRIES: 最大筆數
+    - QUERY_EMBEDDING_CACHE_MAX_BYTES: 最大記憶體用量（估算）
+    - QUERY_EMBEDDING_CACHE_TTL: 存活時間（秒）
+    - QUERY_EMBEDDING_CACHE_SHARED / QUERY_EMBEDDING_CACHE_PATH: 跨 worker 共用
+    """
+
+    # 每個 float 在 Python list 中約佔 8 bytes 指標 + 24 bytes 物件
+    _BYTES_PER_FLOAT = 32
+
+    def __init__(
+        self,
+        model: str,
+        max_entries: int = 2048,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600.0,
+        shared_path: Optional[str] = None
+    ):
+        """
+        初始化快取
+
+        Args:
+            model: Embedding 模型名稱（納入鍵中）
+            max_entries: 最大筆數
+            max_bytes: 最大記憶體用量（估算）
+            ttl: 存活時間（秒）
+            shared_path: 共用 SQLite 檔案路徑（None 表示只用記憶體）
+        """
+        self.model = model
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared_path = shared_path
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+        # key -> (expires_at, vector)
+        self._entries: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._bytes = 0
+
+        self._shared_lock = threading.Lock()
+        self._shared_conn: Optional[sqlite3.Connection] = None
+
+    def _key(self, query: str) -> str:
+        normalized = normalize_query(query)
+        return hashlib.sha256(f"{self.model}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _size_of(self, vector: List[float]) -> int:
+        return len(vector) * self._BYTES_PER_FLOAT
+
+    # ============================================
+    # 記憶體層
+    # ============================================
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, vector = entry
+        if expires_at < time.time():
+            self._remove_local(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return vector
+
+    def _put_local(self, key: str, vector: List[float], expires_at: float) -> None:
+        if key in self._entries:
+            self._remove_local(key)
+
+        self._entries[key] = (expires_at, vector)
+        self._bytes += self._size_of(vector)
+
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest_key = next(iter(self._entries))
+            self._remove_local(oldest_key)
+
+    def _remove_local(self, key: str) -> None:
+        _, vector = self._entries.pop(key)
+        self._bytes -= self._size_of(vector)
+
+    # ============================================
+    # 共用層（SQLite）
+    # ============================================
+
+    def _connect_shared(self) -> sqlite3.Connection:
+        if self._shared_conn is not None:
+            return self._shared_conn
+
+        Path(self.shared_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.shared_path, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_query_embeddings_expires "
+            "ON query_embeddings (expires_at)"
+        )
+        conn.commit()
+        self._shared_conn = conn
+        return conn
+
+    def _get_shared_sync(self, key: str) -> Optional[Tuple[float, List[float]]]:
+        with self._shared_lock:
+            conn = self._connect_shared()
+            row = conn.execute(
+                "SELECT expires_at, vector FROM query_embeddings WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+
+        values = array("f")
+        values.frombytes(row[1])
+        return row[0], values.tolist()
+
+    def _put_shared_sync(self, key: str, vector: List[float], expires_at: float) -> None:
+        with self._shared_lock:
+            conn = self._connect_shared()
+            conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector, expires_at) VALUES (?, ?, ?)",
+                (key, array("f", vector).tobytes(), expires_at)
+            )
+            conn.execute(
+                "DELETE FROM query_embeddings WHERE expires_at < ?",
+                (time.time(),)
+            )
+            conn.commit()
+
+    # ============================================
+    # 公開介面
+    # ============================================
+
+    async def get(self, query: str) -> Optional[List[float]]:
+        """
+        查詢快取
+
+        Args:
+            query: 查詢文本
+
+        Returns:
+            Optional[List[float]]: 命中時返回向量，否則 None
+        """
+        key = self._key(query)
+
+        vector = self._get_local(key)
+        if vector is not None:
+            self.hits += 1
+            return vector
+
+        if self.shared_path:
+            try:
+                shared = await asyncio.to_thread(self._get_shared_sync, key)
+            except Exception as e:
+                logging.warning(f"Shared query cache lookup failed: {e}")
+                shared = None
+
+            if shared is not None:
+                expires_at, vector = shared
+                self._put_local(key, vector, expires_at)
+                self.shared_hits += 1
+                return vector
+
+        self.misses += 1
+        return None
+
+    async def put(self, query: str, vector: List[float]) -> None:
+        """
+        寫入快取
+
+        Args:
+            query: 查詢文本
+            vector: 查詢向量
+        """
+        if not vector:
+            return
+
+        key = self._key(query)
+        expires_at = time.time() + self.ttl
+        self._put_local(key, vector, expires_at)
+
+        if self.shared_path:
+            try:
+                await asyncio.to_thread(self._put_shared_sync, key, vector, expires_at)
+            except Exception as e:
+                logging.warning(f"Shared query cache write failed: {e}")
+
+    def clear(self) -> None:
+        """清空記憶體層"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        total = self.hits + self.shared_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "approx_bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "shared": bool(self.shared_path),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.shared_hits) / total, 3) if total else 0.0,
+        }
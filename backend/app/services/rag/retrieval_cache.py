@@ -0,0 +1,241 @@
+"""
+檢索結果快取
+
+以群組索引版本作失效判斷的 RetrieverService.retrieve 結果快取
+"""
+
+import asyncio
+import copy
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Tuple
+
+from app.core.config import settings
+from app.services.rag.query_cache import normalize_query
+
+
+class IndexVersionRegistry:
+    """
+    群組索引版本
+
+    業務邏輯：
+    - 每個群組一個遞增的版本號
+    - 文件處理完成、文件刪除、群組刪除時遞增
+    - 快取項目記錄寫入時的版本，版本不同即視為失效
+
+    注意：
+    - 版本保存在 SQLite 檔案，多個 uvicorn worker 共用同一份版本
+    """
+
+    def __init__(self, path: str = None):
+        """
+        初始化版本登錄
+
+        Args:
+            path: SQLite 檔案路徑
+        """
+        self.path = path or settings.INDEX_VERSION_PATH
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS index_versions ("
+            "group_id TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        conn.commit()
+        self._conn = conn
+        return conn
+
+    def _get_sync(self, group_id: Any) -> int:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT version FROM index_versions WHERE group_id = ?",
+                (str(group_id),)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def _bump_sync(self, group_id: Any) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO index_versions (group_id, version) VALUES (?, 1) "
+                "ON CONFLICT(group_id) DO UPDATE SET version = version + 1",
+                (str(group_id),)
+            )
+            conn.commit()
+
+    async def get(self, group_id: Any) -> int:
+        """
+        取得群組目前的索引版本
+
+        Args:
+            group_id: 群組 ID
+
+        Returns:
+            int: 版本號（從未變更過為 0）
+        """
+        return await asyncio.to_thread(self._get_sync, group_id)
+
+    async def bump(self, group_id: Any) -> None:
+        """
+        遞增群組的索引版本（使該群組所有快取失效）
+
+        失敗只記錄警告，不影響呼叫端的主要流程
+
+        Args:
+            group_id: 群組 ID
+        """
+        try:
+            await asyncio.to_thread(self._bump_sync, group_id)
+        except Exception as e:
+            logging.warning(f"Failed to bump index version for group {group_id}: {e}")
+
+
+class RetrievalCache:
+    """
+    檢索結果 LRU 快取
+
+    業務邏輯：
+    - 鍵為 (group_id, document_ids, 正規化查詢, top_k, min_score)
+    - 每筆記錄寫入時的群組索引版本，讀取時版本不同即失效
+    - 依筆數與估算的位元組數限制大小，另有 TTL 作為保險
+    - 記錄命中 / 未命中 / 失效次數
+
+    配置：
+    - RETRIEVAL_CACHE_MAX_ENTRIES: 最大筆數
+    - RETRIEVAL_CACHE_MAX_BYTES: 最大記憶體用量（估算）
+    - RETRIEVAL_CACHE_TTL: 存活時間（秒）
+    """
+
+    # 每筆結果除內容外的固定開銷估算（dataclass + metadata）
+    _BYTES_PER_RESULT = 512
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl: float = 600.0
+    ):
+        """
+        初始化快取
+
+        Args:
+            max_entries: 最大筆數
+            max_bytes: 最大記憶體用量（估算）
+            ttl: 存活時間（秒）
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        # key -> (version, expires_at, size, results)
+        self._entries: "OrderedDict[tuple, Tuple[int, float, int, list]]" = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def make_key(
+        group_id: Any,
+        document_ids: Optional[List[int]],
+        query: str,
+        top_k: int,
+        min_score: float
+    ) -> tuple:
+        """建立快取鍵（document_ids 排序後比較）"""
+        docs = tuple(sorted(document_ids)) if document_ids else None
+        return (group_id, docs, normalize_query(query), top_k, min_score)
+
+    def _size_of(self, results: list) -> int:
+        return sum(len(r.content) * 2 + self._BYTES_PER_RESULT for r in results)
+
+    def _remove(self, key: tuple) -> None:
+        _, _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key: tuple, version: int) -> Optional[list]:
+        """
+        查詢快取
+
+        Args:
+            key: make_key 建立的鍵
+            version: 群組目前的索引版本
+
+        Returns:
+            Optional[list]: 命中時返回結果的深層複本（metadata、chunk_indices 不與快取共用），否則 None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        entry_version, expires_at, _, results = entry
+        if entry_version != version or expires_at < time.time():
+            self._remove(key)
+            self.invalidations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(results)
+
+    def put(self, key: tuple, version: int, results: list) -> None:
+        """
+        寫入快取
+
+        Args:
+            key: make_key 建立的鍵
+            version: 檢索開始前讀取的索引版本
+            results: 檢索結果
+        """
+        if key in self._entries:
+            self._remove(key)
+
+        size = self._size_of(results)
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (version, time.time() + self.ttl, size, copy.deepcopy(results))
+        self._bytes += size
+
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """清空快取"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "approx_bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+# 單例實例
+index_versions = IndexVersionRegistry()
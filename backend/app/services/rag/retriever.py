@@ -4,11 +4,17 @@
 從向量資料庫檢索相關文件
 """
 
+import asyncio
+import logging
 from typing import List, Optional, Dict, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from app.services.rag.embedder import EmbeddingService, embedding_service
 from app.services.rag.vectorstore import VectorStoreService, vectorstore_service, SearchResult
+from app.services.rag.lexical_index import LexicalIndexService, lexical_index_service
+from app.services.rag.retrieval_cache import RetrievalCache, IndexVersionRegistry, index_versions
+from app.services.rag.parent_store import ParentChunkStore, parent_store as default_parent_store
+from app.services.rag.document_index import DocumentCentroidIndex, document_centroid_index
 from app.core.config import settings
 
 
@@ -19,8 +25,10 @@ class RetrievalResult:
     document_id: int
     document_name: str
     chunk_index: int
-    score: float
+    score: float  # 相似度分數（0-1）
     metadata: Dict[str, Any]
+    fusion_score: float = 0.0  # 混合檢索的 RRF 分數（排序依據）
+    chunk_indices: List[int] = field(default_factory=list)  # 合併後包含的切片索引（未合併時為空）
 
 
 class RetrieverService:
@@ -31,17 +39,40 @@ class RetrieverService:
     - 將查詢轉換為向量
     - 從向量資料庫檢索相關文件
     - 支援文件過濾和權限控制
+    - 混合檢索：向量與 BM25 並行查詢，以 Reciprocal Rank Fusion 合併
+    - 兩階段檢索：大型群組先以文件中心向量挑出前 M 份文件，向量檢索只搜尋這些文件
+      （BM25 不剪枝，精確詞彙仍可命中其他文件）
     - 返回排序後的結果
+    - 父子分塊的子塊換成所屬的父段落，同一父段落只返回一次
+    - 同一文件中重疊或相鄰的切片合併為一段（依 start_char / end_char），避免重複內容
+    - 群組內相同查詢的結果會被快取，群組索引版本改變時失效
 
     配置：
     - TOP_K_RETRIEVAL: 返回的文件數量
+    - HYBRID_SEARCH_ENABLED: 是否啟用 BM25
+    - HYBRID_RRF_K / HYBRID_VECTOR_WEIGHT / HYBRID_BM25_WEIGHT: 融合參數
+    - RETRIEVAL_CACHE_ENABLED: 是否啟用檢索結果快取
+    - DOCUMENT_PRUNING_ENABLED / DOCUMENT_PRUNING_TOP_M: 兩階段檢索
+    - RETRIEVAL_MERGE_ADJACENT: 是否合併重疊與相鄰的切片
     """
 
+    # 判定為相鄰的最大間隔字元數（分塊時去除的空白）
+    MERGE_MAX_GAP = 2
+    # 以內容比對重疊時的最短重疊字元數（避免誤判偶然相同的字元）
+    MERGE_MIN_OVERLAP = 16
+
     def __init__(
         self,
         embed_service: EmbeddingService = None,
         vector_service: VectorStoreService = None,
-        top_k: int = None
+        top_k: int = None,
+        lexical_service: LexicalIndexService = None,
+        hybrid: bool = None,
+        cache: Optional[RetrievalCache] = None,
+        versions: IndexVersionRegistry = None,
+        parent_store: ParentChunkStore = None,
+        document_index: DocumentCentroidIndex = None,
+        pruning: bool = None
     ):
         """
         初始化檢索服務
@@ -50,10 +81,30 @@ class RetrieverService:
             embed_service: Embedding 服務
             vector_service: 向量資料庫服務
             top_k: 返回的文件數量
+            lexical_service: BM25 詞彙索引服務
+            hybrid: 是否啟用混合檢索（預設讀取 HYBRID_SEARCH_ENABLED）
+            cache: 檢索結果快取（預設依 RETRIEVAL_CACHE_* 建立）
+            versions: 群組索引版本登錄
+            parent_store: 父段落儲存（父子分塊模式）
+            document_index: 文件中心向量索引
+            pruning: 是否啟用兩階段檢索（預設讀取 DOCUMENT_PRUNING_ENABLED）
         """
         self.embedding = embed_service or embedding_service
         self.vectorstore = vector_service or vectorstore_service
+        self.lexical = lexical_service or lexical_index_service
         self.top_k = top_k or settings.TOP_K_RETRIEVAL
+        self.hybrid = settings.HYBRID_SEARCH_ENABLED if hybrid is None else hybrid
+        self.versions = versions or index_versions
+        self.parents = parent_store or default_parent_store
+        self.documents = document_index or document_centroid_index
+        self.pruning = settings.DOCUMENT_PRUNING_ENABLED if pruning is None else pruning
+        if cache is None and settings.RETRIEVAL_CACHE_ENABLED:
+            cache = RetrievalCache(
+                max_entries=settings.RETRIEVAL_CACHE_MAX_ENTRIES,
+                max_bytes=settings.RETRIEVAL_CACHE_MAX_BYTES,
+                ttl=settings.RETRIEVAL_CACHE_TTL
+            )
+        self.cache = cache
 
     async def retrieve(
         self,
@@ -71,44 +122,286 @@ class RetrieverService:
             top_k: 返回數量（覆蓋預設值）
             document_ids: 限制在這些文件中搜尋
             group_id: 限制在此群組中搜尋
-            min_score: 最低相似度分數
+            min_score: 最低相似度分數（混合檢索時套用於融合後的結果，
+                只由 BM25 找到的切片以估算的 score 比較）
 
         Returns:
             List[RetrievalResult]: 檢索結果列表
         """
         k = top_k or self.top_k
 
-        # 1. 將查詢轉換為向量
-        query_embedding = await self.embedding.embed_query(query)
+        # 快取只用於有群組的查詢（版本以群組為單位）
+        if self.cache is None or group_id is None:
+            return await self._retrieve(query, k, document_ids, group_id, min_score)
 
-        # 2. 建立過濾條件
-        where = self._build_filter(document_ids, group_id)
+        key = self.cache.make_key(group_id, document_ids, query, k, min_score)
+        try:
+            version = await self.versions.get(group_id)
+        except Exception as e:
+            logging.warning(f"Index version lookup failed, bypassing retrieval cache: {e}")
+            return await self._retrieve(query, k, document_ids, group_id, min_score)
 
-        # 3. 從向量資料庫查詢
-        search_results = await self.vectorstore.query(
-            query_embedding=query_embedding,
-            n_results=k * 2,  # 多查一些以便過濾
-            where=where
-        )
+        cached = self.cache.get(key, version)
+        if cached is not None:
+            return cached
+
+        results = await self._retrieve(query, k, document_ids, group_id, min_score)
+        self.cache.put(key, version, results)
+        return results
 
-        # 4. 過濾和轉換結果
+    async def _retrieve(
+        self,
+        query: str,
+        k: int,
+        document_ids: Optional[List[int]],
+        group_id: Optional[int],
+        min_score: float
+    ) -> List[RetrievalResult]:
+        """執行檢索（不經快取）"""
+        # 1. 向量檢索與 BM25 檢索並行（BM25 索引依群組分檔，需要 group_id）
+        use_lexical = self.hybrid and group_id is not None
+        vector_task = self._vector_search(query, k * 2, document_ids, group_id)  # 多查一些以便過濾
+        if use_lexical:
+            search_results, lexical_results = await asyncio.gather(
+                vector_task,
+                self.lexical.search(query, group_id, top_k=k * 2, document_ids=document_ids)
+            )
+        else:
+            search_results, lexical_results = await vector_task, []
+
+        # 2. 過濾和轉換結果
         results = []
         for sr in search_results:
             if sr.score < min_score:
                 continue
+            results.append(self._to_result(sr, sr.score))
+
+        # 3. 合併並排序（只由 BM25 找到的切片以估算的 score 同樣套用 min_score）
+        if use_lexical:
+            results = [r for r in self._fuse(results, lexical_results) if r.score >= min_score]
+        else:
+            results.sort(key=lambda x: x.score, reverse=True)
+        results = results[:k]
 
-            results.append(RetrievalResult(
-                content=sr.content,
-                document_id=sr.metadata.get("document_id", 0),
-                document_name=sr.metadata.get("filename", ""),
-                chunk_index=sr.metadata.get("chunk_index", 0),
-                score=sr.score,
-                metadata=sr.metadata
-            ))
+        # 4. 子塊換成父段落（只有父子分塊處理過的切片帶有 parent_index）
+        results = await self._expand_parents(results)
 
-        # 5. 按分數排序並限制數量
-        results.sort(key=lambda x: x.score, reverse=True)
-        return results[:k]
+        # 5. 合併同一文件中重疊或相鄰的切片
+        if settings.RETRIEVAL_MERGE_ADJACENT:
+            results = self._merge_adjacent(results)
+        return results
+
+    async def _vector_search(
+        self,
+        query: str,
+        n_results: int,
+        document_ids: Optional[List[int]],
+        group_id: Optional[int]
+    ) -> List[SearchResult]:
+        """將查詢轉換為向量並從向量資料庫查詢（大型群組先以文件中心向量剪枝）"""
+        query_embedding = await self.embedding.embed_query(query)
+        if self.pruning and group_id is not None:
+            top_documents = await self.documents.top_documents(
+                group_id,
+                query_embedding,
+                top_m=settings.DOCUMENT_PRUNING_TOP_M,
+                document_ids=document_ids,
+                min_documents=settings.DOCUMENT_PRUNING_MIN_DOCUMENTS
+            )
+            if top_documents is not None:
+                document_ids = top_documents
+        return await self.vectorstore.query(
+            query_embedding=query_embedding,
+            n_results=n_results,
+            where=self._build_filter(document_ids, group_id)
+        )
+
+    @staticmethod
+    def _to_result(sr: SearchResult, score: float) -> RetrievalResult:
+        return RetrievalResult(
+            content=sr.content,
+            document_id=sr.metadata.get("document_id", 0),
+            document_name=sr.metadata.get("filename", ""),
+            chunk_index=sr.metadata.get("chunk_index", 0),
+            score=score,
+            metadata=sr.metadata
+        )
+
+    def _fuse(
+        self,
+        vector_results: List[RetrievalResult],
+        lexical_results: List[SearchResult]
+    ) -> List[RetrievalResult]:
+        """
+        Reciprocal Rank Fusion
+
+        fusion_score = Σ weight / (RRF_K + rank)，只看排名，不需對齊兩種分數的尺度
+
+        只由 BM25 找到的切片沒有向量相似度，score 以 BM25 分數相對於最高分的比例
+        乘上最高向量相似度估算，使信心度計算仍維持在相同尺度
+        """
+        rrf_k = settings.HYBRID_RRF_K
+        fused: Dict[tuple, RetrievalResult] = {}
+
+        def key_of(result: RetrievalResult) -> tuple:
+            return (result.document_id, result.chunk_index)
+
+        vector_results.sort(key=lambda x: x.score, reverse=True)
+        for rank, result in enumerate(vector_results, 1):
+            result.fusion_score = settings.HYBRID_VECTOR_WEIGHT / (rrf_k + rank)
+            fused[key_of(result)] = result
+
+        if lexical_results:
+            top_vector = vector_results[0].score if vector_results else 1.0
+            top_lexical = lexical_results[0].score or 1.0
+            for rank, sr in enumerate(lexical_results, 1):
+                weight = settings.HYBRID_BM25_WEIGHT / (rrf_k + rank)
+                result = self._to_result(sr, top_vector * sr.score / top_lexical)
+                existing = fused.get(key_of(result))
+                if existing is not None:
+                    existing.fusion_score += weight
+                else:
+                    result.fusion_score = weight
+                    fused[key_of(result)] = result
+
+        logging.debug(
+            f"Hybrid retrieval: {len(vector_results)} vector + {len(lexical_results)} lexical "
+            f"-> {len(fused)} fused"
+        )
+        return sorted(fused.values(), key=lambda x: x.fusion_score, reverse=True)
+
+    async def _expand_parents(self, results: List[RetrievalResult]) -> List[RetrievalResult]:
+        """
+        將子塊換成所屬的父段落
+
+        - 同一父段落只保留一次，位置取其最佳子塊的排名
+        - score / fusion_score 取命中子塊的最高值，chunk_indices 記錄所有命中的子塊
+        - 沒有 parent_index 或找不到父段落的結果保持原樣
+        """
+        keys = [
+            (r.document_id, r.metadata["parent_index"])
+            for r in results if isinstance(r.metadata.get("parent_index"), int)
+        ]
+        if not keys:
+            return results
+
+        parents = await self.parents.get_many(keys)
+        expanded: List[RetrievalResult] = []
+        seen: Dict[tuple, RetrievalResult] = {}
+
+        for r in results:
+            key = (r.document_id, r.metadata.get("parent_index"))
+            parent = parents.get(key)
+            if parent is None:
+                expanded.append(r)
+                continue
+
+            existing = seen.get(key)
+            if existing is not None:
+                existing.chunk_indices.append(r.chunk_index)
+                existing.score = max(existing.score, r.score)
+                existing.fusion_score = max(existing.fusion_score, r.fusion_score)
+                continue
+
+            result = RetrievalResult(
+                content=parent["content"],
+                document_id=r.document_id,
+                document_name=r.document_name,
+                chunk_index=r.chunk_index,
+                score=r.score,
+                metadata={**r.metadata, "start_char": parent["start_char"], "end_char": parent["end_char"]},
+                fusion_score=r.fusion_score,
+                chunk_indices=[r.chunk_index]
+            )
+            seen[key] = result
+            expanded.append(result)
+
+        for result in seen.values():
+            result.chunk_indices.sort()
+        return expanded
+
+    def _merge_adjacent(self, results: List[RetrievalResult]) -> List[RetrievalResult]:
+        """
+        合併同一文件中重疊或相鄰的切片
+
+        - 依 document_id 分組，以 start_char 排序後合併重疊或相鄰的區段
+        - 合併後的段落取區段內最高的 score / fusion_score，chunk_indices 記錄所有切片
+        - 結果依各段落最佳切片的原始排名排序
+        - 缺少 start_char / end_char 的結果保持原樣
+        """
+        rank = {id(r): i for i, r in enumerate(results)}
+        by_document: Dict[int, List[RetrievalResult]] = {}
+        passages: List[tuple] = []  # (最佳排名, 結果)
+
+        for r in results:
+            if isinstance(r.metadata.get("start_char"), int) and isinstance(r.metadata.get("end_char"), int):
+                by_document.setdefault(r.document_id, []).append(r)
+            else:
+                passages.append((rank[id(r)], r))
+
+        for chunks in by_document.values():
+            chunks.sort(key=lambda x: x.metadata["start_char"])
+            span = [chunks[0]]
+            end = chunks[0].metadata["end_char"]
+            for r in chunks[1:]:
+                if r.metadata["start_char"] <= end + self.MERGE_MAX_GAP:
+                    span.append(r)
+                    end = max(end, r.metadata["end_char"])
+                else:
+                    passages.append(self._merge_span(span, rank))
+                    span, end = [r], r.metadata["end_char"]
+            passages.append(self._merge_span(span, rank))
+
+        passages.sort(key=lambda x: x[0])
+        merged = [r for _, r in passages]
+        if len(merged) < len(results):
+            logging.debug(f"Merged {len(results)} retrieved chunks into {len(merged)} passages")
+        return merged
+
+    def _merge_span(self, span: List[RetrievalResult], rank: Dict[int, int]) -> tuple:
+        """將一段連續的切片合併為單一結果，返回 (最佳排名, 結果)"""
+        best = min(span, key=lambda x: rank[id(x)])
+        if len(span) == 1:
+            return rank[id(best)], best
+
+        content = span[0].content
+        end = span[0].metadata["end_char"]
+        for r in span[1:]:
+            start, r_end = r.metadata["start_char"], r.metadata["end_char"]
+            if r_end <= end and r.content in content:
+                continue  # 完全包含於前面的區段
+            content = self._join(content, r.content, end - start)
+            end = max(end, r_end)
+
+        merged = RetrievalResult(
+            content=content,
+            document_id=best.document_id,
+            document_name=best.document_name,
+            chunk_index=span[0].chunk_index,
+            score=max(r.score for r in span),
+            metadata={
+                **best.metadata,
+                "chunk_index": span[0].chunk_index,
+                "start_char": span[0].metadata["start_char"],
+                "end_char": end
+            },
+            fusion_score=max(r.fusion_score for r in span),
+            chunk_indices=sorted({i for r in span for i in (r.chunk_indices or [r.chunk_index])})
+        )
+        return rank[id(best)], merged
+
+    def _join(self, left: str, right: str, overlap: int) -> str:
+        """
+        串接兩段文字並去除重疊部分
+
+        優先使用位移計算出的重疊長度；位移不精確時改以內容比對最長的重疊
+        """
+        if 0 < overlap <= len(right) and left.endswith(right[:overlap]):
+            return left + right[overlap:]
+        for size in range(min(len(left), len(right)), self.MERGE_MIN_OVERLAP - 1, -1):
+            if left.endswith(right[:size]):
+                return left + right[size:]
+        return left + "\n" + right
 
     def _build_filter(
         self,
@@ -140,7 +433,8 @@ class RetrieverService:
         self,
         query: str,
         document_ids: List[int],
-        top_k: int = None
+        top_k: int = None,
+        group_id: Optional[int] = None
     ) -> List[RetrievalResult]:
         """
         在指定文件中檢索
@@ -151,6 +445,7 @@ class RetrieverService:
             query: 查詢文本
             document_ids: 文件 ID 列表
             top_k: 返回數量
+            group_id: 文件所屬群組（分片模式下避免查詢所有分片）
 
         Returns:
             List[RetrievalResult]: 檢索結果列表
@@ -158,7 +453,8 @@ class RetrieverService:
         return await self.retrieve(
             query=query,
             top_k=top_k,
-            document_ids=document_ids
+            document_ids=document_ids,
+            group_id=group_id
         )
 
     async def retrieve_for_group(
@@ -4,11 +4,14 @@
 管理 Chroma 向量資料庫的操作
 """
 
-import httpx
-from typing import List, Optional, Dict, Any
+import asyncio
+import re
+import zlib
+from typing import List, Optional, Dict, Any, Set
 from dataclasses import dataclass
 
 from app.core.config import settings
+from app.core.http_client import http_clients
 
 
 @dataclass
@@ -20,6 +23,41 @@ class SearchResult:
     score: float  # 相似度分數（越高越相似）
 
 
+def extract_field_values(where: Optional[Dict[str, Any]], field: str) -> Optional[Set[Any]]:
+    """
+    從 where 條件中取出某欄位的允許值（僅處理頂層與 $and 中的 $eq / $in）
+
+    Returns:
+        Optional[Set[Any]]: 允許值集合；無法判斷時返回 None（表示不限制）
+    """
+    if not where:
+        return None
+
+    allowed: Optional[Set[Any]] = None
+
+    def intersect(values: Set[Any]):
+        nonlocal allowed
+        allowed = values if allowed is None else allowed & values
+
+    for key, condition in where.items():
+        if key == "$and":
+            for sub in condition:
+                values = extract_field_values(sub, field)
+                if values is not None:
+                    intersect(values)
+        elif key == field:
+            if isinstance(condition, dict):
+                if "$eq" in condition:
+                    intersect({condition["$eq"]})
+                if "$in" in condition:
+                    intersect(set(condition["$in"]))
+            else:
+                intersect({condition})
+
+    return allowed
+
+
+
 class VectorStoreService:
     """
     向量資料庫服務
@@ -28,19 +66,32 @@ class VectorStoreService:
     - 使用 Chroma 作為向量資料庫
     - 支援 HTTP API 模式（獨立部署）
     - 管理 collection 和文件向量
+    - 可選的分片模式：每個群組（或群組雜湊桶）使用獨立 collection，
+      小群組的查詢延遲不受最大群組的資料量影響
+
+    分片路由：
+    - add_documents: 依每筆 metadata 的 group_id 分送
+    - query / delete_by_filter: where 中有 group_id 時只查對應分片，否則查詢所有分片後合併
+    - 無 group_id 的資料保留在主 collection
 
     配置：
     - CHROMA_HOST: Chroma 伺服器地址
     - CHROMA_PORT: Chroma 伺服器埠口
-    - CHROMA_COLLECTION_NAME: 預設 collection 名稱
+    - CHROMA_COLLECTION_NAME: 預設 collection 名稱（分片名稱的前綴）
+    - CHROMA_SHARDING: none（單一 collection）、group（每群組一個）、bucket（雜湊桶）
+    - CHROMA_SHARD_BUCKETS: bucket 模式的桶數
     """
 
+    API_PREFIX = "/api/v2/tenants/default_tenant/databases/default_database"
+
     def __init__(
         self,
         host: str = None,
         port: int = None,
         collection_name: str = None,
-        timeout: float = 30.0
+        timeout: float = 30.0,
+        sharding: str = None,
+        shard_buckets: int = None
     ):
         """
         初始化向量資料庫服務
@@ -50,44 +101,147 @@ class VectorStoreService:
             port: Chroma 伺服器埠口
             collection_name: Collection 名稱
             timeout: 請求超時時間（秒）
+            sharding: 分片模式（none / group / bucket，預設讀取 CHROMA_SHARDING）
+            shard_buckets: bucket 模式的桶數
         """
         self.host = host or settings.CHROMA_HOST
         self.port = port or settings.CHROMA_PORT
         self.collection_name = collection_name or settings.CHROMA_COLLECTION_NAME
         self.timeout = timeout
         self.base_url = f"http://{self.host}:{self.port}"
-        self._collection_id = None
+        self.sharding = (sharding or settings.CHROMA_SHARDING).lower()
+        self.shard_buckets = max(1, shard_buckets or settings.CHROMA_SHARD_BUCKETS)
+        if self.sharding not in ("none", "group", "bucket"):
+            raise ValueError(
+                f"不支援的分片模式: {self.sharding}。支援的選項: none, group, bucket"
+            )
+
+        # collection 名稱 -> ID
+        self._collection_ids: Dict[str, str] = {}
+        self._collection_locks: Dict[str, asyncio.Lock] = {}
+
+    @property
+    def _client(self):
+        """共用的 Chroma 連線池"""
+        return http_clients.get(http_clients.CHROMA)
+
+    @property
+    def _collections_url(self) -> str:
+        return f"{self.base_url}{self.API_PREFIX}/collections"
+
+    # ============================================
+    # 分片路由
+    # ============================================
+
+    @property
+    def is_sharded(self) -> bool:
+        return self.sharding != "none"
+
+    def shard_name(self, group_id: Any) -> str:
+        """
+        取得群組對應的 collection 名稱
+
+        Args:
+            group_id: 群組 ID（None 表示無群組，使用主 collection）
+
+        Returns:
+            str: collection 名稱
+        """
+        if not self.is_sharded or group_id is None:
+            return self.collection_name
+        if self.sharding == "group":
+            return f"{self.collection_name}_g{group_id}"
+        # 使用 crc32 而非 hash()，確保跨行程穩定
+        bucket = zlib.crc32(str(group_id).encode("utf-8")) % self.shard_buckets
+        return f"{self.collection_name}_b{bucket:03d}"
+
+    async def _list_shard_names(self) -> List[str]:
+        """列出伺服器上屬於此服務的所有 collection（主 collection 與分片）"""
+        names: List[str] = []
+        offset, limit = 0, 100
+        while True:
+            response = await self._client.get(
+                self._collections_url,
+                params={"limit": limit, "offset": offset},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            page = response.json()
+            names.extend(c.get("name") for c in page)
+            if len(page) < limit:
+                break
+            offset += limit
+
+        # 只接受 shard_name() 產生的名稱，避免 documents_backup 之類無關的 collection 被併入查詢
+        pattern = re.compile(rf"{re.escape(self.collection_name)}(_(g\d+|b\d{{3,}}))?")
+        return [name for name in names if name and pattern.fullmatch(name)]
+
+    async def _target_collections(self, where: Optional[Dict[str, Any]]) -> List[str]:
+        """依 where 條件決定要查詢的 collection"""
+        if not self.is_sharded:
+            return [self.collection_name]
 
-    async def _ensure_collection(self) -> str:
-        """確保 collection 存在，返回 collection ID"""
-        if self._collection_id:
-            return self._collection_id
+        group_ids = extract_field_values(where, "group_id")
+        if group_ids is not None:
+            return sorted({self.shard_name(g) for g in group_ids})
+
+        return await self._list_shard_names()
+
+    async def _ensure_collection(self, name: str = None, create: bool = True) -> Optional[str]:
+        """
+        確保 collection 存在，返回 collection ID
+
+        Args:
+            name: collection 名稱（預設為主 collection）
+            create: 不存在時是否建立
+
+        Returns:
+            Optional[str]: collection ID；create=False 且不存在時返回 None
+        """
+        name = name or self.collection_name
+        if name in self._collection_ids:
+            return self._collection_ids[name]
+
+        lock = self._collection_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if name in self._collection_ids:
+                return self._collection_ids[name]
+
+            client = self._client
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
             # 嘗試取得現有 collection (使用 v2 API)
             try:
                 response = await client.get(
-                    f"{self.base_url}/api/v2/tenants/default_tenant/databases/default_database/collections/{self.collection_name}"
+                    f"{self._collections_url}/{name}",
+                    timeout=self.timeout
                 )
                 if response.status_code == 200:
                     data = response.json()
-                    self._collection_id = data.get("id")
-                    return self._collection_id
+                    self._collection_ids[name] = data.get("id")
+                    return self._collection_ids[name]
             except Exception:
                 pass
 
+            if not create:
+                return None
+
             # 建立新 collection (使用 v2 API)
             response = await client.post(
-                f"{self.base_url}/api/v2/tenants/default_tenant/databases/default_database/collections",
+                self._collections_url,
                 json={
-                    "name": self.collection_name,
+                    "name": name,
                     "metadata": {"description": "Library RAG documents"}
-                }
+                },
+                timeout=self.timeout
             )
             response.raise_for_status()
             data = response.json()
-            self._collection_id = data.get("id")
-            return self._collection_id
+            self._collection_ids[name] = data.get("id")
+            return self._collection_ids[name]
+
+    def _forget_collection(self, name: str) -> None:
+        """collection 在伺服器上已不存在時清除快取的 ID"""
+        self._collection_ids.pop(name, None)
 
     async def add_documents(
         self,
@@ -108,24 +262,63 @@ class VectorStoreService:
         Returns:
             bool: 是否成功
         """
-        await self._ensure_collection()
+        return await self._write("add", ids, embeddings, documents, metadatas)
 
-        payload = {
-            "ids": ids,
-            "embeddings": embeddings,
-            "documents": documents,
-        }
+    async def upsert_documents(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> bool:
+        """
+        新增或覆寫文件（相同 ID 會被取代，重試時不會產生重複資料）
 
-        if metadatas:
-            payload["metadatas"] = metadatas
+        Args:
+            ids: 文件 ID 列表
+            embeddings: 向量列表
+            documents: 原始文本列表
+            metadatas: 元資料列表
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                f"{self.base_url}/api/v2/tenants/default_tenant/databases/default_database/collections/{self._collection_id}/add",
-                json=payload
+        Returns:
+            bool: 是否成功
+        """
+        return await self._write("upsert", ids, embeddings, documents, metadatas)
+
+    async def _write(
+        self,
+        operation: str,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: Optional[List[Dict[str, Any]]]
+    ) -> bool:
+        """寫入向量（operation 為 add 或 upsert），依分片分送"""
+        # 依分片分組（保持原順序）
+        shards: Dict[str, List[int]] = {}
+        for i in range(len(ids)):
+            group_id = metadatas[i].get("group_id") if metadatas else None
+            shards.setdefault(self.shard_name(group_id), []).append(i)
+
+        for name, indexes in shards.items():
+            collection_id = await self._ensure_collection(name)
+
+            payload = {
+                "ids": [ids[i] for i in indexes],
+                "embeddings": [embeddings[i] for i in indexes],
+                "documents": [documents[i] for i in indexes],
+            }
+
+            if metadatas:
+                payload["metadatas"] = [metadatas[i] for i in indexes]
+
+            response = await self._client.post(
+                f"{self._collections_url}/{collection_id}/{operation}",
+                json=payload,
+                timeout=self.timeout
             )
             response.raise_for_status()
-            return True
+        return True
 
     async def query(
         self,
@@ -146,7 +339,31 @@ class VectorStoreService:
         Returns:
             List[SearchResult]: 搜尋結果列表
         """
-        await self._ensure_collection()
+        names = await self._target_collections(where)
+        if len(names) == 1:
+            return await self._query_collection(names[0], query_embedding, n_results, where, include)
+
+        # 多個分片：並行查詢後依分數合併
+        shard_results = await asyncio.gather(*[
+            self._query_collection(name, query_embedding, n_results, where, include)
+            for name in names
+        ])
+        merged = [r for results in shard_results for r in results]
+        merged.sort(key=lambda r: r.score, reverse=True)
+        return merged[:n_results]
+
+    async def _query_collection(
+        self,
+        name: str,
+        query_embedding: List[float],
+        n_results: int,
+        where: Optional[Dict[str, Any]],
+        include: Optional[List[str]]
+    ) -> List[SearchResult]:
+        """查詢單一 collection（不存在時返回空結果，不會建立）"""
+        collection_id = await self._ensure_collection(name, create=not self.is_sharded)
+        if collection_id is None:
+            return []
 
         payload = {
             "query_embeddings": [query_embedding],
@@ -157,13 +374,16 @@ class VectorStoreService:
         if where:
             payload["where"] = where
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                f"{self.base_url}/api/v2/tenants/default_tenant/databases/default_database/collections/{self._collection_id}/query",
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
+        response = await self._client.post(
+            f"{self._collections_url}/{collection_id}/query",
+            json=payload,
+            timeout=self.timeout
+        )
+        if response.status_code == 404:
+            self._forget_collection(name)
+            return []
+        response.raise_for_status()
+        data = response.json()
 
         # 解析結果
         results = []
@@ -196,15 +416,9 @@ class VectorStoreService:
         Returns:
             bool: 是否成功
         """
-        await self._ensure_collection()
-
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                f"{self.base_url}/api/v2/tenants/default_tenant/databases/default_database/collections/{self._collection_id}/delete",
-                json={"ids": ids}
-            )
-            response.raise_for_status()
-            return True
+        for name in await self._target_collections(None):
+            await self._delete(name, {"ids": ids})
+        return True
 
     async def delete_by_filter(self, where: Dict[str, Any]) -> bool:
         """
@@ -216,38 +430,82 @@ class VectorStoreService:
         Returns:
             bool: 是否成功
         """
-        await self._ensure_collection()
-
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                f"{self.base_url}/api/v2/tenants/default_tenant/databases/default_database/collections/{self._collection_id}/delete",
-                json={"where": where}
-            )
-            response.raise_for_status()
-            return True
+        for name in await self._target_collections(where):
+            await self._delete(name, {"where": where})
+        return True
+
+    async def _delete(self, name: str, payload: Dict[str, Any]) -> None:
+        """在單一 collection 中刪除（不存在時略過）"""
+        collection_id = await self._ensure_collection(name, create=not self.is_sharded)
+        if collection_id is None:
+            return
+
+        response = await self._client.post(
+            f"{self._collections_url}/{collection_id}/delete",
+            json=payload,
+            timeout=self.timeout
+        )
+        if response.status_code == 404:
+            self._forget_collection(name)
+            return
+        response.raise_for_status()
 
     async def count(self) -> int:
-        """取得文件數量"""
-        await self._ensure_collection()
-
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.get(
-                f"{self.base_url}/api/v2/tenants/default_tenant/databases/default_database/collections/{self._collection_id}/count"
+        """取得文件數量（分片模式為所有分片總和）"""
+        names = await self._target_collections(None) if self.is_sharded else [self.collection_name]
+
+        total = 0
+        for name in names:
+            collection_id = await self._ensure_collection(name, create=not self.is_sharded)
+            if collection_id is None:
+                continue
+            response = await self._client.get(
+                f"{self._collections_url}/{collection_id}/count",
+                timeout=self.timeout
             )
             response.raise_for_status()
-            return response.json()
+            total += response.json()
+        return total
 
     async def health_check(self) -> bool:
         """健康檢查"""
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(
-                    f"{self.base_url}/api/v2/heartbeat"
-                )
-                return response.status_code == 200
+            response = await self._client.get(
+                f"{self.base_url}/api/v2/heartbeat",
+                timeout=5.0
+            )
+            return response.status_code == 200
         except Exception:
             return False
 
 
+def create_vectorstore_service(backend: str = None, **kwargs):
+    """
+    依設定建立向量資料庫服務
+
+    Args:
+        backend: 後端名稱（"chroma" 或 "numpy"，預設讀取 VECTOR_STORE_BACKEND）
+        **kwargs: 額外參數傳遞給服務
+
+    Returns:
+        VectorStoreService 或 NumpyVectorStore（兩者介面相同）
+
+    Raises:
+        ValueError: 不支援的後端
+    """
+    backend = (backend or settings.VECTOR_STORE_BACKEND).lower()
+
+    if backend == "chroma":
+        return VectorStoreService(**kwargs)
+    elif backend == "numpy":
+        from app.services.rag.numpy_store import NumpyVectorStore
+        return NumpyVectorStore(**kwargs)
+    else:
+        raise ValueError(
+            f"不支援的向量資料庫後端: {backend}。"
+            f"支援的選項: chroma, numpy"
+        )
+
+
 # 單例實例
-vectorstore_service = VectorStoreService()
+vectorstore_service = create_vectorstore_service()
@@ -0,0 +1,98 @@
+"""
+獨立文件入庫 worker
+
+在 API 行程之外處理 ingestion_jobs 佇列，數量可與 uvicorn worker 分開調整
+
+使用方式（於 backend 目錄，API 端設定 INGEST_WORKERS_ENABLED=false）：
+    python -m app.worker
+    python -m app.worker --concurrency 4 --cpu-workers 4
+
+業務邏輯：
+- 解析 + 分塊（CPU 密集）送入 ProcessPoolExecutor，不受 GIL 限制
+- 向量化與寫入向量庫（I/O 密集）維持在事件迴圈中以 async 執行
+- 啟動時復原中斷的文件處理；收到 SIGTERM / SIGINT 時停止取得新工作，
+  等待進行中的工作完成（逾時者交還佇列）後結束
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from app.core.config import settings
+from app.core.database import close_db
+from app.core.http_client import http_clients
+from app.services.document.ingestion_worker import IngestionWorkerPool
+from app.services.document.job_queue import ingestion_queue
+from app.services.document.processor import processor
+
+
+async def run(concurrency: int, cpu_workers: int, shutdown_timeout: float) -> None:
+    """
+    執行 worker 直到收到結束訊號
+
+    Args:
+        concurrency: 同時處理的文件數
+        cpu_workers: 解析 + 分塊的子行程數（0 = 使用執行緒）
+        shutdown_timeout: 結束時等待進行中工作的秒數
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    # spawn：子行程不繼承事件迴圈與執行緒狀態
+    executor: Optional[ProcessPoolExecutor] = None
+    if cpu_workers > 0:
+        executor = ProcessPoolExecutor(
+            max_workers=cpu_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        processor.cpu_executor = executor
+
+    await http_clients.startup()
+    pool = IngestionWorkerPool(processor=processor, concurrency=concurrency)
+    try:
+        try:
+            await ingestion_queue.recover()
+        except Exception as e:
+            logging.error(f"Failed to recover unfinished documents: {e}")
+        await pool.start()
+        logging.info(f"Ingestion worker running: concurrency={pool.concurrency}, cpu_workers={cpu_workers}")
+
+        await stop.wait()
+        logging.info("Shutdown signal received, stopping ingestion worker")
+    finally:
+        await pool.stop(timeout=shutdown_timeout)
+        if executor is not None:
+            processor.cpu_executor = None
+            executor.shutdown(wait=True, cancel_futures=True)
+        await http_clients.close()
+        await close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文件入庫 worker")
+    parser.add_argument(
+        "--concurrency", type=int, default=settings.INGEST_CONCURRENCY,
+        help="同時處理的文件數（預設 INGEST_CONCURRENCY）"
+    )
+    parser.add_argument(
+        "--cpu-workers", type=int, default=settings.INGEST_CPU_WORKERS,
+        help="解析 + 分塊的子行程數，0 = 使用執行緒（預設 INGEST_CPU_WORKERS）"
+    )
+    parser.add_argument(
+        "--shutdown-timeout", type=float, default=30.0,
+        help="結束時等待進行中工作的秒數"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(run(args.concurrency, args.cpu_workers, args.shutdown_timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+兩階段檢索基準測試
+
+比較精確搜尋（flat，掃描群組內所有切片）與文件中心向量剪枝（先挑前 M 份文件，再只掃描其切片）
+在不同 M 下的召回率與查詢延遲
+
+使用方式（於 backend 目錄）：
+    python -m benchmarks.centroid_pruning_benchmark --documents 5000 --chunks 20 --dim 768
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from app.services.rag.document_index import CentroidAccumulator, DocumentCentroidIndex  # noqa: E402
+from app.services.rag.retrieval_cache import IndexVersionRegistry  # noqa: E402
+
+
+def make_corpus(documents: int, chunks: int, dim: int, topics: int, seed: int):
+    """
+    產生帶主題結構的合成文件（近似真實文件庫：同主題文件相近，文件內切片圍繞文件主旨）
+
+    Returns:
+        (切片向量 (n, dim), 每個切片所屬的文件 ID, 每份文件的切片列範圍)
+    """
+    rng = np.random.default_rng(seed)
+    topic_centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    doc_topics = rng.integers(0, topics, size=documents)
+    doc_centers = topic_centers[doc_topics] + 0.5 * rng.standard_normal((documents, dim)).astype(np.float32)
+
+    sizes = rng.integers(max(1, chunks // 2), chunks * 3 // 2 + 1, size=documents)
+    owners = np.repeat(np.arange(documents), sizes)
+    vectors = doc_centers[owners] + 0.8 * rng.standard_normal((len(owners), dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    ranges = [(int(offsets[i]), int(offsets[i + 1])) for i in range(documents)]
+    return vectors, owners, ranges
+
+
+def make_queries(vectors: np.ndarray, count: int, dim: int, noise: float, seed: int) -> np.ndarray:
+    """
+    以隨機切片加上雜訊作為查詢（問題與某段文件內容相近，但不完全相同）
+
+    noise 為雜訊向量與切片向量的長度比例
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), size=count, replace=False)
+    queries = vectors[rows] + noise / np.sqrt(dim) * rng.standard_normal((count, dim)).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def top_k(vectors: np.ndarray, rows: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = vectors[rows] @ query if rows is not None else vectors @ query
+    kk = min(k, len(scores))
+    top = np.argpartition(-scores, kk - 1)[:kk]
+    top = top[np.argsort(-scores[top])]
+    return rows[top] if rows is not None else top
+
+
+def percentile_ms(samples, q: float) -> float:
+    return float(np.percentile(samples, q) * 1000)
+
+
+async def run(args):
+    print(f"Generating {args.documents} documents (~{args.chunks} chunks each) x {args.dim} dims ...")
+    vectors, owners, ranges = make_corpus(args.documents, args.chunks, args.dim, args.topics, args.seed)
+    queries = make_queries(vectors, args.queries, args.dim, args.query_noise, args.seed + 1)
+    print(f"{len(vectors)} chunks total\n")
+
+    workdir = tempfile.mkdtemp(prefix="centroid_benchmark_")
+    index = DocumentCentroidIndex(
+        path=os.path.join(workdir, "centroids.sqlite3"),
+        versions=IndexVersionRegistry(os.path.join(workdir, "versions.sqlite3"))
+    )
+    started = time.perf_counter()
+    for document_id, (start, end) in enumerate(ranges):
+        accumulator = CentroidAccumulator(n_centroids=args.centroids)
+        accumulator.add(vectors[start:end])
+        index._put_document_sync(document_id, 1, accumulator.centroids())
+    print(f"Stored centroids in {time.perf_counter() - started:.2f}s")
+    await index.top_documents(1, queries[0], top_m=1)  # 預先載入群組矩陣
+    print()
+
+    # 精確搜尋（基準）
+    truth, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        truth.append(set(top_k(vectors, None, query, args.k).tolist()))
+        latencies.append(time.perf_counter() - started)
+
+    print(f"{'method':<14}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p95 ms':>10}{'scanned':>10}")
+    print(f"{'flat':<14}{1.0:>10.3f}{percentile_ms(latencies, 50):>10.2f}"
+          f"{percentile_ms(latencies, 95):>10.2f}{1.0:>10.1%}")
+
+    for top_m in args.top_m:
+        hits, latencies, scanned = 0, [], 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            documents = await index.top_documents(1, query, top_m=top_m)
+            rows = np.concatenate([np.arange(*ranges[d]) for d in documents])
+            result = top_k(vectors, rows, query, args.k)
+            latencies.append(time.perf_counter() - started)
+            hits += len(expected & set(result.tolist()))
+            scanned += len(rows)
+
+        print(f"{'M=' + str(top_m):<14}{hits / (len(queries) * args.k):>10.3f}"
+              f"{percentile_ms(latencies, 50):>10.2f}{percentile_ms(latencies, 95):>10.2f}"
+              f"{scanned / (len(queries) * len(vectors)):>10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Document centroid pruning vs flat search benchmark")
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=300)
+    parser.add_argument("--centroids", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-noise", type=float, default=1.0)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--top-m", type=int, nargs="+", default=[10, 25, 50, 100, 200])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
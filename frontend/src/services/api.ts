@@ -34,4 +34,71 @@ api.interceptors.response.use(
     }
 )
 
+/**
+ * 以 POST 發送請求並解析 Server-Sent Events 串流
+ *
+ * EventSource 只支援 GET 且無法帶 Authorization 標頭，因此改用 fetch + ReadableStream
+ * 每收到一個完整事件就呼叫 onEvent(event, data)
+ */
+export const postEventStream = async (
+    url: string,
+    body: unknown,
+    onEvent: (event: string, data: any) => void,
+    signal?: AbortSignal
+): Promise<void> => {
+    const headers: Record<string, string> = {
+        'Content-Type': 'application/json',
+        Accept: 'text/event-stream'
+    }
+    const token = localStorage.getItem('token')
+    if (token) {
+        headers.Authorization = `Bearer ${token}`
+    }
+
+    const response = await fetch(url, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify(body),
+        signal
+    })
+
+    if (response.status === 401) {
+        localStorage.removeItem('token')
+        window.location.href = '/login'
+        return
+    }
+    if (!response.ok || !response.body) {
+        const detail = await response.json().catch(() => null)
+        throw new Error(detail?.detail || `HTTP ${response.status}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+
+    while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        // 事件以空行分隔
+        let boundary = buffer.indexOf('\n\n')
+        while (boundary !== -1) {
+            const raw = buffer.slice(0, boundary)
+            buffer = buffer.slice(boundary + 2)
+            boundary = buffer.indexOf('\n\n')
+
+            let event = 'message'
+            const dataLines: string[] = []
+            for (const line of raw.split('\n')) {
+                if (line.startsWith('event:')) event = line.slice(6).trim()
+                else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim())
+            }
+            if (dataLines.length) {
+                onEvent(event, JSON.parse(dataLines.join('\n')))
+            }
+        }
+    }
+}
+
 export default api
@@ -1,6 +1,6 @@
 import { defineStore } from 'pinia'
 import { ref, computed } from 'vue'
-import api from '@/services/api'
+import api, { postEventStream } from '@/services/api'
 import logger from '@/utils/logger'
 
 interface Group {
@@ -54,6 +54,8 @@ export const useChatStore = defineStore('chat', () => {
     const messages = ref<Message[]>([])
     const isLoading = ref(false)
     const isSending = ref(false)
+    // 進行中的串流請求（中止時後端會取消生成並保存部分內容）
+    let sendController: AbortController | null = null
 
     // 載入群組
     const fetchGroups = async () => {
@@ -133,25 +135,49 @@ export const useChatStore = defineStore('chat', () => {
         }
         messages.value.push(userMessage)
 
+        // 助手訊息先以空內容加入，隨串流逐步填入
+        messages.value.push({
+            id: Date.now() + 1,
+            role: 'assistant',
+            content: '',
+            created_at: new Date().toISOString()
+        })
+        // 取得響應式代理，後續修改才會觸發畫面更新
+        const assistantMessage = messages.value[messages.value.length - 1]
+
+        sendController = new AbortController()
+
         try {
-            const response = await api.post('/api/chat/ask', {
+            let streamError: string | null = null
+
+            await postEventStream('/api/chat/ask/stream', {
                 question,
                 group_id: currentGroupId.value,
                 conversation_id: currentConversationId.value
-            })
-
-            const data = response.data
-            currentConversationId.value = data.conversation_id
-
-            // 添加助手回覆
-            const assistantMessage: Message = {
-                id: data.message_id,
-                role: 'assistant',
-                content: data.answer,
-                sources: data.sources,
-                created_at: new Date().toISOString()
+            }, (event, data) => {
+                switch (event) {
+                    case 'meta':
+                        currentConversationId.value = data.conversation_id
+                        break
+                    case 'sources':
+                        assistantMessage.sources = data.sources
+                        break
+                    case 'delta':
+                        assistantMessage.content += data.content
+                        break
+                    case 'done':
+                        assistantMessage.id = data.message_id
+                        logger.log('Stream finished:', data.generation_time, 's, first token:', data.time_to_first_token, 's, prefill:', data.prefill_time, 's, prompt cache:', data.prompt_cache_ratio)
+                        break
+                    case 'error':
+                        streamError = data.detail
+                        break
+                }
+            }, sendController.signal)
+
+            if (streamError) {
+                throw new Error(streamError)
             }
-            messages.value.push(assistantMessage)
 
             logger.log('Message sent successfully')
 
@@ -160,22 +186,34 @@ export const useChatStore = defineStore('chat', () => {
 
             return true
         } catch (error: any) {
+            if (error.name === 'AbortError') {
+                logger.log('Message generation cancelled')
+                assistantMessage.content = assistantMessage.content
+                    ? `${assistantMessage.content}\n\n（已停止生成）`
+                    : '（已停止生成）'
+                return false
+            }
+
             logger.error('Failed to send message:', error)
 
-            // 添加錯誤訊息
-            messages.value.push({
-                id: Date.now(),
-                role: 'assistant',
-                content: error.response?.data?.detail || '抱歉，處理您的問題時發生錯誤。請稍後再試。',
-                created_at: new Date().toISOString()
-            })
+            // 顯示錯誤訊息（保留已收到的部分內容）
+            const errorText = error.message || '抱歉，處理您的問題時發生錯誤。請稍後再試。'
+            assistantMessage.content = assistantMessage.content
+                ? `${assistantMessage.content}\n\n（${errorText}）`
+                : errorText
 
             return false
         } finally {
+            sendController = null
             isSending.value = false
         }
     }
 
+    // 停止生成（中斷串流連線）
+    const cancelSending = () => {
+        sendController?.abort()
+    }
+
     // 建立新對話
     const createNewConversation = () => {
         currentConversationId.value = null
@@ -222,6 +260,7 @@ export const useChatStore = defineStore('chat', () => {
         isLoading,
         isSending,
         fetchMessages,
-        sendMessage
+        sendMessage,
+        cancelSending
     }
 })